@@ -0,0 +1,594 @@
+"""
+A small pure-Python client for the ADB server's host protocol (normally on
+127.0.0.1:5037), so that device queries don't need to fork the adb binary.
+
+The protocol is simple: each request is a 4-digit hex length followed by the
+request string, answered with OKAY or FAIL (followed by a hex-length-prefixed
+error message). Device services (shell:, etc) are reached by first switching
+the connection to a device transport with host:transport:<serial>.
+
+For frequent small commands (input events, queries), each device also has one
+persistent shell (AdbShell), which runs every command over the same connection.
+"""
+
+import itertools
+import os
+import re
+import socket
+import struct
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+ADB_SERVER_HOST = '127.0.0.1'
+ADB_SERVER_PORT = int(os.environ.get('ANDROID_ADB_SERVER_PORT', 5037))
+
+
+class AdbError(Exception):
+    pass
+
+
+class AdbConnection:
+    def __init__(self, sock):
+        self.sock = sock
+
+    def set_timeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def read_exactly(self, length):
+        data = bytearray()
+        while len(data) < length:
+            chunk = self.sock.recv(length - len(data))
+            if not chunk:
+                raise AdbError("ADB server closed the connection unexpectedly")
+            data += chunk
+        return bytes(data)
+
+    def read_hex_string(self):
+        length = int(self.read_exactly(4), 16)
+        return self.read_exactly(length).decode('utf-8', errors='replace')
+
+    def read_all(self):
+        chunks = []
+        while True:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def send(self, request):
+        """
+        Sends a request, and raises an AdbError if the server rejects it.
+        """
+        payload = request.encode('utf-8')
+        self.sock.sendall(b'%04x' % len(payload) + payload)
+
+        status = self.read_exactly(4)
+        if status == b'OKAY':
+            return
+        elif status == b'FAIL':
+            raise AdbError(f"{request} failed: {self.read_hex_string()}")
+        else:
+            raise AdbError(f"{request} failed: unexpected response {status!r}")
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse_devices(device_list):
+    """
+    Parses a host:devices style device list into a dict of serial -> state.
+    """
+    devices = {}
+    for line in device_list.splitlines():
+        serial, _, state = line.partition('\t')
+        if serial:
+            devices[serial] = state.strip()
+    return devices
+
+
+class AdbClient:
+    def __init__(self, adb_path=None, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT, timeout=10):
+        # If adb_path is set, the server is started automatically if it isn't running
+        self.adb_path = adb_path
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def connect(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout)
+        except ConnectionRefusedError:
+            if not self.adb_path:
+                raise AdbError(f"No ADB server running on {self.host}:{self.port}") from None
+            subprocess.run([self.adb_path, 'start-server'], capture_output=True)
+            sock = socket.create_connection((self.host, self.port), timeout)
+        return AdbConnection(sock)
+
+    def devices(self):
+        with self.connect() as connection:
+            connection.send('host:devices')
+            return parse_devices(connection.read_hex_string())
+
+    def track_devices(self, timeout=None):
+        """
+        Yields the full device list (serial -> state) immediately and then again on every
+        change, over a single long-lived connection. Raises socket.timeout if no change
+        happens within timeout.
+        """
+        with self.connect() as connection:
+            connection.send('host:track-devices')
+            connection.set_timeout(timeout)
+            while True:
+                yield parse_devices(connection.read_hex_string())
+
+    def transport(self, serial=None, timeout=None):
+        """
+        Returns a connection switched to the given device (or the only device, if
+        serial is None), ready to open a device service.
+        """
+        connection = self.connect(timeout)
+        try:
+            connection.send(f'host:transport:{serial}' if serial else 'host:transport-any')
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    def shell(self, serial, command, timeout=None):
+        """
+        Runs a shell command on the device, returning its combined output.
+        """
+        with self.transport(serial, timeout) as connection:
+            connection.send(f'shell:{command}')
+            return connection.read_all().decode('utf-8', errors='replace')
+
+
+
+class AdbConnectionPool:
+    """
+    Keeps connections per device serial that are already switched to that device's
+    transport, so each command skips connecting & the transport round trip.
+
+    ADB consumes a connection with each service it opens (shell:, exec:, etc), so
+    connections can't be reused afterwards. Instead, each one taken is replaced in
+    the background, ready for the next command.
+    """
+
+    def __init__(self, client=None, max_idle=2):
+        self.client = client or AdbClient()
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._refills = ThreadPoolExecutor(max_workers=1, thread_name_prefix='adb-pool')
+        self._shells = {}
+        self._shells_lock = threading.Lock()
+
+    def _refill(self, serial):
+        try:
+            connection = self.client.transport(serial)
+        except (AdbError, OSError):
+            return  # Device gone, most likely: the next acquire will connect & report it
+
+        with self._lock:
+            idle = self._idle.setdefault(serial, deque())
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def open_service(self, serial, service, timeout=None):
+        """
+        Opens a device service, returning the connection to read its output from.
+        """
+        with self._lock:
+            idle = self._idle.setdefault(serial, deque())
+            connection = idle.popleft() if idle else None
+            needs_refill = len(idle) < self.max_idle
+        if needs_refill:
+            self._refills.submit(self._refill, serial)
+
+        if connection is not None:
+            connection.set_timeout(timeout if timeout is not None else self.client.timeout)
+            try:
+                connection.send(service)
+                return connection
+            except (AdbError, OSError):
+                # Pooled connections go stale if the device disconnects or the server
+                # restarts. Retry once on a fresh connection, to get a real error if so.
+                connection.close()
+
+        connection = self.client.transport(serial, timeout)
+        try:
+            connection.send(service)
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    def persistent_shell(self, serial):
+        """
+        Returns the device's persistent shell, opening it (again, if it has closed) if needed.
+        """
+        with self._shells_lock:
+            shell = self._shells.get(serial)
+            if shell is None or shell.closed:
+                shell = self._shells[serial] = AdbShell(self.open_service(serial, 'exec:sh'))
+            return shell
+
+    def device(self, serial):
+        return AdbDevice(self, serial)
+
+    def close(self):
+        with self._shells_lock:
+            for shell in self._shells.values():
+                shell.close()
+            self._shells.clear()
+        self._refills.shutdown(wait=True)
+        with self._lock:
+            for idle in self._idle.values():
+                for connection in idle:
+                    connection.close()
+            self._idle.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+SYNC_CHUNK_SIZE = 64 * 1024
+
+
+class AdbDevice:
+    """
+    Commands for a single device, run over its pooled connections.
+    """
+
+    def __init__(self, pool, serial):
+        self.pool = pool
+        self.serial = serial
+
+    def shell(self, command, timeout=None):
+        """
+        Runs a shell command on the device, returning its combined output.
+        """
+        with self.pool.open_service(self.serial, f'shell:{command}', timeout) as connection:
+            return connection.read_all().decode('utf-8', errors='replace')
+
+    def tap(self, x, y):
+        self.pool.persistent_shell(self.serial).run(f'input tap {x} {y}', check=True)
+
+    def taps(self, points, interval=0):
+        """
+        Taps each (x, y) point in turn, as raw touchscreen events sent in a single batch.
+        """
+        self.pool.persistent_shell(self.serial).taps(points, interval)
+
+    def keyevent(self, keycode):
+        self.pool.persistent_shell(self.serial).run(f'input keyevent {keycode}', check=True)
+
+    def start_app(self, package):
+        self.shell(f'monkey -p {package} 1')
+
+    def install(self, apk_path, *options, timeout=300):
+        """
+        Installs an APK by streaming it straight into the package manager (as
+        'adb install' does on Android 7+), with no intermediate copy on the device.
+        """
+        size = os.path.getsize(apk_path)
+        command = ' '.join(['cmd package install', *options, '-S', str(size)])
+        with self.pool.open_service(self.serial, f'exec:{command}', timeout) as connection:
+            with open(apk_path, 'rb') as apk:
+                for chunk in iter(lambda: apk.read(SYNC_CHUNK_SIZE), b''):
+                    connection.sock.sendall(chunk)
+            output = connection.read_all().decode('utf-8', errors='replace').strip()
+
+        if 'Success' not in output:
+            raise AdbError(f"Installing {apk_path} failed: {output}")
+
+    def push(self, local_path, remote_path, mode=0o644, timeout=300):
+        """
+        Copies a file to the device using the sync protocol.
+        """
+        with self.pool.open_service(self.serial, 'sync:', timeout) as connection:
+            path_and_mode = f'{remote_path},{mode}'.encode('utf-8')
+            connection.sock.sendall(b'SEND' + struct.pack('<I', len(path_and_mode)) + path_and_mode)
+
+            with open(local_path, 'rb') as source:
+                for chunk in iter(lambda: source.read(SYNC_CHUNK_SIZE), b''):
+                    connection.sock.sendall(b'DATA' + struct.pack('<I', len(chunk)) + chunk)
+            mtime = int(os.path.getmtime(local_path))
+            connection.sock.sendall(b'DONE' + struct.pack('<I', mtime))
+
+            status = connection.read_exactly(4)
+            length = struct.unpack('<I', connection.read_exactly(4))[0]
+            if status != b'OKAY':
+                message = connection.read_exactly(length).decode('utf-8', errors='replace')
+                raise AdbError(f"Pushing {local_path} to {remote_path} failed: {message}")
+
+    def forward(self, local, remote):
+        """
+        Forwards a host socket (e.g. 'tcp:8000') to a device socket. Returns the
+        host port allocated, if local is 'tcp:0'.
+        """
+        with self.pool.client.connect() as connection:
+            connection.send(f'host-serial:{self.serial}:forward:{local};{remote}')
+            return self._read_port_result(connection, local)
+
+    def remove_forward(self, local):
+        with self.pool.client.connect() as connection:
+            connection.send(f'host-serial:{self.serial}:killforward:{local}')
+
+    def reverse(self, remote, local):
+        """
+        Forwards a device socket (e.g. 'tcp:8000') to a host socket. Returns the
+        device port allocated, if remote is 'tcp:0'.
+        """
+        with self.pool.open_service(self.serial, f'reverse:forward:{remote};{local}') as connection:
+            return self._read_port_result(connection, remote)
+
+    def remove_reverse(self, remote):
+        with self.pool.open_service(self.serial, f'reverse:killforward:{remote}') as connection:
+            connection.read_exactly(4)
+
+    @staticmethod
+    def _read_port_result(connection, requested):
+        # Forwarding replies with a second status, once the forward is actually set up:
+        status = connection.read_exactly(4)
+        if status != b'OKAY':
+            raise AdbError(f"Forwarding {requested} failed: {connection.read_hex_string()}")
+        if requested == 'tcp:0':
+            return int(connection.read_hex_string())
+        return None
+
+
+
+class AdbShell:
+    """
+    One long-lived shell on a device, for running many small commands without the
+    cost of a new connection & shell (or an adb process) for each.
+
+    Commands are written to the shell's stdin, each followed by a sentinel line with
+    a per-session token, the command's sequence number and its exit status, which
+    delimits its output in the stream. Responses arrive in order, so commands from
+    any number of threads can be pipelined: each is sent as soon as it's submitted,
+    and a reader thread resolves each one's future as its sentinel arrives.
+
+    Each command must be a complete shell command, and runs in its own subshell (so
+    'exit' or 'cd' don't affect the session). Its stdin is /dev/null (the shell's
+    stdin is the command stream), and its stderr is merged into its output.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.connection.set_timeout(None) # Idle between commands, for as long as it's open
+        self._token = f'HTK_SHELL_{os.urandom(8).hex()}'
+        self._sequence = itertools.count()
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._touchscreen = None
+        self._tracking_ids = itertools.count()
+
+        threading.Thread(target=self._read_responses, name='adb-shell', daemon=True).start()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def submit(self, command):
+        """
+        Sends a command, returning a future for its (output, exit status).
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise AdbError("Shell is closed")
+            sequence = next(self._sequence)
+            self._pending.append((sequence, future))
+            # The sentinel follows a newline, so output without a trailing newline is still delimited:
+            frame = f'( {command}\n) </dev/null 2>&1; printf "\\n%s %d %d\\n" {self._token} {sequence} $?\n'
+            try:
+                self.connection.sock.sendall(frame.encode('utf-8'))
+            except OSError as e:
+                error = e
+            else:
+                return future
+        self._fail(AdbError(f"Shell failed: {error}"))
+        return future
+
+    def run(self, command, timeout=None, check=False):
+        """
+        Runs a command, returning its output. If check is set, raises an AdbError if it fails.
+        """
+        try:
+            output, status = self.submit(command).result(timeout)
+        except FutureTimeoutError:
+            # The shell is still busy with the command, so everything queued behind it would
+            # be late too. Closing it means the next command gets a fresh shell instead.
+            self.close()
+            raise AdbError(f"{command} timed out after {timeout}s") from None
+
+        if check and status != 0:
+            raise AdbError(f"{command} failed with status {status}: {output.strip()}")
+        return output
+
+    def _read_responses(self):
+        marker = f'\n{self._token} '.encode('utf-8')
+        buffer = bytearray()
+        searched = 0 # Everything before this has been checked for a sentinel already
+        try:
+            while True:
+                chunk = self.connection.sock.recv(65536)
+                if not chunk:
+                    raise AdbError("Shell closed by the device")
+                buffer += chunk
+
+                while True:
+                    start = buffer.find(marker, searched)
+                    end = buffer.find(b'\n', start + len(marker)) if start != -1 else -1
+                    if end == -1:
+                        searched = max(0, len(buffer) - len(marker)) if start == -1 else start
+                        break
+
+                    sequence, status = map(int, buffer[start + len(marker):end].split())
+                    output = buffer[:start].decode('utf-8', errors='replace')
+                    del buffer[:end + 1]
+                    searched = 0
+
+                    with self._lock:
+                        expected, future = self._pending.popleft()
+                    if sequence != expected:
+                        raise AdbError(f"Shell response out of order: expected {expected}, got {sequence}")
+                    if future.set_running_or_notify_cancel():
+                        future.set_result((output, status))
+        except (AdbError, OSError, ValueError, IndexError) as e:
+            self._fail(e if isinstance(e, AdbError) else AdbError(f"Shell failed: {e}"))
+
+    def _fail(self, error):
+        with self._lock:
+            self._closed = True
+            pending, self._pending = self._pending, deque()
+        try:
+            # Unblocks the reader thread, which close() alone doesn't do
+            self.connection.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+        for _, future in pending:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def close(self):
+        self._fail(AdbError("Shell is closed"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def touchscreen(self):
+        if self._touchscreen is None:
+            self._touchscreen = Touchscreen.find(self)
+        return self._touchscreen
+
+    def taps(self, points, interval=0):
+        """
+        Taps each (x, y) point (in the same display coordinates as 'input tap') by
+        writing the touch events straight to the touchscreen with sendevent. That
+        skips starting the input command's JVM, which otherwise costs far more than
+        the tap itself, and sends every tap as a single command. If an interval is
+        given, the device waits that many seconds between taps.
+        """
+        touchscreen = self.touchscreen()
+        commands = []
+        for x, y in points:
+            if commands and interval:
+                commands.append(f'sleep {interval}')
+            commands.extend(touchscreen.sendevent_commands(touchscreen.tap_events(x, y, next(self._tracking_ids))))
+        if commands:
+            self.run(' && '.join(commands), check=True)
+
+
+# Input event types & codes, from linux/input-event-codes.h:
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+SYN_REPORT = 0x00
+BTN_TOUCH = 0x14a
+ABS_MT_SLOT = 0x2f
+ABS_MT_POSITION_X = 0x35
+ABS_MT_POSITION_Y = 0x36
+ABS_MT_TRACKING_ID = 0x39
+
+# Device headers & axis ranges, as listed by 'getevent -p':
+_INPUT_DEVICE_PATTERN = re.compile(r'^add device \d+: (\S+)')
+_AXIS_RANGE_PATTERN = re.compile(r'\b([0-9a-f]{4})\s+: value -?\d+, min (-?\d+), max (-?\d+)')
+_DISPLAY_SIZE_PATTERN = re.compile(r'(Physical|Override) size: (\d+)x(\d+)')
+
+
+class Touchscreen:
+    """
+    A multi-touch input device (using the type B, slotted protocol), with its axis ranges
+    and the display size that they're scaled to.
+    """
+
+    def __init__(self, path, x_range, y_range, display_size):
+        self.path = path
+        self.x_range = x_range
+        self.y_range = y_range
+        self.display_size = display_size
+
+    @classmethod
+    def find(cls, shell):
+        """
+        Finds the device's touchscreen: the first input device with multi-touch position axes.
+        Assumes the display is in its natural orientation.
+        """
+        devices = {}
+        path = None
+        for line in shell.run('getevent -p', check=True).splitlines():
+            device_match = _INPUT_DEVICE_PATTERN.match(line)
+            if device_match:
+                path = device_match.group(1)
+                devices[path] = {}
+                continue
+            range_match = _AXIS_RANGE_PATTERN.search(line)
+            if range_match and path:
+                code, minimum, maximum = range_match.groups()
+                devices[path][int(code, 16)] = (int(minimum), int(maximum))
+
+        # An override size (set with 'wm size') takes precedence, as for 'input tap':
+        sizes = dict(
+            (kind, (int(width), int(height)))
+            for kind, width, height in _DISPLAY_SIZE_PATTERN.findall(shell.run('wm size', check=True))
+        )
+        display_size = sizes.get('Override') or sizes.get('Physical')
+        if display_size is None:
+            raise AdbError("Couldn't read the display size")
+
+        for path, axes in devices.items():
+            if ABS_MT_POSITION_X in axes and ABS_MT_POSITION_Y in axes:
+                return cls(path, axes[ABS_MT_POSITION_X], axes[ABS_MT_POSITION_Y], display_size)
+        raise AdbError("No multi-touch input device found")
+
+    @staticmethod
+    def _scale(position, axis_range, size):
+        minimum, maximum = axis_range
+        value = minimum + round(position * (maximum - minimum) / max(size - 1, 1))
+        return min(max(value, minimum), maximum)
+
+    def tap_events(self, x, y, tracking_id):
+        """
+        Returns the (type, code, value) events for touching the given display position and releasing it.
+        """
+        width, height = self.display_size
+        return [
+            (EV_ABS, ABS_MT_SLOT, 0),
+            (EV_ABS, ABS_MT_TRACKING_ID, tracking_id),
+            (EV_KEY, BTN_TOUCH, 1),
+            (EV_ABS, ABS_MT_POSITION_X, self._scale(x, self.x_range, width)),
+            (EV_ABS, ABS_MT_POSITION_Y, self._scale(y, self.y_range, height)),
+            (EV_SYN, SYN_REPORT, 0),
+            (EV_ABS, ABS_MT_TRACKING_ID, -1),
+            (EV_KEY, BTN_TOUCH, 0),
+            (EV_SYN, SYN_REPORT, 0)
+        ]
+
+    def sendevent_commands(self, events):
+        return [f'sendevent {self.path} {event_type} {code} {value}' for event_type, code, value in events]
@@ -0,0 +1,314 @@
+"""
+Installs APKs on a device only when needed, streaming them in a single install session.
+
+Before installing, the package's current install is compared to the local APK
+files. If 'pm path' lists the same files (with the same size & mtime) as when
+they were last installed or verified on that device, the install is skipped
+straight away. Otherwise the installed files are hashed on the device, and the
+install is still skipped if they match. That per-device state is kept in a JSON
+file, along with the local APKs' hashes (keyed by size & mtime), so neither side
+is hashed again while nothing changes.
+
+Installs use the package manager's session commands: one session is created,
+each APK (the base & any splits) is streamed into it straight from the local
+file, and then it's committed. Each stage is retried on its own, so a dropped
+connection while streaming one split only resends that split.
+
+Incremental installs (Android 11+, with an .idsig signature next to each APK) need
+adb's own data server, so they're run with 'adb install --incremental', falling
+back to a streamed install if the device or adb doesn't support them.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shlex
+import subprocess
+import time
+
+from adb_client import SYNC_CHUNK_SIZE, AdbError
+from run_trace import RunTrace
+
+INSTALL_STATE = 'apk-install-state.json'
+
+STAGE_RETRIES = 3
+RETRY_DELAY = 1
+
+INCREMENTAL_MIN_SDK = 30
+
+_SESSION_ID_PATTERN = re.compile(r'\[(\d+)\]')
+
+
+class ApkInstallError(AdbError):
+    """
+    The package manager rejected the install, so retrying won't help.
+    """
+
+
+def _check_pm_output(output, description):
+    output = output.strip()
+    if output.startswith('Success'):
+        return output
+    if output.startswith('Failure'):
+        raise ApkInstallError(f"{description} failed: {output}")
+    # Anything else (e.g. the package service not being up yet) might be transient
+    raise AdbError(f"{description} failed: {output}")
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InstallState:
+    """
+    What's installed where, as last seen by this machine: for each device serial & package,
+    the installed files with their size & mtime, and their hashes. Also caches local files'
+    hashes.
+    """
+
+    def __init__(self, path=INSTALL_STATE):
+        self.path = path
+        self._updates = {'files': {}, 'devices': {}}
+        try:
+            with open(path, encoding='utf-8') as state_file:
+                self._state = json.load(state_file)
+        except (OSError, ValueError):
+            self._state = {}
+        self._state.setdefault('files', {})
+        self._state.setdefault('devices', {})
+
+    def local_hash(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        fingerprint = f'{stat.st_size}:{stat.st_mtime_ns}'
+
+        cached = self._state['files'].get(path)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+
+        entry = [fingerprint, _sha256(path)]
+        self._state['files'][path] = self._updates['files'][path] = entry
+        return entry[1]
+
+    def device_install(self, serial, package):
+        """
+        Returns the install last seen for the package, as a dict of its files ([path, fingerprint]
+        for each) and their hashes (sorted).
+        """
+        return self._state['devices'].get(serial, {}).get(package)
+
+    def set_device_install(self, serial, package, files, hashes):
+        install = {'files': sorted([path, fingerprint] for path, fingerprint in files), 'hashes': sorted(hashes)}
+        self._state['devices'].setdefault(serial, {})[package] = install
+        self._updates['devices'].setdefault(serial, {})[package] = install
+
+    def save(self):
+        if not any(self._updates.values()):
+            return
+
+        # Concurrent workers share the file (with a device each), so merge our changes into
+        # its latest content rather than overwriting theirs:
+        try:
+            with open(self.path, encoding='utf-8') as state_file:
+                latest = json.load(state_file)
+        except (OSError, ValueError):
+            latest = {}
+        latest.setdefault('files', {}).update(self._updates['files'])
+        for serial, packages in self._updates['devices'].items():
+            latest.setdefault('devices', {}).setdefault(serial, {}).update(packages)
+
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as state_file:
+            json.dump(latest, state_file)
+        os.replace(temp_path, self.path)
+        self._updates = {'files': {}, 'devices': {}}
+
+
+class ApkInstaller:
+    """
+    Installs packages on one device (an AdbDevice), skipping them if already installed.
+    Each stage runs in its own trace span, with its retries counted there.
+    """
+
+    def __init__(self, device, state=None, trace=None, retries=STAGE_RETRIES, timeout=300):
+        self.device = device
+        self.state = state or InstallState()
+        self.trace = trace or RunTrace()
+        self.retries = retries
+        self.timeout = timeout
+
+    @property
+    def _shell(self):
+        return self.device.pool.persistent_shell(self.device.serial)
+
+    def install(self, package, apk_paths, *options, incremental=False):
+        """
+        Installs the package from its APK (or base & split APKs), unless exactly those files
+        are already installed. Options are passed to the package manager (e.g. '-r', '-g').
+        Returns how it ended: 'cached', 'verified', 'installed' or 'installed incrementally'.
+        """
+        apk_paths = [apk_paths] if isinstance(apk_paths, str) else list(apk_paths)
+        try:
+            with self.trace.span('apk_check') as span:
+                local_hashes = sorted(self.state.local_hash(path) for path in apk_paths)
+                span.details['result'] = result = self._stage(span, self._check_installed, package, local_hashes)
+            if result:
+                return result
+
+            if incremental and self._install_incremental(apk_paths, options):
+                result = 'installed incrementally'
+            else:
+                self._install_streamed(package, apk_paths, options, local_hashes)
+                result = 'installed'
+
+            with self.trace.span('apk_record') as span:
+                installed = self._stage(span, self._installed_files, package)
+                if len(installed) == len(local_hashes):
+                    # The installed files are byte for byte what was streamed, so there's
+                    # no need to hash them:
+                    self.state.set_device_install(self.device.serial, package, installed, local_hashes)
+            return result
+        finally:
+            self.state.save()
+
+    def _stage(self, span, func, *args):
+        """
+        Runs one stage of an install, retrying it (and only it) if the device connection fails.
+        """
+        while True:
+            try:
+                return func(*args)
+            except ApkInstallError:
+                raise
+            except (AdbError, OSError) as e:
+                if span.retries >= self.retries:
+                    raise
+                print(f"{span.name} failed, retrying: {e}")
+                span.retries += 1
+                time.sleep(RETRY_DELAY)
+
+    def _installed_files(self, package):
+        """
+        Returns (path, fingerprint) for each of the package's installed APKs, or an empty list.
+        """
+        output = self._shell.run(f'pm path {shlex.quote(package)}', timeout=self.timeout)
+        paths = [line[len('package:'):].strip() for line in output.splitlines() if line.startswith('package:')]
+        if not paths:
+            return []
+
+        stats = self._shell.run(
+            'stat -c "%s:%Y %n" ' + ' '.join(shlex.quote(path) for path in paths),
+            timeout=self.timeout,
+            check=True
+        )
+        fingerprints = {}
+        for line in stats.splitlines():
+            fingerprint, _, path = line.partition(' ')
+            fingerprints[path] = fingerprint
+        return [[path, fingerprints.get(path)] for path in paths]
+
+    def _check_installed(self, package, local_hashes):
+        """
+        Returns 'cached' or 'verified' if exactly the local APKs are installed, or None.
+        """
+        installed = self._installed_files(package)
+        if len(installed) != len(local_hashes):
+            return None
+
+        # Unchanged since we last saw it? Paths include a random component on Android 8+,
+        # so they change with every install:
+        known = self.state.device_install(self.device.serial, package)
+        if known and sorted(installed) == known['files']:
+            return 'cached' if known['hashes'] == local_hashes else None
+
+        output = self._shell.run(
+            'sha256sum ' + ' '.join(shlex.quote(path) for path, _ in installed),
+            timeout=self.timeout,
+            check=True
+        )
+        device_hashes = sorted(line.split(None, 1)[0] for line in output.splitlines() if line.strip())
+        self.state.set_device_install(self.device.serial, package, installed, device_hashes)
+        return 'verified' if device_hashes == local_hashes else None
+
+    def _install_incremental(self, apk_paths, options):
+        adb_path = self.device.pool.client.adb_path
+        if not adb_path or not all(os.path.exists(path + '.idsig') for path in apk_paths):
+            return False
+
+        with self.trace.span('apk_install_incremental') as span:
+            sdk = self._stage(span, lambda: self._shell.run('getprop ro.build.version.sdk', timeout=self.timeout))
+            if not sdk.strip().isdigit() or int(sdk) < INCREMENTAL_MIN_SDK:
+                span.details['skipped'] = f"SDK {sdk.strip()} doesn't support incremental installs"
+                return False
+
+            result = subprocess.run(
+                [
+                    adb_path, '-s', self.device.serial,
+                    'install-multiple' if len(apk_paths) > 1 else 'install',
+                    '--incremental', *options, *apk_paths
+                ],
+                capture_output=True,
+                timeout=self.timeout
+            )
+            output = (result.stdout + result.stderr).decode('utf-8', errors='replace').strip()
+            if result.returncode != 0 or 'Success' not in output:
+                span.details['skipped'] = f"Incremental install failed, streaming instead: {output}"
+                print(span.details['skipped'])
+                return False
+            return True
+
+    def _install_streamed(self, package, apk_paths, options, local_hashes):
+        total_size = sum(os.path.getsize(path) for path in apk_paths)
+
+        with self.trace.span('apk_session_create') as span:
+            session_id = self._stage(span, self._create_session, total_size, options)
+
+        try:
+            for index, path in enumerate(apk_paths):
+                with self.trace.span('apk_write') as span:
+                    span.details['apk'] = os.path.basename(path)
+                    self._stage(span, self._write_apk, session_id, index, path)
+
+            with self.trace.span('apk_commit'):
+                self._commit(session_id, package, local_hashes)
+        except BaseException:
+            try:
+                self._shell.run(f'cmd package install-abandon {session_id}', timeout=30)
+            except (AdbError, OSError):
+                pass # It'll expire on its own
+            raise
+
+    def _create_session(self, total_size, options):
+        command = ' '.join(['cmd package install-create', *map(shlex.quote, options), '-S', str(total_size)])
+        output = _check_pm_output(self._shell.run(command, timeout=self.timeout), "Creating an install session")
+        match = _SESSION_ID_PATTERN.search(output)
+        if not match:
+            raise AdbError(f"Unexpected install session output: {output}")
+        return match.group(1)
+
+    def _write_apk(self, session_id, index, path):
+        size = os.path.getsize(path)
+        name = f'{index}_{os.path.basename(path)}'
+        service = f'exec:cmd package install-write -S {size} {session_id} {shlex.quote(name)} -'
+        with self.device.pool.open_service(self.device.serial, service, self.timeout) as connection:
+            with open(path, 'rb') as apk:
+                for chunk in iter(lambda: apk.read(SYNC_CHUNK_SIZE), b''):
+                    connection.sock.sendall(chunk)
+            output = connection.read_all().decode('utf-8', errors='replace')
+        _check_pm_output(output, f"Streaming {path}")
+
+    def _commit(self, session_id, package, local_hashes):
+        try:
+            output = self._shell.run(f'cmd package install-commit {session_id}', timeout=self.timeout)
+        except (AdbError, OSError):
+            # The commit may or may not have happened before the connection failed, and the
+            # session is gone either way, so all that can be done is to check:
+            if self._check_installed(package, local_hashes):
+                return
+            raise
+        _check_pm_output(output, "Committing the install")
@@ -0,0 +1,119 @@
+"""
+Measures device commands per second, for each way of running them over ADB.
+
+Compares running each command with its own adb process ('adb shell <command>'),
+over its own pooled host-protocol connection (AdbDevice.shell), and over the
+device's persistent shell (AdbShell), both one at a time and pipelined (every
+command sent before waiting for any responses).
+
+Optionally (as it really taps the screen, so pick a harmless position) also
+compares tapping with an 'adb shell input tap' process per tap to sending all the
+taps as one batch of touchscreen events:
+
+    python3 benchmarks/adb_shell_benchmark.py [--serial emulator-5554] [--commands 200] [--command true] [--tap X Y --taps 20]
+
+Requires a connected device, and adb (from $ANDROID_HOME/platform-tools, unless --adb is given).
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from import_benchmark import ROOT
+
+sys.path.insert(0, ROOT)
+from adb_client import AdbClient, AdbConnectionPool # noqa: E402
+
+
+def default_adb_path():
+    android_home = os.environ.get('ANDROID_HOME')
+    return os.path.join(android_home, 'platform-tools', 'adb') if android_home else 'adb'
+
+
+def commands_per_second(run, count):
+    run() # Warm up
+    start = time.perf_counter()
+    for _ in range(count):
+        run()
+    return count / (time.perf_counter() - start)
+
+
+def batched_taps_per_second(device, x, y, count):
+    device.taps([(x, y)]) # Warm up, & find the touchscreen
+    start = time.perf_counter()
+    device.taps([(x, y)] * count)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--serial', help='Device to use (defaults to the only one connected)')
+    parser.add_argument('--adb', default=default_adb_path())
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--command', default='true', help='Shell command to run repeatedly')
+    parser.add_argument('--tap', type=int, nargs=2, metavar=('X', 'Y'), help='Also benchmark tapping here')
+    parser.add_argument('--taps', type=int, default=20)
+    args = parser.parse_args()
+
+    with AdbConnectionPool(AdbClient(args.adb)) as pool:
+        serial = args.serial
+        if serial is None:
+            online = [serial for serial, state in pool.client.devices().items() if state == 'device']
+            if len(online) != 1:
+                parser.error(f"--serial is required with {len(online)} devices connected")
+            serial = online[0]
+        device = pool.device(serial)
+        shell = pool.persistent_shell(serial)
+
+        def pipelined(count):
+            start = time.perf_counter()
+            for future in [shell.submit(args.command) for _ in range(count)]:
+                future.result()
+            return count / (time.perf_counter() - start)
+
+        results = [
+            ('adb process per command', commands_per_second(
+                lambda: subprocess.run([args.adb, '-s', serial, 'shell', args.command], capture_output=True),
+                args.commands
+            )),
+            ('pooled connection per command', commands_per_second(
+                lambda: device.shell(args.command),
+                args.commands
+            )),
+            ('persistent shell', commands_per_second(
+                lambda: shell.run(args.command),
+                args.commands
+            )),
+            ('persistent shell, pipelined', pipelined(args.commands))
+        ]
+
+        print(f"'{args.command}' on {serial}, {args.commands} times:\n")
+        baseline = results[0][1]
+        for label, rate in results:
+            print(f"  {label:<32} {rate:10.1f} commands/s  ({rate / baseline:.1f}x)")
+
+        if args.tap:
+            x, y = args.tap
+            tap_results = [
+                ('adb process per input tap', commands_per_second(
+                    lambda: subprocess.run([args.adb, '-s', serial, 'shell', 'input', 'tap', str(x), str(y)],
+                        capture_output=True),
+                    args.taps
+                )),
+                ('persistent shell, input tap', commands_per_second(
+                    lambda: device.tap(x, y),
+                    args.taps
+                )),
+                ('batched touchscreen events', batched_taps_per_second(device, x, y, args.taps))
+            ]
+
+            print(f"\nTapping ({x}, {y}) {args.taps} times:\n")
+            baseline = tap_results[0][1]
+            for label, rate in tap_results:
+                print(f"  {label:<32} {rate:10.1f} taps/s  ({rate / baseline:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Measures the overhead of the aiohttp override, for session creation and requests.
+
+Compares the previous override (taken from git history: forcing trust_env on every
+session, so proxy settings are read from the environment for each request, with
+aiohttp's default SSL context) to the current one (a proxy resolved once, and a
+shared SSL context), making HTTPS requests through a local TLS-terminating
+CONNECT proxy, standing in for HTTP Toolkit. Each variant runs in its own
+process, alternating, and the median of each measurement across rounds is shown.
+
+    python3 benchmarks/aiohttp_benchmark.py [--rounds 5] [--iterations 200] [--baseline-ref <commit>]
+
+Requires aiohttp, and the openssl CLI to generate throwaway certificates.
+"""
+
+import argparse
+import json
+import os
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from import_benchmark import ROOT, OVERRIDE_PATH, extract_overrides
+from ssl_context_benchmark import _read_headers
+
+
+def previous_override_ref():
+    """
+    Finds the last commit before the aiohttp override used a shared SSL context, or HEAD if that
+    change hasn't been committed yet.
+    """
+    changed_in = subprocess.run(
+        ['git', 'log', '-1', '--format=%H', '-S_supports_ssl_param', '--',
+            'overrides/pythonpath/httptoolkit_patches/aiohttp.py'],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout.strip()
+    return changed_in + '^' if changed_in else 'HEAD'
+
+
+def generate_certificates(directory, subject_alt_names=('DNS:example.com',)):
+    """
+    Generates a CA, and a certificate for the given names signed by it (aiohttp verifies hostnames).
+    """
+    def openssl(*args):
+        subprocess.run(['openssl', *args], check=True, capture_output=True, cwd=directory)
+
+    openssl('req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=Benchmark CA', '-days', '1',
+        '-keyout', 'ca.key', '-out', 'ca.pem',
+        '-addext', 'basicConstraints=critical,CA:TRUE', '-addext', 'keyUsage=critical,keyCertSign')
+    openssl('req', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=' + subject_alt_names[0].split(':', 1)[1],
+        '-keyout', 'leaf.key', '-out', 'leaf.csr')
+    with open(os.path.join(directory, 'leaf.ext'), 'w') as extensions:
+        extensions.write(f"subjectAltName={','.join(subject_alt_names)}\nextendedKeyUsage=serverAuth\n")
+    openssl('x509', '-req', '-in', 'leaf.csr', '-CA', 'ca.pem', '-CAkey', 'ca.key', '-CAcreateserial',
+        '-days', '1', '-out', 'leaf.pem', '-extfile', 'leaf.ext')
+
+    return tuple(os.path.join(directory, name) for name in ('ca.pem', 'leaf.pem', 'leaf.key'))
+
+
+def run_keep_alive_proxy(cert_path, key_path):
+    """
+    Starts a minimal CONNECT proxy that terminates TLS itself (as HTTP Toolkit does), answering
+    every request on each connection with a tiny response. Returns its port.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', 0))
+    server.listen(128)
+
+    def handle(client):
+        try:
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            while True:
+                headers = _read_headers(client)
+                if not headers:
+                    return
+                if headers.startswith(b'CONNECT '):
+                    client.sendall(b'HTTP/1.1 200 Connection established\r\n\r\n')
+                    client = context.wrap_socket(client, server_side=True)
+                else:
+                    client.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            client.close()
+
+    def serve():
+        while True:
+            client, _ = server.accept()
+            threading.Thread(target=handle, args=(client,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()[1]
+
+
+async def _measure(iterations):
+    import aiohttp
+
+    url = 'https://example.com/'
+
+    async def create_session():
+        session = aiohttp.ClientSession()
+        await session.close()
+
+    async def first_request():
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                await response.read()
+
+    async def time_per_call(func):
+        await func() # Warm up
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await func()
+        return (time.perf_counter() - start) / iterations
+
+    async with aiohttp.ClientSession() as session:
+        async def repeat_request():
+            async with session.get(url) as response:
+                await response.read()
+
+        return {
+            'session creation': await time_per_call(create_session),
+            'new session + first request': await time_per_call(first_request),
+            'request on an open session': await time_per_call(repeat_request)
+        }
+
+
+def run_child(iterations):
+    """
+    Runs inside a process with the override on the path, as an intercepted process would.
+    """
+    import asyncio
+    print(json.dumps(asyncio.run(_measure(iterations))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--baseline-ref', help='Git ref for the previous overrides')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.iterations)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        ca_path, cert_path, key_path = generate_certificates(directory)
+        proxy_port = run_keep_alive_proxy(cert_path, key_path)
+
+        baseline_ref = args.baseline_ref or previous_override_ref()
+        variants = [
+            (f'previous ({baseline_ref})', extract_overrides(baseline_ref, directory)),
+            ('current', OVERRIDE_PATH)
+        ]
+
+        results = {label: {} for label, _ in variants}
+        for _ in range(args.rounds):
+            for label, override_path in variants:
+                env = dict(
+                    os.environ,
+                    PYTHONPATH=os.pathsep.join(filter(None, [override_path, os.environ.get('PYTHONPATH')])),
+                    HTTP_PROXY=f'http://127.0.0.1:{proxy_port}',
+                    HTTPS_PROXY=f'http://127.0.0.1:{proxy_port}',
+                    SSL_CERT_FILE=ca_path
+                )
+                output = subprocess.run([
+                    sys.executable, os.path.abspath(__file__), '--child',
+                    '--iterations', str(args.iterations)
+                ], env=env, check=True, capture_output=True, text=True).stdout
+                for measurement, duration in json.loads(output).items():
+                    results[label].setdefault(measurement, []).append(duration)
+
+    print(f"aiohttp via the proxy, median of {args.rounds} rounds of {args.iterations}:")
+    baseline_label, _ = variants[0]
+    for measurement in results[baseline_label]:
+        print(f"\n  {measurement}:")
+        baseline = statistics.median(results[baseline_label][measurement])
+        for label, _ in variants:
+            duration = statistics.median(results[label][measurement])
+            comparison = f"  ({baseline / duration:.2f}x the speed)" if label != baseline_label else ''
+            print(f"    {label:<24} {duration * 1e3:8.3f} ms{comparison}")
+
+
+if __name__ == '__main__':
+    main()
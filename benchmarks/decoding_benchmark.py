@@ -0,0 +1,79 @@
+"""
+Measures decoding the bodies of a large capture, sequentially and with BodyDecoder.
+
+Builds a synthetic capture of gzip & deflate encoded JSON responses, where a
+share of the bodies repeat (as for identical API responses & static assets),
+and compares decoding each body in turn on the main thread to the process pool,
+with a range of worker counts.
+
+    python3 benchmarks/decoding_benchmark.py [--exchanges 2000] [--body-size 256] [--duplicates 0.3] [--workers 1 2 4]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+from import_benchmark import ROOT
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, f'{ROOT}/fakes')
+from exchange_decoding import BodyDecoder # noqa: E402
+from fake_httptoolkit import make_exchange # noqa: E402
+from httptoolkit_api import Exchange # noqa: E402
+
+
+def build_capture(count, body_size, duplicates):
+    events = []
+    repeated = []
+    for index in range(count):
+        if repeated and random.random() < duplicates:
+            body, encoding = random.choice(repeated)
+        else:
+            document = [{'id': i, 'value': random.random(), 'name': os.urandom(8).hex()} for i in range(body_size // 64)]
+            raw = json.dumps(document).encode()
+            body, encoding = (gzip.compress(raw), 'gzip') if index % 2 else (zlib.compress(raw), 'deflate')
+            if len(repeated) < 20:
+                repeated.append((body, encoding))
+        events.append(make_exchange('GET', f'https://example.com/{index}', 200,
+            response_body=body, response_headers={'content-encoding': encoding}))
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--exchanges', type=int, default=2000)
+    parser.add_argument('--body-size', type=int, default=256, help='Decoded size of each body, in KB')
+    parser.add_argument('--duplicates', type=float, default=0.3, help='Share of bodies that repeat an earlier one')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    events = build_capture(args.exchanges, args.body_size << 10, args.duplicates)
+    decoded_size = args.exchanges * args.body_size / 1024
+    print(f"{args.exchanges} exchanges, ~{decoded_size:.0f}MB decoded, on {os.cpu_count()} cores:\n")
+
+    start = time.perf_counter()
+    for event in events:
+        Exchange.from_event(event).response.decoded_body()
+    baseline = time.perf_counter() - start
+    print(f"  {'sequential':<28} {baseline:8.2f}s")
+
+    for workers in sorted(set(args.workers)):
+        for label, cache_size in (('', 0), (', dedup', None)):
+            options = {'workers': workers}
+            if cache_size is not None:
+                options['cache_size'] = cache_size
+            start = time.perf_counter()
+            with BodyDecoder(**options) as decoder:
+                for _ in decoder.decode(Exchange.from_event(event) for event in events):
+                    pass
+            duration = time.perf_counter() - start
+            print(f"  {f'{workers} worker(s){label}':<28} {duration:8.2f}s  ({baseline / duration:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
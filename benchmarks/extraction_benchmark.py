@@ -0,0 +1,114 @@
+"""
+Measures extracting values from captured exchange bodies, per exchange.
+
+Compares the previous approach (a regex built per field, per body) to the compiled
+Extractor, with pointer rules and with regex rules (checking that the latter find
+the same values, including for rules whose matches overlap), over a batch of
+gzipped device register responses, and then compares
+fully parsing a large body to the streaming scan, with the fields at its start
+and at its end.
+
+    python3 benchmarks/extraction_benchmark.py [--exchanges 2000] [--large-size 8]
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import time
+
+from import_benchmark import ROOT
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, f'{ROOT}/fakes')
+from extraction import Extractor # noqa: E402
+from fake_httptoolkit import default_exchanges # noqa: E402
+from httptoolkit_api import Exchange # noqa: E402
+
+FIELDS = {
+    'device_id_str': {'pointer': '/device_id_str', 'type': 'str'},
+    'new_user': {'pointer': '/new_user', 'type': 'int'},
+    'install_id_str': {'pointer': '/install_id_str', 'type': 'str'}
+}
+
+# The same fields as regexes, plus one whose first match overlaps another field's:
+REGEX_FIELDS = {
+    'device_id_str': {'regex': r'"device_id_str":\s*"?(\d+)"?'},
+    'new_user': {'regex': r'"new_user":\s*(\d+)', 'type': 'int'},
+    'install_id_str': {'regex': r'"install_id_str":\s*"?(\d+)"?'},
+    'device_id': {'regex': r'"device_id":\s*(\d+)'},
+    'first_id': {'regex': r'id":\s*(\d+)'} # Overlaps device_id's match
+}
+
+
+def regex_per_field(exchange):
+    body = exchange.response.text()
+
+    def extract_value(key):
+        match = re.search(f'"{key}":\\s*"?(\\d+)"?', body)
+        return match.group(1) if match else None
+
+    return {
+        'device_id_str': extract_value('device_id_str'),
+        'new_user': int(extract_value('new_user')),
+        'install_id_str': extract_value('install_id_str')
+    }
+
+
+def per_second(run, items):
+    start = time.perf_counter()
+    run(items)
+    return len(items) / (time.perf_counter() - start)
+
+
+def large_body(size, fields_first):
+    values = {'device_id_str': '7000000000000000001', 'new_user': 1, 'install_id_str': '7000000000000000002'}
+    padding = []
+    while len(padding) * 64 < size:
+        padding.append({'id': len(padding), 'value': random.random(), 'name': 'x' * 16})
+    document = dict(values, padding=padding) if fields_first else dict(padding=padding, **values)
+    return json.dumps(document)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--exchanges', type=int, default=2000)
+    parser.add_argument('--large-size', type=int, default=8, help='Size of the large bodies, in MB')
+    args = parser.parse_args()
+
+    exchanges = []
+    while len(exchanges) < args.exchanges:
+        exchanges.append(Exchange.from_event(default_exchanges()[-1]))
+
+    extractor = Extractor(FIELDS)
+    regex_extractor = Extractor(REGEX_FIELDS)
+    body = exchanges[0].response.text()
+    expected = {field: re.search(rule['regex'], body).group(1) for field, rule in REGEX_FIELDS.items()}
+    extracted = {field: str(value) for field, value in regex_extractor.extract(exchanges[0]).items()}
+    if extracted != expected:
+        sys.exit(f"Regex rules extracted {extracted}, but each regex alone finds {expected}")
+
+    results = [
+        ('regex per field', per_second(lambda batch: [regex_per_field(exchange) for exchange in batch], exchanges)),
+        ('compiled extractor', per_second(lambda batch: list(extractor.extract_all(batch)), exchanges)),
+        ('extractor, regex rules', per_second(lambda batch: list(regex_extractor.extract_all(batch)), exchanges))
+    ]
+    print(f"{args.exchanges} gzipped device register responses:\n")
+    baseline = results[0][1]
+    for label, rate in results:
+        print(f"  {label:<24} {rate:10.1f} exchanges/s  ({rate / baseline:.1f}x)")
+
+    full_parse = Extractor(FIELDS, streaming_threshold=float('inf'))
+    streaming = Extractor(FIELDS, streaming_threshold=0)
+    for fields_first in (True, False):
+        body = large_body(args.large_size << 20, fields_first)
+        print(f"\n{len(body) / (1 << 20):.1f}MB body, fields at its {'start' if fields_first else 'end'}:\n")
+        for label, engine in (('full parse', full_parse), ('streaming scan', streaming)):
+            start = time.perf_counter()
+            engine.extract(body)
+            print(f"  {label:<24} {(time.perf_counter() - start) * 1000:10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
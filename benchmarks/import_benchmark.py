@@ -0,0 +1,124 @@
+"""
+Measures the startup & import time the Python overrides add to intercepted processes.
+
+Compares plain Python (no overrides), the previous shadow-module overrides (taken
+from git history: the commit before they were removed) and the current import hook,
+for a process that imports nothing, one that only imports unrelated modules, and
+those that import intercepted modules directly & indirectly.
+
+    python3 benchmarks/import_benchmark.py [--runs 30] [--baseline-ref <commit>]
+"""
+
+import argparse
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OVERRIDE_PATH = os.path.join(ROOT, 'overrides', 'pythonpath')
+
+STATEMENTS = [
+    ('startup only', 'pass'),
+    ('unrelated imports', 'import json, csv, decimal'),
+    ('import http.client', 'import http.client'),
+    ('import urllib.request', 'import urllib.request'),
+    ('import http.server', 'import http.server')
+]
+
+
+def previous_overrides_ref():
+    """
+    Finds the last commit with the shadow-module overrides: the parent of the commit removing them.
+    """
+    removed_in = subprocess.run(
+        ['git', 'log', '-1', '--format=%H', '--diff-filter=D', '--', 'overrides/pythonpath/http/client.py'],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout.strip()
+    if not removed_in:
+        raise SystemExit("Could not find the previous overrides in git history, pass --baseline-ref")
+    return removed_in + '^'
+
+
+def extract_overrides(ref, directory):
+    archive = subprocess.run(
+        ['git', 'archive', ref, 'overrides/pythonpath'],
+        cwd=ROOT, check=True, capture_output=True
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return os.path.join(directory, 'overrides', 'pythonpath')
+
+
+def _environment(override_path, bytecode_cache):
+    env = dict(
+        os.environ,
+        HTTP_PROXY='http://127.0.0.1:8000',
+        SSL_CERT_FILE=os.path.abspath(__file__) # Never actually loaded
+    )
+    env.pop('PYTHONPATH', None)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    if not bytecode_cache:
+        env['PYTHONDONTWRITEBYTECODE'] = '1'
+    if override_path:
+        env['PYTHONPATH'] = override_path
+    return env
+
+
+def time_statement(statement, override_paths, runs, bytecode_cache=True):
+    """
+    Returns the median time to run the statement in a fresh process, for each override path.
+    Runs for each path are interleaved, so that changes in machine load affect all equally.
+    """
+    command = [sys.executable, '-c', statement]
+    environments = [_environment(path, bytecode_cache) for path in override_paths]
+    for env in environments:
+        subprocess.run(command, env=env, check=True)  # Warm up the OS & bytecode caches
+
+    timings = [[] for _ in environments]
+    for _ in range(runs):
+        for env, env_timings in zip(environments, timings):
+            start = time.perf_counter()
+            subprocess.run(command, env=env, check=True)
+            env_timings.append(time.perf_counter() - start)
+    return [statistics.median(env_timings) for env_timings in timings]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--no-bytecode-cache', action='store_true',
+                        help="Compile the overrides in every process, as when their directory isn't writable")
+    parser.add_argument('--baseline-ref', help='Commit with the previous overrides (default: found from git history)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        baseline_ref = args.baseline_ref or previous_overrides_ref()
+        variants = [
+            ('no overrides', None),
+            ('shadow modules', extract_overrides(baseline_ref, directory)),
+            ('import hook', OVERRIDE_PATH)
+        ]
+
+        caching = 'without' if args.no_bytecode_cache else 'with'
+        print(f"Median process time over {args.runs} runs, {caching} bytecode caching (shadow modules from {baseline_ref}):\n")
+        print(f"  {'':24}" + ''.join(f"{name:>18}" for name, _ in variants))
+        for label, statement in STATEMENTS:
+            timings = time_statement(
+                statement, [path for _, path in variants], args.runs,
+                bytecode_cache=not args.no_bytecode_cache
+            )
+            baseline = timings[0]
+            cells = [f"{timings[0] * 1e3:15.1f} ms"] + [
+                f"{timing * 1e3:8.1f} ms ({(timing - baseline) * 1e3:+5.1f})"
+                for timing in timings[1:]
+            ]
+            print(f"  {label:24}" + ''.join(f"{cell:>18}" for cell in cells))
+
+
+if __name__ == '__main__':
+    main()
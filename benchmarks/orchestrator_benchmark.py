@@ -0,0 +1,234 @@
+"""
+Runs the whole capture pipeline (run_all_in_python.py) offline, against the fake ADB
+server, SDK & HTTP Toolkit server in fakes/, and checks each phase's timing.
+
+The first run starts with no prepared image, so it does the wipe boot, root, APK
+install & snapshot save, and later runs restore that snapshot, as on a real
+machine. Every run writes its trace, from which each phase's duration is reported.
+Phases with a budget (seconds, for the slowest warm run, or for the cold run with
+'cold:' before the phase) fail the benchmark if exceeded, so regressions in the
+Python tooling show up without needing an emulator.
+
+    python3 benchmarks/orchestrator_benchmark.py [--runs 3] [--budget capture=10 --budget cold:total=30] [--output results.json] [--compare previous.json]
+
+Device behaviour is scriptable as with fake_adb.py: --boot-delay, --install-failures.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from import_benchmark import ROOT
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'fakes'))
+
+from emulator import AVD_NAME # noqa: E402
+from fake_adb import FakeAdbServer # noqa: E402
+from fake_httptoolkit import FakeHttpToolkitServer # noqa: E402
+from fake_sdk import create_sdk # noqa: E402
+
+RUN_SCRIPT = os.path.join(ROOT, 'run_all_in_python.py')
+TIKTOK_APK = 'tiktok-v30.1.2.apk'
+FAKE_APK_SIZE = 8 << 20
+
+EMULATOR_PORT = 5580
+
+# Generous limits for the fakes, covering the fixed waits in the pipeline itself
+# (e.g. the pause before accepting the VPN prompt):
+DEFAULT_BUDGETS = {
+    'warm': {'total': 30, 'emulator_boot': 10, 'capture': 15},
+    'cold': {'total': 60}
+}
+
+SUMMARY_PHASES = [
+    'adb_server', 'server', 'ca_certificate', 'image_cache', 'prepare_image',
+    'emulator_boot', 'app_install', 'session', 'capture', 'cleanup'
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def create_workspace(directory):
+    """
+    Lays out everything a run needs besides the servers: the SDK, an AVD, the CA
+    certificate and the APK. Returns the environment to run with.
+    """
+    sdk = create_sdk(os.path.join(directory, 'sdk'))
+
+    avd_home = os.path.join(directory, 'avd')
+    avd_dir = os.path.join(avd_home, f'{AVD_NAME}.avd')
+    os.makedirs(avd_dir)
+    with open(os.path.join(avd_dir, 'config.ini'), 'w') as config:
+        config.write('image.sysdir.1=system-images/android-31/google_apis/arm64-v8a/\n')
+
+    # The fake emulator's console auth token is written to HOME, so it's kept out of the real one
+    home = os.path.join(directory, 'home')
+    os.makedirs(home)
+
+    config_home = os.path.join(directory, 'config')
+    os.makedirs(os.path.join(config_home, 'httptoolkit'))
+    with open(os.path.join(config_home, 'httptoolkit', 'ca.pem'), 'w') as cert:
+        cert.write('-----BEGIN CERTIFICATE-----\nZmFrZQ==\n-----END CERTIFICATE-----\n')
+
+    with open(os.path.join(directory, TIKTOK_APK), 'wb') as apk:
+        apk.write(b'package:com.zhiliaoapp.musically\n')
+        apk.write(os.urandom(FAKE_APK_SIZE))
+
+    return dict(
+        os.environ,
+        HOME=home,
+        ANDROID_AVD_HOME=avd_home,
+        XDG_CONFIG_HOME=config_home,
+        HTK_ROOTAVD=sdk['rootavd'],
+        HTK_TRACE_DIR=os.path.join(directory, 'traces'),
+        HTK_EMULATOR_PORT=str(EMULATOR_PORT),
+        PYTHONUNBUFFERED='1'
+    )
+
+
+def phase_durations(trace):
+    """
+    Sums the trace's span durations by phase name (steps retried or run more than once
+    count in full).
+    """
+    durations = {}
+    for span in trace['spans']:
+        if span['duration'] is not None:
+            durations[span['phase']] = durations.get(span['phase'], 0) + span['duration']
+    return durations
+
+
+def run_pipeline(directory, env, run_index, verbose):
+    run_id = f'benchmark-{run_index}'
+    start_time = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, RUN_SCRIPT, os.path.join(directory, 'sdk')],
+        cwd=directory,
+        env=dict(env, HTK_RUN_ID=run_id),
+        stdout=None if verbose else subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        timeout=300
+    )
+    total = time.perf_counter() - start_time
+
+    if result.returncode != 0:
+        if result.stdout:
+            sys.stdout.write(result.stdout.decode('utf-8', errors='replace'))
+        raise Exception(f"Run {run_index} failed with exit code {result.returncode}")
+
+    with open(os.path.join(env['HTK_TRACE_DIR'], f'{run_id}.json')) as trace_file:
+        durations = phase_durations(json.load(trace_file))
+    durations['total'] = total
+    return durations
+
+
+def parse_budgets(values):
+    budgets = {kind: dict(limits) for kind, limits in DEFAULT_BUDGETS.items()}
+    for value in values:
+        phase, _, seconds = value.partition('=')
+        kind, _, name = phase.rpartition(':')
+        budgets.setdefault(kind or 'warm', {})[name] = float(seconds)
+    return budgets
+
+
+def print_results(results, previous=None):
+    phases = [phase for phase in SUMMARY_PHASES + ['total'] if phase in results['cold']]
+    print(f"\n{'phase':<16} {'cold':>9} {'warm median':>12} {'warm max':>9}" + ("  vs previous warm" if previous else ""))
+    for phase in phases:
+        warm = [run[phase] for run in results['warm'] if phase in run]
+        line = f"{phase:<16} {results['cold'][phase]:>8.2f}s"
+        line += f" {statistics.median(warm):>11.2f}s {max(warm):>8.2f}s" if warm else f" {'-':>12} {'-':>9}"
+        if previous and warm:
+            previous_warm = [run[phase] for run in previous['warm'] if phase in run]
+            if previous_warm:
+                line += f"  {statistics.median(warm) - statistics.median(previous_warm):>+8.2f}s"
+        print(line)
+
+
+def check_budgets(results, budgets):
+    """
+    Returns a description of each budget exceeded.
+    """
+    failures = []
+    for phase, limit in budgets.get('cold', {}).items():
+        duration = results['cold'].get(phase)
+        if duration is not None and duration > limit:
+            failures.append(f"cold {phase}: {duration:.2f}s > {limit:.2f}s")
+    for phase, limit in budgets.get('warm', {}).items():
+        durations = [run[phase] for run in results['warm'] if phase in run]
+        if durations and max(durations) > limit:
+            failures.append(f"warm {phase}: {max(durations):.2f}s > {limit:.2f}s")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3, help='Total runs, including the first (cold) one')
+    parser.add_argument('--budget', action='append', default=[], metavar='[cold:]PHASE=SECONDS')
+    parser.add_argument('--boot-delay', type=float, default=1)
+    parser.add_argument('--install-failures', type=int, default=0)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', help='Results JSON from a previous --output, to compare against')
+    parser.add_argument('--keep', action='store_true', help="Keep the workspace directory (traces, logs, etc)")
+    parser.add_argument('--verbose', action='store_true', help="Show each run's output")
+    args = parser.parse_args()
+
+    budgets = parse_budgets(args.budget)
+    directory = tempfile.mkdtemp(prefix='htk-orchestrator-benchmark-')
+    env = create_workspace(directory)
+    emulator_settings = {'boot_delay': args.boot_delay, 'install_failures': args.install_failures}
+
+    try:
+        with FakeAdbServer(free_port(), emulator_settings=emulator_settings) as adb_server, \
+                FakeHttpToolkitServer(free_port(), free_port(), adb_server=adb_server) as htk_server:
+            env.update(
+                ANDROID_ADB_SERVER_PORT=str(adb_server.port),
+                HTK_API_URL=htk_server.api_url,
+                HTK_ADMIN_URL=htk_server.admin_url
+            )
+
+            results = {'cold': None, 'warm': []}
+            for run_index in range(args.runs):
+                durations = run_pipeline(directory, env, run_index, args.verbose)
+                print(f"Run {run_index} ({'cold' if run_index == 0 else 'warm'}): {durations['total']:.2f}s")
+                if run_index == 0:
+                    results['cold'] = durations
+                else:
+                    results['warm'].append(durations)
+    finally:
+        if args.keep:
+            print(f"Workspace kept in {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    failures = check_budgets(results, budgets)
+    if failures:
+        print("\nOver budget:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("\nAll phases within budget.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+"""
+Measures what the Python overrides cost an intercepted process, for each client we patch.
+
+Runs a local HTTPS origin, and a stand-in for HTTP Toolkit's proxy in front of it
+(accepting CONNECT tunnels and direct TLS, terminating TLS, and forwarding each
+request to the origin). For http.client, httplib2, aiohttp and stripe, each is
+measured without the overrides (requesting the origin directly) and with them
+(on PYTHONPATH, via the proxy, as when intercepted):
+
+- interpreter startup (once per variant, as it doesn't depend on the client)
+- importing the client module
+- the first request, including connection setup
+- steady-state requests per second, reusing the connection
+- peak RSS of the process
+
+Runs are interleaved across variants, and each result is the median across runs.
+Clients that aren't installed are skipped. Results can be saved as JSON, and
+compared to an earlier report, so that regressions in the overrides stand out:
+
+    python3 benchmarks/override_benchmark.py [--runs 5] [--requests 500] [--output report.json] [--compare previous.json]
+
+With --check-timing, it instead runs each client once through the overrides with client
+timing enabled, and checks that the request that opened its connection reported the time
+spent connecting (exiting with an error if not).
+
+Linux only (for RSS), offline. Requires the openssl CLI to generate throwaway certificates.
+"""
+
+import argparse
+import http.client
+import http.server
+import json
+import os
+import platform
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from import_benchmark import OVERRIDE_PATH
+from aiohttp_benchmark import generate_certificates
+
+# Run in a separate process for each measurement, importing as little as possible itself:
+CLIENT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'override_benchmark_clients.py')
+
+CLIENTS = ['http.client', 'httplib2', 'aiohttp', 'stripe']
+VARIANTS = ['without overrides', 'with overrides']
+
+# Any of these phases in a timing record means its connection setup was timed:
+CONNECT_PHASES = {'connect', 'tcp', 'tunnel', 'tls'}
+
+# Metric -> (label, units, whether higher is better):
+METRICS = {
+    'startup_ms': ('interpreter startup', 'ms', False),
+    'import_ms': ('import', 'ms', False),
+    'first_request_ms': ('first request', 'ms', False),
+    'requests_per_second': ('steady state', 'req/s', True),
+    'max_rss_mb': ('peak RSS', 'MB', False)
+}
+
+RESPONSE_BODY = json.dumps({
+    'object': 'balance', # Just enough for stripe to parse
+    'available': [],
+    'pending': [],
+    'livemode': False
+}).encode()
+
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-connection', 'proxy-authorization', 'transfer-encoding', 'upgrade'
+}
+
+
+class OriginHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive
+    disable_nagle_algorithm = True # Headers & body are written separately
+
+    def _respond(self):
+        length = int(self.headers.get('content-length') or 0)
+        if length:
+            self.rfile.read(length)
+        self.send_response(200)
+        self.send_header('content-type', 'application/json')
+        self.send_header('request-id', 'req_benchmark')
+        self.send_header('content-length', str(len(RESPONSE_BODY)))
+        self.end_headers()
+        self.wfile.write(RESPONSE_BODY)
+
+    do_GET = do_POST = do_DELETE = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+def run_origin(tls_context):
+    """
+    Starts the origin, on both plain HTTP (for the proxy) and HTTPS (for direct requests). Returns
+    both ports.
+    """
+    def serve(server):
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server.server_address[1]
+
+    plain_server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), OriginHandler)
+    tls_server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), OriginHandler)
+    tls_server.socket = tls_context.wrap_socket(tls_server.socket, server_side=True)
+    return serve(plain_server), serve(tls_server)
+
+
+def _read_request(reader):
+    """
+    Reads one request's line & headers, returning (method, target, headers), or None at EOF.
+    """
+    line = reader.readline()
+    if not line.strip():
+        return None
+    method, target, _ = line.decode('latin-1').split(' ', 2)
+    headers = []
+    while True:
+        header_line = reader.readline()
+        if header_line in (b'\r\n', b'\n', b''):
+            break
+        name, value = header_line.decode('latin-1').split(':', 1)
+        headers.append((name.strip(), value.strip()))
+    return method, target, headers
+
+
+def run_proxy(tls_context, origin_port):
+    """
+    Starts a stand-in for HTTP Toolkit's proxy. It accepts CONNECT tunnels, plain HTTP proxy
+    requests and direct TLS connections, terminates any TLS, and forwards every request to the
+    origin over a keep-alive connection. Returns its port.
+    """
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', 0))
+    server.listen(128)
+
+    def is_tls(client):
+        return client.recv(1, socket.MSG_PEEK) == b'\x16' # A TLS handshake record
+
+    def handle(client):
+        upstream = http.client.HTTPConnection('127.0.0.1', origin_port)
+        try:
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if is_tls(client):
+                client = tls_context.wrap_socket(client, server_side=True)
+            reader = client.makefile('rb')
+
+            while True:
+                request = _read_request(reader)
+                if request is None:
+                    return
+                method, target, headers = request
+
+                if method == 'CONNECT':
+                    client.sendall(b'HTTP/1.1 200 Connection established\r\n\r\n')
+                    if is_tls(client):
+                        client = tls_context.wrap_socket(client, server_side=True)
+                        reader = client.makefile('rb')
+                    continue
+
+                if '://' in target:
+                    target = '/' + target.split('://', 1)[1].partition('/')[2]
+                length = int(dict((name.lower(), value) for name, value in headers).get('content-length') or 0)
+                body = reader.read(length) if length else None
+
+                upstream.putrequest(method, target, skip_host=True, skip_accept_encoding=True)
+                for name, value in headers:
+                    if name.lower() not in HOP_BY_HOP_HEADERS:
+                        upstream.putheader(name, value)
+                upstream.endheaders(body)
+
+                response = upstream.getresponse()
+                response_body = response.read()
+                client.sendall(
+                    f'HTTP/1.1 {response.status} {response.reason}\r\n'.encode('latin-1') +
+                    b''.join(
+                        f'{name}: {value}\r\n'.encode('latin-1')
+                        for name, value in response.getheaders()
+                        if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != 'content-length'
+                    ) +
+                    f'content-length: {len(response_body)}\r\n\r\n'.encode('latin-1') +
+                    response_body
+                )
+        except (OSError, ssl.SSLError, ValueError, http.client.HTTPException):
+            pass
+        finally:
+            upstream.close()
+            client.close()
+
+    def serve():
+        while True:
+            client, _ = server.accept()
+            threading.Thread(target=handle, args=(client,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def _environment(variant, ca_path, proxy_port):
+    env = dict(os.environ, SSL_CERT_FILE=ca_path)
+    for name in ('HTTP_PROXY', 'HTTPS_PROXY', 'http_proxy', 'https_proxy', 'NO_PROXY', 'no_proxy',
+            'REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE', 'PYTHONDONTWRITEBYTECODE'):
+        env.pop(name, None)
+
+    if variant == 'with overrides':
+        proxy_url = f'http://127.0.0.1:{proxy_port}'
+        env.update(
+            PYTHONPATH=os.pathsep.join(filter(None, [OVERRIDE_PATH, os.environ.get('PYTHONPATH')])),
+            HTTP_PROXY=proxy_url,
+            HTTPS_PROXY=proxy_url
+        )
+    return env
+
+
+def _median_results(samples):
+    if any('skipped' in sample for sample in samples):
+        return next(sample for sample in samples if 'skipped' in sample)
+    return {
+        metric: round(statistics.median(sample[metric] for sample in samples), 3)
+        for metric in samples[0]
+    }
+
+
+def run_servers(directory):
+    """
+    Starts the origin & the proxy, with certificates in the directory. Returns the CA's path,
+    the proxy's port and the origin's HTTPS URL.
+    """
+    ca_path, cert_path, key_path = generate_certificates(directory, ('DNS:localhost', 'IP:127.0.0.1'))
+    tls_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    tls_context.load_cert_chain(cert_path, key_path)
+
+    origin_port, origin_tls_port = run_origin(tls_context)
+    proxy_port = run_proxy(tls_context, origin_port)
+    return ca_path, proxy_port, f'https://localhost:{origin_tls_port}'
+
+
+def run_benchmarks(runs, count):
+    with tempfile.TemporaryDirectory() as directory:
+        ca_path, proxy_port, url = run_servers(directory)
+
+        environments = {variant: _environment(variant, ca_path, proxy_port) for variant in VARIANTS}
+        startup_samples = {variant: [] for variant in VARIANTS}
+        client_samples = {client: {variant: [] for variant in VARIANTS} for client in CLIENTS}
+
+        for variant in VARIANTS:
+            subprocess.run([sys.executable, '-c', 'pass'], env=environments[variant], check=True) # Warm up
+
+        for _ in range(runs):
+            for variant in VARIANTS:
+                start = time.perf_counter()
+                subprocess.run([sys.executable, '-c', 'pass'], env=environments[variant], check=True)
+                startup_samples[variant].append({'startup_ms': (time.perf_counter() - start) * 1e3})
+
+            for client in CLIENTS:
+                for variant in VARIANTS:
+                    output = subprocess.run(
+                        [sys.executable, CLIENT_SCRIPT, client, url, str(count)],
+                        env=environments[variant], check=True, capture_output=True, text=True
+                    ).stdout
+                    client_samples[client][variant].append(json.loads(output))
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': runs,
+        'requests': count,
+        'startup': {variant: _median_results(samples) for variant, samples in startup_samples.items()},
+        'clients': {
+            client: {variant: _median_results(samples) for variant, samples in variants.items()}
+            for client, variants in client_samples.items()
+        }
+    }
+
+
+def _read_timing_records(collector):
+    records = []
+    while True:
+        try:
+            message = json.loads(collector.recv(65536))
+        except socket.timeout:
+            return records
+        records.extend(message['records'])
+
+
+def check_timing(count=5):
+    """
+    Runs each client through the overrides with timing enabled, and prints the phases reported
+    for the request that opened its connection. Returns the clients for which none of those
+    phases covered connecting.
+    """
+    failures = []
+    with tempfile.TemporaryDirectory() as directory, socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as collector:
+        ca_path, proxy_port, url = run_servers(directory)
+        collector.bind(('127.0.0.1', 0))
+        collector.settimeout(1)
+        env = dict(
+            _environment(VARIANTS[1], ca_path, proxy_port),
+            HTTP_TOOLKIT_TIMING_PORT=str(collector.getsockname()[1])
+        )
+
+        for client in CLIENTS:
+            output = subprocess.run(
+                [sys.executable, CLIENT_SCRIPT, client, url, str(count)],
+                env=env, check=True, capture_output=True, text=True
+            ).stdout
+            if 'skipped' in json.loads(output):
+                print(f"{client:<12} skipped: {json.loads(output)['skipped']}")
+                continue
+
+            records = _read_timing_records(collector)
+            first = min(records, key=lambda record: record['startTime']) if records else None
+            phases = sorted(first['phases']) if first else []
+            passed = bool(CONNECT_PHASES.intersection(phases))
+            print(f"{client:<12} {'ok' if passed else 'FAILED':<7} first request phases: {', '.join(phases) or 'none reported'}")
+            if not passed:
+                failures.append(client)
+    return failures
+
+
+def _print_results(name, results, previous=None, threshold=None):
+    print(f"\n{name}:")
+    if 'skipped' in results[VARIANTS[0]]:
+        print(f"  skipped: {results[VARIANTS[0]]['skipped']}")
+        return
+
+    for metric, (label, units, higher_is_better) in METRICS.items():
+        if metric not in results[VARIANTS[0]]:
+            continue
+        without, with_overrides = (results[variant][metric] for variant in VARIANTS)
+        line = f"  {label:<20} {without:10.2f} -> {with_overrides:10.2f} {units:<6} ({with_overrides / without - 1:+.0%})"
+
+        previous_value = (previous or {}).get(VARIANTS[1], {}).get(metric)
+        if previous_value:
+            change = with_overrides / previous_value - 1
+            line += f", {change:+.0%} vs previous"
+            if (-change if higher_is_better else change) > threshold:
+                line += "  << REGRESSION"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=500, help='Requests for each steady state measurement')
+    parser.add_argument('--output', help='Path to save the JSON report')
+    parser.add_argument('--compare', help='Path of an earlier JSON report, to compare to')
+    parser.add_argument('--threshold', type=float, default=0.1,
+        help='Relative change (vs --compare) to flag as a regression')
+    parser.add_argument('--check-timing', action='store_true',
+        help="Instead of benchmarking, check that each client's timing records include connecting")
+    args = parser.parse_args()
+
+    if args.check_timing:
+        failures = check_timing()
+        if failures:
+            sys.exit(f"No connect phase reported for: {', '.join(failures)}")
+        return
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+
+    report = run_benchmarks(args.runs, args.requests)
+
+    print(f"Python {report['python']}, median of {args.runs} runs, without -> with overrides:")
+    _print_results('All processes', report['startup'], previous and previous['startup'], args.threshold)
+    for client, results in report['clients'].items():
+        _print_results(client, results, previous and previous['clients'].get(client), args.threshold)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"\nReport saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Client benchmarks for override_benchmark.py, each run in a fresh process:
+
+    python3 benchmarks/override_benchmark_clients.py <client> <origin url> <requests>
+
+Each imports its client, makes a first request (including connection setup), and then repeats
+requests on the same connection or session, printing the results as JSON. This imports as little
+as possible itself, so that it doesn't preload any of what the clients import.
+"""
+
+import json
+import os
+import sys
+import time
+
+
+def _time(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def _steady_state(request, count):
+    for _ in range(min(count // 10, 20)):
+        request() # Warm up
+    duration, _ = _time(lambda: [request() for _ in range(count)])
+    return count / duration
+
+
+def benchmark_http_client(url, count):
+    host, port = url.split('://')[1].split(':')
+    import_time, client = _time(lambda: __import__('http.client', fromlist=['HTTPSConnection']))
+
+    connection = None
+    def request():
+        nonlocal connection
+        if connection is None:
+            connection = client.HTTPSConnection(host, int(port))
+        connection.request('GET', '/')
+        connection.getresponse().read()
+
+    first_request_time, _ = _time(request)
+    return import_time, first_request_time, _steady_state(request, count)
+
+
+def benchmark_httplib2(url, count):
+    import_time, httplib2 = _time(lambda: __import__('httplib2'))
+
+    # httplib2 only supports proxy env vars with PySocks installed. Here interception relies on the
+    # override alone, as without PySocks:
+    http = httplib2.Http(ca_certs=os.environ['SSL_CERT_FILE'], proxy_info=None)
+    def request():
+        http.request(url + '/')
+
+    first_request_time, _ = _time(request)
+    return import_time, first_request_time, _steady_state(request, count)
+
+
+def benchmark_aiohttp(url, count):
+    import asyncio
+    import_time, aiohttp = _time(lambda: __import__('aiohttp'))
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            async def request():
+                async with session.get(url + '/') as response:
+                    await response.read()
+
+            start = time.perf_counter()
+            await request()
+            first_request_time = time.perf_counter() - start
+
+            for _ in range(min(count // 10, 20)):
+                await request()
+            start = time.perf_counter()
+            for _ in range(count):
+                await request()
+            return first_request_time, count / (time.perf_counter() - start)
+
+    return (import_time,) + asyncio.run(run())
+
+
+def benchmark_stripe(url, count):
+    import_time, stripe = _time(lambda: __import__('stripe'))
+
+    stripe.api_key = 'sk_test_benchmark'
+    stripe.api_base = url
+    stripe.ca_bundle_path = os.environ['SSL_CERT_FILE']
+    stripe.max_network_retries = 0
+    def request():
+        stripe.Balance.retrieve()
+
+    first_request_time, _ = _time(request)
+    return import_time, first_request_time, _steady_state(request, count)
+
+
+BENCHMARKS = {
+    'http.client': benchmark_http_client,
+    'httplib2': benchmark_httplib2,
+    'aiohttp': benchmark_aiohttp,
+    'stripe': benchmark_stripe
+}
+
+
+def run_child(client_name, url, count):
+    import resource
+
+    try:
+        import_time, first_request_time, requests_per_second = BENCHMARKS[client_name](url, count)
+    except ImportError as error:
+        print(json.dumps({'skipped': f'not installed ({error})'}))
+        return
+
+    print(json.dumps({
+        'import_ms': import_time * 1e3,
+        'first_request_ms': first_request_time * 1e3,
+        'requests_per_second': requests_per_second,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }))
+
+
+if __name__ == '__main__':
+    client_name, url, count = sys.argv[1:]
+    run_child(client_name, url, int(count))
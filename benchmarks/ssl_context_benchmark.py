@@ -0,0 +1,168 @@
+"""
+Measures the per-connection overhead of the http.client override's TLS setup.
+
+Compares the previous behaviour (a fresh SSLContext with the CA loaded for every
+connection, so no TLS session is ever resumed) to the current cached context,
+both for constructing connections alone and for complete HTTPS requests through
+a local TLS-terminating CONNECT proxy, standing in for HTTP Toolkit.
+
+    python3 benchmarks/ssl_context_benchmark.py [--connections 500] [--requests 200]
+
+Requires the openssl CLI, to generate a throwaway certificate.
+"""
+
+import argparse
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OVERRIDE_PATH = os.path.join(ROOT, 'overrides', 'pythonpath')
+
+
+def generate_certificate(directory):
+    cert_path = os.path.join(directory, 'ca.pem')
+    key_path = os.path.join(directory, 'key.pem')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+        '-subj', '/CN=localhost', '-days', '1',
+        '-keyout', key_path, '-out', cert_path
+    ], check=True, capture_output=True)
+    return cert_path, key_path
+
+
+def _read_headers(sock):
+    data = b''
+    while b'\r\n\r\n' not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def run_tls_proxy(cert_path, key_path):
+    """
+    Starts a minimal CONNECT proxy that terminates TLS itself (as HTTP Toolkit does),
+    answering every request with a tiny response (reporting whether its TLS session
+    was resumed). Returns its port.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', 0))
+    server.listen(128)
+
+    def handle(client):
+        try:
+            if not _read_headers(client):
+                return
+            client.sendall(b'HTTP/1.1 200 Connection established\r\n\r\n')
+            with context.wrap_socket(client, server_side=True) as tls_client:
+                if _read_headers(tls_client):
+                    resumed = b'1' if tls_client.session_reused else b'0'
+                    tls_client.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 1\r\nConnection: close\r\n\r\n' + resumed)
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            client.close()
+
+    def serve():
+        while True:
+            client, _ = server.accept()
+            threading.Thread(target=handle, args=(client,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def _time_per_call(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count
+
+
+def run_benchmark(connections, requests):
+    """
+    Runs inside a process with the override on the path, as an intercepted process would.
+    """
+    import http.client
+    from httptoolkit_patches import http_client as override
+
+    original_init = http.client.HTTPSConnection.__init__.__wrapped__
+    cert_path = os.environ['SSL_CERT_FILE']
+
+    def previous_context():
+        # What the override did before, for every connection:
+        context = override._build_default_context()
+        context.load_verify_locations(cert_path)
+        return context
+
+    def construct_previous():
+        connection = http.client.HTTPSConnection.__new__(http.client.HTTPSConnection)
+        original_init(connection, override._proxyHost, int(override._proxyPort), context=previous_context())
+
+    def construct_current():
+        http.client.HTTPSConnection('example.com')
+
+    print(f"Constructing {connections} HTTPS connections:")
+    before = _time_per_call(construct_previous, connections)
+    after = _time_per_call(construct_current, connections)
+    print(f"  per-connection context:  {before * 1e6:9.1f} us/connection")
+    print(f"  cached context:          {after * 1e6:9.1f} us/connection  ({before / after:.1f}x faster)")
+
+    resumed = []
+
+    def request(context):
+        connection = http.client.HTTPSConnection('example.com', context=context)
+        connection.request('GET', '/')
+        resumed.append(connection.getresponse().read() == b'1')
+        connection.close()
+
+    print(f"\nComplete HTTPS requests via the proxy ({requests} each):")
+    before = _time_per_call(lambda: request(previous_context()), requests)
+    before_resumed = sum(resumed)
+    resumed.clear()
+    after = _time_per_call(lambda: request(None), requests)
+    print(f"  per-connection context:  {before * 1e3:9.2f} ms/request  ({before_resumed} TLS sessions resumed)")
+    print(f"  cached context:          {after * 1e3:9.2f} ms/request  ({sum(resumed)} TLS sessions resumed)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--connections', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_benchmark(args.connections, args.requests)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, key_path = generate_certificate(directory)
+        proxy_port = run_tls_proxy(cert_path, key_path)
+
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(filter(None, [OVERRIDE_PATH, os.environ.get('PYTHONPATH')])),
+            HTTP_PROXY=f'http://127.0.0.1:{proxy_port}',
+            SSL_CERT_FILE=cert_path
+        )
+        subprocess.run([
+            sys.executable, os.path.abspath(__file__), '--child',
+            '--connections', str(args.connections),
+            '--requests', str(args.requests)
+        ], env=env, check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Staged readiness checks for an Android device, without polling from the host.
+
+Each stage waits for a specific condition, with its own timeout:
+
+* transport: the device is attached to the ADB server (via one long-lived
+  host:track-devices connection, which pushes every state change)
+* boot_completed: sys.boot_completed is set
+* package_manager: the package manager service answers, so installs will work
+* network: the device has a default route
+
+The later stages run a wait loop on the device itself, over a single shell
+connection per stage, so no host process is spawned per check.
+"""
+
+import socket
+import time
+
+from adb_client import AdbClient, AdbError, parse_devices
+
+STAGES = ('transport', 'boot_completed', 'package_manager', 'network')
+
+DEFAULT_TIMEOUTS = {
+    'transport': 60,
+    'boot_completed': 120,
+    'package_manager': 60,
+    'network': 30
+}
+
+READY_SENTINEL = 'HTK_STAGE_READY'
+
+# Device-side loops for each shell-based stage. Each prints the sentinel once ready.
+_STAGE_COMMANDS = {
+    'boot_completed':
+        'while [ "$(getprop sys.boot_completed)" != 1 ]; do sleep 0.2; done',
+    'package_manager':
+        'until pm path android >/dev/null 2>&1; do sleep 0.2; done',
+    'network':
+        'until ip route show table all 2>/dev/null | grep -q "^default"; do sleep 0.2; done'
+}
+
+
+class DeviceNotReadyError(Exception):
+    def __init__(self, stage, timeout, timings):
+        super().__init__(f"Device not ready: {stage} stage timed out after {timeout}s")
+        self.stage = stage
+        self.timings = timings
+
+
+def _wait_for_transport(client, serial, timeout):
+    """
+    Waits until the device (or any emulator, if serial is None) is online, and
+    returns its serial.
+    """
+    deadline = time.time() + timeout
+    with client.connect() as connection:
+        connection.send('host:track-devices')
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise socket.timeout()
+            connection.set_timeout(remaining)
+
+            # The server sends the full device list immediately, and again on every change:
+            for device_serial, state in parse_devices(connection.read_hex_string()).items():
+                if state != 'device':
+                    continue  # Offline, unauthorized, still booting, etc.
+                if device_serial == serial or (serial is None and device_serial.startswith('emulator-')):
+                    return device_serial
+
+
+def _wait_for_shell_condition(client, serial, stage, timeout):
+    command = f'{_STAGE_COMMANDS[stage]}; echo {READY_SENTINEL}'
+    output = client.shell(serial, command, timeout=timeout)
+    if READY_SENTINEL not in output:
+        raise AdbError(f"{stage} check ended unexpectedly: {output.strip()}")
+
+
+def wait_for_device_ready(adb_path=None, serial=None, stages=STAGES, timeouts=None, client=None):
+    """
+    Waits for the device to pass each of the given stages in order. Returns the
+    device serial and a dict of the time (in seconds) each stage took.
+
+    Raises DeviceNotReadyError, identifying the stage, if any stage times out.
+    """
+    client = client or AdbClient(adb_path)
+    timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+    timings = {}
+
+    for stage in stages:
+        timeout = timeouts[stage]
+        start_time = time.time()
+        try:
+            if stage == 'transport':
+                serial = _wait_for_transport(client, serial, timeout)
+            else:
+                _wait_for_shell_condition(client, serial, stage, timeout)
+        except (socket.timeout, TimeoutError):
+            raise DeviceNotReadyError(stage, timeout, timings) from None
+        timings[stage] = time.time() - start_time
+        print(f"Device {stage} ready in {timings[stage]:.2f}s")
+
+    return serial, timings
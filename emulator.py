@@ -0,0 +1,235 @@
+"""
+Helpers for launching the Android emulator used by run_all_in_python.py.
+
+Preparing a device from scratch (wipe, root with rootAVD, reboot, install the
+APK) takes minutes of cold boots. PreparedImageCache saves the result as a
+named Quickboot snapshot instead, keyed by everything that went into it, so
+later runs can restore it in seconds and only rebuild when an input changes.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+AVD_NAME = 'Pixel_XL_API_31-v2'
+
+HEADLESS_FLAGS = [
+    '-no-window',     # Run without a window
+    '-no-boot-anim',  # Disable boot animation
+    '-no-audio',      # Disable audio
+    '-gpu', 'swiftshader_indirect',
+    '-no-skin'        # Don't load device skin
+]
+
+SNAPSHOT_PREFIX = 'htk-prepared-'
+CACHE_MANIFEST = 'htk-prepared-image.json'
+CACHE_LOCK = 'htk-prepared-image.lock'
+
+
+def home_directory():
+    """
+    Returns the user's HOME directory in a cross-platform way.
+    """
+    return os.path.expanduser('~')
+
+
+def default_avd_home():
+    return os.environ.get('ANDROID_AVD_HOME') or os.path.join(home_directory(), '.android', 'avd')
+
+
+def emulator_env(avd_home=None):
+    return {
+        **os.environ,
+        'ANDROID_EMULATOR_WAIT_TIME_BEFORE_KILL': '0',
+        'ANDROID_AVD_HOME': avd_home or default_avd_home(),  # Explicit AVD path
+        'ANDROID_EMU_HEADLESS': '1'  # Enable headless mode
+    }
+
+
+def emulator_command(emulator_path, *args, avd_name=AVD_NAME, port=None):
+    """
+    The command to start a headless emulator for the AVD, with any extra emulator
+    arguments. If a (even) console port is given the emulator uses it, and its
+    serial will be emulator-<port>.
+    """
+    port_args = ['-port', str(port)] if port else []
+    return [emulator_path, *args, *port_args, f'@{avd_name}', *HEADLESS_FLAGS]
+
+
+def _read_ini(path):
+    values = {}
+    try:
+        with open(path, encoding='utf-8') as ini_file:
+            for line in ini_file:
+                key, separator, value = line.partition('=')
+                if separator:
+                    values[key.strip()] = value.strip()
+    except OSError:
+        pass
+    return values
+
+
+def avd_directory(avd_home, avd_name):
+    # <name>.ini points at the real AVD directory, which is usually (but not always) <name>.avd
+    configured_path = _read_ini(os.path.join(avd_home, f'{avd_name}.ini')).get('path')
+    if configured_path and os.path.isdir(configured_path):
+        return configured_path
+    return os.path.join(avd_home, f'{avd_name}.avd')
+
+
+def system_image_directory(android_home, avd_dir):
+    sysdir = _read_ini(os.path.join(avd_dir, 'config.ini')).get(
+        'image.sysdir.1',
+        'system-images/android-31/google_apis/arm64-v8a/'
+    )
+    return os.path.join(android_home, sysdir)
+
+
+def _hash_file(path, digest):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+
+
+def system_image_fingerprint(system_image_dir, digest):
+    """
+    Adds the system image's identity to the digest. Images are multi-GB, so rather than
+    hashing their content we use the package metadata plus each file's size & mtime.
+    The ramdisk is skipped, since rootAVD patches it in place as part of preparation.
+    """
+    if not os.path.isdir(system_image_dir):
+        digest.update(b'missing system image')
+        return
+
+    properties_path = os.path.join(system_image_dir, 'source.properties')
+    if os.path.exists(properties_path):
+        _hash_file(properties_path, digest)
+
+    for name in sorted(os.listdir(system_image_dir)):
+        if name.startswith('ramdisk.img'):
+            continue
+        stat = os.stat(os.path.join(system_image_dir, name))
+        digest.update(f'{name}:{stat.st_size}:{int(stat.st_mtime)}\n'.encode())
+
+
+class PreparedImageCache:
+    """
+    Tracks a Quickboot snapshot of a fully prepared device (rooted, with the APK
+    installed and the given CA certificate in use), keyed by a hash of the system
+    image, APK and certificate. Any change to those inputs changes the key, so the
+    stale snapshot is ignored and replaced on the next save.
+    """
+
+    def __init__(self, android_home, apk_path, cert_path=None, avd_home=None, avd_name=AVD_NAME):
+        self.avd_name = avd_name
+        self.avd_dir = avd_directory(avd_home or default_avd_home(), avd_name)
+
+        digest = hashlib.sha256()
+        system_image_fingerprint(system_image_directory(android_home, self.avd_dir), digest)
+        for path in (apk_path, cert_path):
+            digest.update(b'\0')
+            if path and os.path.exists(path):
+                _hash_file(path, digest)
+
+        self.key = digest.hexdigest()
+        self.snapshot_name = SNAPSHOT_PREFIX + self.key[:16]
+
+    @property
+    def _snapshots_dir(self):
+        return os.path.join(self.avd_dir, 'snapshots')
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.avd_dir, CACHE_MANIFEST)
+
+    def is_ready(self):
+        """
+        Returns True if a snapshot matching the current inputs exists.
+        """
+        if not os.path.isdir(os.path.join(self._snapshots_dir, self.snapshot_name)):
+            return False
+        try:
+            with open(self._manifest_path, encoding='utf-8') as manifest_file:
+                return json.load(manifest_file).get('key') == self.key
+        except (OSError, ValueError):
+            return False
+
+    def restore_args(self, read_only=False):
+        """
+        Emulator arguments to boot from the prepared snapshot. The snapshot is never
+        overwritten on exit, so every run starts from the same prepared state.
+
+        With read_only, the AVD is opened read-only, so that several emulators can
+        run from the same prepared snapshot at once.
+        """
+        return ['-snapshot', self.snapshot_name, '-no-snapshot-save'] + (['-read-only'] if read_only else [])
+
+    @staticmethod
+    def rebuild_args():
+        """
+        Emulator arguments for the cold boot that prepares a new image: no snapshot is
+        loaded or auto-saved, but saving our named snapshot explicitly still works.
+        """
+        return ['-no-snapshot-load', '-no-snapshot-save']
+
+    @contextmanager
+    def lock(self):
+        """
+        Holds an exclusive lock on preparing this AVD, so that concurrent runs don't
+        rebuild the same image at once. Callers should re-check is_ready() once they
+        hold it, since another run may have finished preparing in the meantime.
+        """
+        if fcntl is None:
+            yield
+            return
+
+        with open(os.path.join(self.avd_dir, CACHE_LOCK), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self, adb_path, serial=None, timeout=120):
+        """
+        Saves the running emulator's state as the prepared snapshot, and drops any
+        snapshots left over from previous inputs.
+        """
+        print(f"Saving prepared image snapshot {self.snapshot_name}...")
+        start_time = time.time()
+
+        adb_command = [adb_path] + (['-s', serial] if serial else [])
+        result = subprocess.run(
+            adb_command + ['emu', 'avd', 'snapshot', 'save', self.snapshot_name],
+            capture_output=True,
+            timeout=timeout
+        )
+        output = result.stdout.decode('utf-8', errors='replace')
+        if result.returncode != 0 or 'KO' in output:
+            raise Exception(f"Failed to save emulator snapshot: {output.strip()}")
+
+        with open(self._manifest_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump({
+                'key': self.key,
+                'snapshot': self.snapshot_name,
+                'created': time.time()
+            }, manifest_file)
+
+        self.prune()
+        print(f"Snapshot saved in {time.time() - start_time:.1f}s.")
+
+    def prune(self):
+        if not os.path.isdir(self._snapshots_dir):
+            return
+        for name in os.listdir(self._snapshots_dir):
+            if name.startswith(SNAPSHOT_PREFIX) and name != self.snapshot_name:
+                shutil.rmtree(os.path.join(self._snapshots_dir, name), ignore_errors=True)
@@ -0,0 +1,155 @@
+"""
+A small client for the Android emulator's control console, which each emulator
+serves on 127.0.0.1 at its console port (the <port> of its emulator-<port> serial).
+
+This talks to one specific emulator directly, rather than going through the ADB
+server (as 'adb emu' does), so stopping an emulator can't affect any others on
+the same host, and doesn't depend on the ADB server being healthy.
+
+The protocol is line-based: the console greets each connection, then answers
+every command with its output followed by a line of OK (or OK: <message>) on
+success, or KO: <message> on failure. Unless the auth token file is empty, a
+connection must first authenticate with 'auth <token>', using the token the
+emulator saved to ~/.emulator_console_auth_token.
+
+    with EmulatorConsole(5554) as console:
+        console.command('avd snapshot list')
+
+    kill_emulator(5554)  # Returns once the emulator has closed its console
+"""
+
+import os
+import re
+import socket
+import time
+
+from emulator import home_directory
+
+CONSOLE_HOST = '127.0.0.1'
+AUTH_TOKEN_FILE = '.emulator_console_auth_token'
+
+
+class EmulatorConsoleError(Exception):
+    pass
+
+
+def console_auth_token(path=None):
+    """
+    Returns the console auth token, or None if there isn't one (so no auth is needed).
+    """
+    try:
+        with open(path or os.path.join(home_directory(), AUTH_TOKEN_FILE), encoding='utf-8') as token_file:
+            return token_file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def console_port(serial):
+    """
+    Returns the console port of an emulator-<port> serial, or None for other devices.
+    """
+    match = re.fullmatch(r'emulator-(\d+)', serial or '')
+    return int(match.group(1)) if match else None
+
+
+class EmulatorConsole:
+    def __init__(self, port, host=CONSOLE_HOST, token=None, timeout=5):
+        # If no token is given, the emulator's own token file is used if it asks for one
+        self.port = port
+        self.host = host
+        self.token = token
+        self.timeout = timeout
+        self.sock = None
+        self._buffer = b''
+
+    def connect(self):
+        try:
+            self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        except OSError as e:
+            raise EmulatorConsoleError(f"Couldn't connect to the emulator console on port {self.port}: {e}") from None
+
+        try:
+            try:
+                greeting = self._read_reply()
+            except socket.timeout:
+                raise EmulatorConsoleError("No greeting from the emulator console") from None
+            if 'Authentication required' in greeting:
+                token = self.token or console_auth_token()
+                if token is None:
+                    raise EmulatorConsoleError(f"The emulator console asked for auth, but there's no {AUTH_TOKEN_FILE}")
+                self.command(f'auth {token}')
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def _read_line(self):
+        while b'\n' not in self._buffer:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise EmulatorConsoleError("The emulator console closed the connection unexpectedly")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line.decode('utf-8', errors='replace').rstrip('\r')
+
+    def _read_reply(self):
+        lines = []
+        while True:
+            line = self._read_line()
+            if line == 'OK' or line.startswith('OK:'):
+                lines.append(line[3:].strip())
+                return '\n'.join(filter(None, lines))
+            elif line.startswith('KO'):
+                raise EmulatorConsoleError(line[3:].strip() or "Command failed")
+            lines.append(line)
+
+    def command(self, command):
+        """
+        Runs a console command, returning its output, or raising an EmulatorConsoleError
+        if the emulator reports that it failed.
+        """
+        try:
+            self.sock.sendall(command.encode('utf-8') + b'\n')
+            return self._read_reply()
+        except socket.timeout:
+            raise EmulatorConsoleError(f"No reply from the emulator console to {command.split()[0]}") from None
+
+    def kill(self, timeout=10):
+        """
+        Asks the emulator to exit, and waits for it to close the console, which it does
+        as its process exits. Raises an EmulatorConsoleError if it's still open after
+        the timeout.
+        """
+        self.command('kill')
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                self.sock.settimeout(max(deadline - time.monotonic(), 0.01))
+                if not self.sock.recv(4096):
+                    return
+        except socket.timeout:
+            raise EmulatorConsoleError(f"The emulator on port {self.port} was still running {timeout}s after kill") from None
+        except ConnectionResetError:
+            return
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def kill_emulator(port, timeout=10, token=None):
+    """
+    Stops the emulator with the given console port, returning once it's exiting.
+    """
+    with EmulatorConsole(port, token=token) as console:
+        console.kill(timeout)
@@ -0,0 +1,275 @@
+"""
+Decodes the bodies of many captured exchanges at once, across a pool of processes.
+
+Exchanges stream in from any iterable and back out in the same order, with each
+message's body already decoded (see _Message.decoded). Decompression (gzip,
+deflate, brotli & zstd) runs in worker processes, so a large capture uses every
+core. Bodies small enough that sending them to a worker would cost more than
+decoding them are decoded inline.
+
+Memory stays bounded however large the capture: once the exchanges waiting to be
+passed on hold max_in_flight bytes of bodies (raw, plus the results of those
+already decoded), no more exchanges are read until the oldest is done. As a
+result's size isn't known until it's decoded, only a couple of bodies per worker
+are decoded ahead at a time. Identical
+bodies (the same encoding & bytes, by hash) are only decoded once while their
+result is cached, up to cache_size bytes.
+
+    with BodyDecoder() as decoder:
+        for exchange in decoder.decode(exchanges):
+            exchange.response.decoded_body() # Already decoded
+
+    python3 exchange_decoding.py exchanges.jsonl [--workers 4] [-o decoded.jsonl]
+
+writes each exchange (one per line, as streamed by the API server) with its
+bodies decoded and content-encoding headers dropped, and prints stats to stderr.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+from httptoolkit_api import Exchange, decode_body
+
+DEFAULT_MAX_IN_FLIGHT = 256 << 20
+DEFAULT_CACHE_SIZE = 64 << 20
+INLINE_SIZE = 16 << 10
+MAX_PENDING = 4096
+
+
+class BodyDecoder:
+    """
+    A pool of decoding processes (started on first use) and the cache of recent results.
+    Close it (or use 'with') when done, to stop the pool.
+    """
+
+    def __init__(self, workers=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 cache_size=DEFAULT_CACHE_SIZE, inline_size=INLINE_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight
+        self.cache_size = cache_size
+        self.inline_size = inline_size
+        self.stats = {'bodies': 0, 'duplicates': 0, 'inline': 0, 'raw_bytes': 0, 'decoded_bytes': 0}
+        self._pool = None
+        self._cache = OrderedDict() # Body hash -> [future, size]
+        self._cache_bytes = 0
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        self._cache.clear()
+        self._cache_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _evict(self):
+        while self._cache_bytes > self.cache_size and self._cache:
+            _, (_, size) = self._cache.popitem(last=False)
+            self._cache_bytes -= size
+
+    def _submit(self, message):
+        """
+        Returns a future of the message's decoded body and its cache key, or None if there's
+        nothing to decode.
+        """
+        encoding = message.header('content-encoding')
+        if message.decoded is not None or not message.body or not encoding:
+            return None
+
+        self.stats['bodies'] += 1
+        self.stats['raw_bytes'] += len(message.body)
+        digest = hashlib.blake2b(message.body, digest_size=20)
+        digest.update(b'\0' + encoding.lower().encode('utf-8'))
+        key = digest.digest()
+
+        entry = self._cache.get(key)
+        if entry is not None:
+            self._cache.move_to_end(key)
+            self.stats['duplicates'] += 1
+            return entry[0], key
+
+        if self.workers == 1 or len(message.body) <= self.inline_size:
+            self.stats['inline'] += 1
+            future = Future()
+            try:
+                future.set_result(decode_body(message.body, encoding))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers)
+            future = self._pool.submit(decode_body, message.body, encoding)
+
+        # Sized by the raw body until decoded, then by the result:
+        self._cache[key] = [future, len(message.body)]
+        self._cache_bytes += len(message.body)
+        self._evict()
+        return future, key
+
+    def _finish(self, exchange, jobs):
+        for message, future, key in jobs:
+            try:
+                message.decoded = future.result()
+            except Exception:
+                # Left undecoded: decoded_body() raises the error if it's ever needed
+                continue
+            self.stats['decoded_bytes'] += len(message.decoded)
+
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] is future:
+                self._cache_bytes += len(message.decoded) - entry[1]
+                entry[1] = len(message.decoded)
+        self._evict()
+        return exchange
+
+    def decode(self, exchanges):
+        """
+        Yields each of the exchanges, in order, once its bodies have been decoded.
+        """
+        pending = deque() # (exchange, [(message, future, cache key)], raw size)
+        in_flight = 0
+        # Future -> [pending exchanges using it, size of its result]. A result shared by
+        # several exchanges (a duplicate body) is only held, and counted, once.
+        held = {}
+        undone = set()
+        done = deque() # Futures finished since last counted (appended from pool threads)
+
+        def count_done():
+            nonlocal in_flight
+            while done:
+                future = done.popleft()
+                undone.discard(future)
+                entry = held.get(future)
+                if entry is not None and entry[1] == 0 and not future.cancelled() and future.exception() is None:
+                    entry[1] = len(future.result())
+                    in_flight += entry[1]
+
+        def release(jobs):
+            nonlocal in_flight
+            for _, future, _ in jobs:
+                entry = held[future]
+                entry[0] -= 1
+                if entry[0] == 0:
+                    in_flight -= entry[1]
+                    del held[future]
+
+        try:
+            for exchange in exchanges:
+                jobs = []
+                for message in (exchange.request, exchange.response):
+                    job = self._submit(message)
+                    if job is None:
+                        continue
+                    jobs.append((message, *job))
+                    future = job[0]
+                    if future not in held:
+                        held[future] = [0, 0]
+                        undone.add(future)
+                        future.add_done_callback(done.append)
+                    held[future][0] += 1
+                size = sum(len(message.body) for message, _, _ in jobs)
+                pending.append((exchange, jobs, size))
+                in_flight += size
+
+                while True:
+                    # Decoded results count towards the limit as soon as they're done:
+                    count_done()
+
+                    # Pass on everything finished at the front, waiting only if over the limits:
+                    while pending and (
+                        in_flight > self.max_in_flight or
+                        len(pending) > MAX_PENDING or
+                        all(future.done() for _, future, _ in pending[0][1])
+                    ):
+                        exchange, jobs, size = pending.popleft()
+                        in_flight -= size
+                        release(jobs)
+                        yield self._finish(exchange, jobs)
+                        count_done()
+
+                    # The size of a result isn't known until it's done, so no more bodies are
+                    # queued than the workers can be decoding at once:
+                    if len(undone) <= self.workers * 2:
+                        break
+                    wait(undone, return_when=FIRST_COMPLETED)
+
+            while pending:
+                exchange, jobs, _ = pending.popleft()
+                yield self._finish(exchange, jobs)
+        finally:
+            # Anything not yet started is no longer needed:
+            for _, jobs, _ in pending:
+                for _, future, _ in jobs:
+                    future.cancel()
+
+
+def decode_exchanges(exchanges, **options):
+    """
+    Yields the exchanges in order with their bodies decoded, using a pool just for them.
+    Takes the same options as BodyDecoder.
+    """
+    with BodyDecoder(**options) as decoder:
+        yield from decoder.decode(exchanges)
+
+
+def read_exchanges(lines):
+    """
+    Parses exchanges from JSONL lines, as streamed by the API server.
+    """
+    for line in lines:
+        if line.strip():
+            yield Exchange.from_event(json.loads(line))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('exchanges', nargs='?', help='JSONL exchanges (default: stdin)')
+    parser.add_argument('-o', '--output', help='Where to write the decoded exchanges (default: stdout)')
+    parser.add_argument('--workers', type=int, help='Decoding processes (default: one per core)')
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT >> 20, help='In MB')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE >> 20, help='In MB')
+    args = parser.parse_args()
+
+    input_file = open(args.exchanges, encoding='utf-8') if args.exchanges else sys.stdin
+    output_file = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    start_time = time.perf_counter()
+    count = failed = 0
+    try:
+        with BodyDecoder(args.workers, args.max_in_flight << 20, args.cache_size << 20) as decoder:
+            for exchange in decoder.decode(read_exchanges(input_file)):
+                try:
+                    event = exchange.to_event(decoded=True)
+                except Exception:
+                    # Undecodable (e.g. truncated) bodies are written as they were captured
+                    event = exchange.to_event()
+                    failed += 1
+                output_file.write(json.dumps(event) + '\n')
+                count += 1
+            stats = decoder.stats
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    print(
+        f"Decoded {count} exchanges ({stats['bodies']} encoded bodies, {stats['duplicates']} duplicates, "
+        f"{stats['raw_bytes'] / (1 << 20):.1f}MB -> {stats['decoded_bytes'] / (1 << 20):.1f}MB) "
+        f"in {time.perf_counter() - start_time:.2f}s with {decoder.workers} workers"
+        + (f", {failed} left encoded as they couldn't be decoded" if failed else ""),
+        file=sys.stderr
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,502 @@
+"""
+Declarative extraction of values from captured exchange bodies.
+
+A rule set maps each field to where its value is found in the (decoded) body: a
+JSON pointer ('/data/device_id'), a JSONPath ('$.data.items[0].id', '$..id') or
+a regex (its first group, or the whole match), plus the type to coerce it to.
+Rules are compiled once, and then every field is pulled from each body in one go:
+JSON rules share a single parse.
+
+    extractor = Extractor({
+        'device_id': {'pointer': '/device_id_str'},
+        'new_user': {'pointer': '/new_user', 'type': 'int'},
+        'region': {'regex': r'"region":\\s*"(\\w+)"', 'required': False}
+    })
+    values = extractor.extract(exchange)
+
+Bodies over STREAMING_THRESHOLD aren't parsed in full when every JSON rule is a
+plain pointer or path: only the containers along those paths are walked, other
+values are skipped, and scanning stops once every field has been found. That's
+never slower than a full parse for deep documents, but walking objects with very
+many members is, so the threshold keeps it to bodies where memory matters.
+
+    python3 extraction.py rules.json exchanges.jsonl
+
+extracts the fields from each exchange (one per line, as streamed by the API
+server, with bodies decoded across cores by exchange_decoding.py) and prints
+them as JSONL.
+"""
+
+import argparse
+import json
+import re
+import sys
+
+from exchange_decoding import decode_exchanges, read_exchanges
+from httptoolkit_api import Exchange
+
+STREAMING_THRESHOLD = 256 * 1024
+
+TYPES = ('json', 'str', 'int', 'float', 'bool')
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_MEMBER_KEY = re.compile(r'"((?:[^"\\]|\\.)*)"[ \t\n\r]*:[ \t\n\r]*', re.DOTALL)
+_PATH_STEP = re.compile(r"""
+    \.\.(?P<descend>[^.\[]+|\*)
+  | \.(?P<key>[^.\[]+)
+  | \[\s*(?:(?P<index>-?\d+)|(?P<wildcard>\*)|'(?P<single>(?:[^'\\]|\\.)*)'|"(?P<double>(?:[^"\\]|\\.)*)")\s*\]
+""", re.VERBOSE)
+
+_WILDCARD = object()
+_MISSING = object()
+
+
+class ExtractionError(ValueError):
+    pass
+
+
+def parse_pointer(pointer):
+    """
+    Splits an RFC 6901 JSON pointer into its reference tokens.
+    """
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise ExtractionError(f"Invalid JSON pointer {pointer!r}: must start with '/'")
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def parse_path(path):
+    """
+    Parses the JSONPath subset used in rules: child names ('.name', "['name']"), array
+    indices ('[0]', '[-1]'), wildcards ('.*', '[*]') and recursive descent ('..name').
+    Returns a list of steps: (kind, value), with kind 'child' or 'descend'.
+    """
+    if not path.startswith('$'):
+        raise ExtractionError(f"Invalid JSONPath {path!r}: must start with '$'")
+
+    steps = []
+    position = 1
+    while position < len(path):
+        match = _PATH_STEP.match(path, position)
+        if not match:
+            raise ExtractionError(f"Invalid JSONPath {path!r} at position {position}")
+        position = match.end()
+
+        if match.group('descend') is not None:
+            name = match.group('descend')
+            steps.append(('descend', _WILDCARD if name == '*' else name))
+        elif match.group('key') is not None:
+            name = match.group('key')
+            steps.append(('child', _WILDCARD if name == '*' else name))
+        elif match.group('index') is not None:
+            steps.append(('child', int(match.group('index'))))
+        elif match.group('wildcard') is not None:
+            steps.append(('child', _WILDCARD))
+        else:
+            quoted = match.group('single') if match.group('single') is not None else match.group('double')
+            steps.append(('child', re.sub(r'\\(.)', r'\1', quoted)))
+    return steps
+
+
+def _child(value, key):
+    """
+    Looks up a single step in a parsed document, returning _MISSING if it's not there.
+    String keys index arrays too, if numeric (as in JSON pointers).
+    """
+    if isinstance(value, dict):
+        return value.get(str(key), _MISSING)
+    if isinstance(value, list):
+        if isinstance(key, str):
+            if not key.isdigit():
+                return _MISSING
+            key = int(key)
+        return value[key] if -len(value) <= key < len(value) else _MISSING
+    return _MISSING
+
+
+def _children(value):
+    if isinstance(value, dict):
+        return list(value.values())
+    if isinstance(value, list):
+        return list(value)
+    return []
+
+
+def _descendants(value):
+    """
+    Yields every value within value (not value itself), depth first, in document order.
+    """
+    stack = list(reversed(_children(value)))
+    while stack:
+        current = stack.pop()
+        yield current
+        stack.extend(reversed(_children(current)))
+
+
+def _evaluate_path(document, steps):
+    """
+    Returns every match of a parsed JSONPath, in document order.
+    """
+    matches = [document]
+    for kind, key in steps:
+        if kind == 'descend':
+            candidates = []
+            for match in matches:
+                for value in [match, *_descendants(match)]:
+                    if key is _WILDCARD:
+                        if value is not match:
+                            candidates.append(value)
+                    elif isinstance(value, dict) and key in value:
+                        candidates.append(value[key])
+            matches = candidates
+        elif key is _WILDCARD:
+            matches = [child for match in matches for child in _children(match)]
+        else:
+            matches = [child for child in (_child(match, key) for match in matches) if child is not _MISSING]
+    return matches
+
+
+def coerce(value, type_name):
+    if type_name == 'json' or value is None:
+        return value
+    try:
+        if type_name == 'str':
+            return value if isinstance(value, str) else json.dumps(value)
+        elif type_name == 'int':
+            if isinstance(value, float) and not value.is_integer():
+                raise ValueError(f"{value} is not a whole number")
+            return int(value)
+        elif type_name == 'float':
+            return float(value)
+        elif type_name == 'bool':
+            if isinstance(value, str):
+                normalized = value.strip().lower()
+                if normalized not in ('true', 'false', '1', '0'):
+                    raise ValueError(f"{value!r} is not a boolean")
+                return normalized in ('true', '1')
+            return bool(value)
+    except (TypeError, ValueError) as e:
+        raise ExtractionError(f"Can't convert {value!r} to {type_name}: {e}")
+    raise ExtractionError(f"Unknown type {type_name!r}, expected one of {', '.join(TYPES)}")
+
+
+def _is_plain(steps):
+    return all(kind == 'child' and key is not _WILDCARD for kind, key in steps)
+
+
+class Rule:
+    """
+    One field's rule, compiled: exactly one of pointer, path or regex, the type to coerce
+    its value to, and whether it must be found (or else, its default). With 'all', a
+    JSONPath or regex rule returns every match, as a list.
+    """
+
+    def __init__(self, field, pointer=None, path=None, regex=None, type='json',
+                 required=True, default=None, all=False):
+        if sum(source is not None for source in (pointer, path, regex)) != 1:
+            raise ExtractionError(f"Rule for {field!r} needs exactly one of 'pointer', 'path' or 'regex'")
+        if type not in TYPES:
+            raise ExtractionError(f"Rule for {field!r} has unknown type {type!r}, expected one of {', '.join(TYPES)}")
+
+        self.field = field
+        self.type = type
+        self.required = required
+        self.default = default
+        self.all = all
+        self.regex = re.compile(regex) if regex is not None else None
+
+        # JSON rules as steps, with plain (key & index only) paths simplified to a list of keys:
+        self.steps = None
+        self.keys = None
+        if pointer is not None:
+            self.keys = parse_pointer(pointer)
+            if all:
+                raise ExtractionError(f"Rule for {field!r}: 'all' needs a JSONPath or regex")
+        elif path is not None:
+            self.steps = parse_path(path)
+            if not all and _is_plain(self.steps):
+                self.keys = [key for _, key in self.steps]
+
+    @property
+    def is_json(self):
+        return self.regex is None
+
+    def value(self, found):
+        """
+        Coerces the value(s) found (or _MISSING), applying the default when allowed.
+        """
+        if found is _MISSING or (self.all and not found):
+            if self.required:
+                raise ExtractionError(f"No value found for {self.field!r}")
+            return self.default
+        if self.all:
+            return [coerce(value, self.type) for value in found]
+        return coerce(found, self.type)
+
+
+class _PathNode:
+    """
+    A node of the trie of plain JSON paths, walked by the streaming scanner.
+    """
+
+    def __init__(self):
+        self.children = {}
+        self.rules = []
+
+
+class _ScanComplete(Exception):
+    pass
+
+
+class _StreamingScanner:
+    """
+    Finds the values at a set of plain paths in a JSON document, without parsing the
+    rest of it: containers on a path are walked member by member, other values are
+    skipped over (parsed by the C decoder, and dropped), and the scan stops as soon
+    as every path has been found.
+    """
+
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, root, rule_count):
+        self.root = root
+        self.rule_count = rule_count
+
+    def scan(self, text):
+        self.text = text
+        self.found = {}
+        try:
+            self._value(_WHITESPACE.match(text, 0).end(), self.root)
+        except _ScanComplete:
+            pass
+        except (json.JSONDecodeError, IndexError) as e:
+            raise ExtractionError(f"Body isn't valid JSON: {e}")
+        finally:
+            self.text = None
+        return self.found
+
+    def _skip(self, index):
+        return self._decoder.raw_decode(self.text, index)[1]
+
+    def _found(self, node, value):
+        for rule in node.rules:
+            self.found[rule.field] = value
+        # Paths below this one are in this value, which is already parsed:
+        stack = [(node, value)]
+        while stack:
+            current, current_value = stack.pop()
+            for key, child in current.children.items():
+                child_value = _child(current_value, key)
+                if child_value is _MISSING:
+                    continue
+                for rule in child.rules:
+                    self.found[rule.field] = child_value
+                stack.append((child, child_value))
+        if len(self.found) == self.rule_count:
+            raise _ScanComplete()
+
+    def _value(self, index, node):
+        """
+        Scans the value starting at index (after any whitespace), returning where it ends.
+        """
+        text = self.text
+        if node.rules:
+            value, end = self._decoder.raw_decode(text, index)
+            self._found(node, value)
+            return end
+
+        opener = text[index]
+        if opener == '{':
+            return self._object(index + 1, node)
+        elif opener == '[':
+            return self._array(index + 1, node)
+        return self._skip(index)
+
+    def _object(self, index, node):
+        text = self.text
+        index = _WHITESPACE.match(text, index).end()
+        if text[index] == '}':
+            return index + 1
+
+        while True:
+            match = _MEMBER_KEY.match(text, index)
+            if not match:
+                raise ExtractionError(f"Body isn't valid JSON: expected a member name at position {index}")
+            key = match.group(1)
+            if '\\' in key:
+                key = json.loads(f'"{key}"')
+
+            child = node.children.get(key)
+            index = self._value(match.end(), child) if child else self._skip(match.end())
+
+            index = _WHITESPACE.match(text, index).end()
+            if text[index] == '}':
+                return index + 1
+            if text[index] != ',':
+                raise ExtractionError(f"Body isn't valid JSON: expected ',' or '}}' at position {index}")
+            index = _WHITESPACE.match(text, index + 1).end()
+
+    def _array(self, index, node):
+        text = self.text
+        index = _WHITESPACE.match(text, index).end()
+        if text[index] == ']':
+            return index + 1
+
+        position = 0
+        while True:
+            child = node.children.get(str(position))
+            index = self._value(index, child) if child else self._skip(index)
+            position += 1
+
+            index = _WHITESPACE.match(text, index).end()
+            if text[index] == ']':
+                return index + 1
+            if text[index] != ',':
+                raise ExtractionError(f"Body isn't valid JSON: expected ',' or ']' at position {index}")
+            index = _WHITESPACE.match(text, index + 1).end()
+
+
+class Extractor:
+    """
+    A compiled rule set. rules maps each field to its rule options (see Rule), and
+    message picks which body of an exchange to extract from: 'response' or 'request'.
+    """
+
+    def __init__(self, rules, message='response', streaming_threshold=STREAMING_THRESHOLD):
+        if message not in ('response', 'request'):
+            raise ExtractionError(f"Unknown message {message!r}, expected 'response' or 'request'")
+        self.message = message
+        self.streaming_threshold = streaming_threshold
+        self.rules = [Rule(field, **options) for field, options in rules.items()]
+
+        json_rules = [rule for rule in self.rules if rule.is_json]
+        self._json_rules = json_rules
+        # Negative indices can't be resolved while streaming, before the array's end:
+        self._streamable = all(
+            rule.keys is not None and not any(isinstance(key, int) and key < 0 for key in rule.keys)
+            for rule in json_rules
+        )
+        self._scanner = None
+        if json_rules and self._streamable:
+            root = _PathNode()
+            for rule in json_rules:
+                node = root
+                for key in rule.keys:
+                    # Keys as in JSON pointers: indices are matched as numeric strings
+                    node = node.children.setdefault(str(key), _PathNode())
+                node.rules.append(rule)
+            self._scanner = _StreamingScanner(root, len(json_rules))
+
+        self._regex_rules = [rule for rule in self.rules if not rule.is_json]
+
+    @classmethod
+    def from_file(cls, path, **options):
+        with open(path, encoding='utf-8') as rules_file:
+            return cls(json.load(rules_file), **options)
+
+    def _text(self, body):
+        if isinstance(body, Exchange):
+            body = getattr(body, self.message)
+        if isinstance(body, str):
+            return body
+        if not isinstance(body, (bytes, bytearray)):
+            try:
+                body = body.decoded_body()
+            except Exception as e: # Corrupt or truncated bodies fail in all sorts of ways
+                raise ExtractionError(f"Can't decode body: {e!r}")
+        return bytes(body).decode('utf-8', errors='replace')
+
+    def _json_values(self, text):
+        if self._scanner is not None and len(text) > self.streaming_threshold:
+            return self._scanner.scan(text)
+
+        try:
+            document = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ExtractionError(f"Body isn't valid JSON: {e}")
+
+        found = {}
+        for rule in self._json_rules:
+            if rule.keys is not None:
+                value = document
+                for key in rule.keys:
+                    value = _child(value, key)
+                    if value is _MISSING:
+                        break
+                if value is not _MISSING:
+                    found[rule.field] = value
+            else:
+                matches = _evaluate_path(document, rule.steps)
+                if rule.all:
+                    found[rule.field] = matches
+                elif matches:
+                    found[rule.field] = matches[0]
+        return found
+
+    def _regex_values(self, text):
+        # Each rule is searched on its own: in a combined alternation, one rule's match would
+        # hide any other rule's match that overlaps it.
+        found = {}
+        for rule in self._regex_rules:
+            if rule.all:
+                found[rule.field] = [
+                    match.group(1) if rule.regex.groups else match.group(0)
+                    for match in rule.regex.finditer(text)
+                ]
+            else:
+                match = rule.regex.search(text)
+                if match:
+                    found[rule.field] = match.group(1) if rule.regex.groups else match.group(0)
+        return found
+
+    def extract(self, body):
+        """
+        Extracts every field from one body: an Exchange (using its message), a captured
+        request or response, or a decoded body (bytes or str). Returns a dict of fields.
+        Raises ExtractionError if a required field is missing, or can't be converted.
+        """
+        text = self._text(body)
+        found = {}
+        if self._json_rules:
+            found.update(self._json_values(text))
+        if self._regex_rules:
+            found.update(self._regex_values(text))
+        return {rule.field: rule.value(found.get(rule.field, _MISSING)) for rule in self.rules}
+
+    def extract_all(self, bodies, skip_errors=False):
+        """
+        Extracts every field from each of a batch of bodies (as for extract()), yielding
+        a dict for each. With skip_errors, bodies missing required fields are skipped.
+        """
+        for body in bodies:
+            try:
+                yield self.extract(body)
+            except ExtractionError:
+                if not skip_errors:
+                    raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('rules', help='JSON file mapping each field to its rule')
+    parser.add_argument('exchanges', nargs='?', help='JSONL exchanges (default: stdin)')
+    parser.add_argument('--request', action='store_true', help='Extract from request bodies, not responses')
+    parser.add_argument('--skip-errors', action='store_true', help='Skip exchanges missing required fields')
+    args = parser.parse_args()
+
+    extractor = Extractor.from_file(args.rules, message='request' if args.request else 'response')
+    input_file = open(args.exchanges, encoding='utf-8') if args.exchanges else sys.stdin
+    try:
+        exchanges = decode_exchanges(read_exchanges(input_file))
+        for values in extractor.extract_all(exchanges, skip_errors=args.skip_errors):
+            print(json.dumps(values))
+    except ExtractionError as e:
+        sys.exit(f"Extraction failed: {e}")
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,494 @@
+"""
+A stand-in for the ADB server and the devices behind it, for running the
+orchestration scripts offline, without the Android SDK or an emulator.
+
+FakeAdbServer speaks the host protocol that adb_client.py (and the real adb
+binary) use. Each FakeDevice runs its shell: and exec: services with the
+host's own sh, with fake versions of the device's tools (getprop, pm, cmd,
+input, monkey, etc: see fake_device_tools.py) first on the PATH. Its state
+(properties, install sessions & installed packages) lives in a directory of
+its own.
+
+Devices are scriptable: how long they take to come online and to finish
+booting, how many APK writes fail, and when (if ever) they disappear. Emulators
+started with the fake emulator binary (see fake_sdk.py) attach themselves as
+devices with the server's emulator settings, and are killed & snapshotted via
+'adb emu' as usual.
+
+    python3 fakes/fake_adb.py [--port 5037] [--device emulator-5554] [--boot-delay 2] [--install-failures 1]
+
+Besides the real host requests, the server accepts a few of its own, used by the
+fake binaries: host:fake-emulator:<json> (an emulator attaching, for as long as
+the connection stays open), host-serial:<serial>:fake-emu:<command> (adb emu)
+and host-serial:<serial>:fake-event:<json> (device tools reporting input & app
+launches, passed on to on_event callbacks).
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+FAKES_DIR = os.path.dirname(os.path.abspath(__file__))
+DEVICE_TOOLS_SCRIPT = os.path.join(FAKES_DIR, 'fake_device_tools.py')
+DEVICE_TOOLS = ('getprop', 'pm', 'cmd', 'input', 'monkey', 'am', 'wm', 'getevent', 'sendevent', 'ip')
+
+DEFAULT_PORT = 5037
+DEFAULT_PACKAGE = 'com.zhiliaoapp.musically'
+DEFAULT_PROPERTIES = {
+    'ro.build.version.sdk': '31',
+    'ro.build.version.release': '12',
+    'ro.product.model': 'sdk_gphone64_arm64',
+    'ro.kernel.qemu': '1'
+}
+
+
+def _read_exactly(sock, length):
+    data = bytearray()
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def _read_request(sock):
+    length = _read_exactly(sock, 4)
+    if length is None:
+        return None
+    request = _read_exactly(sock, int(length, 16))
+    return None if request is None else request.decode('utf-8')
+
+
+def _hex_string(message):
+    payload = message.encode('utf-8')
+    return b'%04x' % len(payload) + payload
+
+
+def _okay(sock, message=None):
+    sock.sendall(b'OKAY' + (_hex_string(message) if message is not None else b''))
+
+
+def _fail(sock, message):
+    sock.sendall(b'FAIL' + _hex_string(message))
+
+
+class FakeDevice:
+    """
+    A scripted device. Delays are in seconds from when it's attached: it's listed as
+    offline until transport_delay has passed, and finishes booting (so sys.boot_completed
+    is set, and the package manager & network answer) after boot_delay. The first
+    install_failures APK writes fail partway through. If disappear_after is set, the
+    device is detached then, as if unplugged or crashed.
+
+    Fake APKs can name their package on their first line ('package:<name>'). Others are
+    installed as the device's default package.
+    """
+
+    def __init__(self, serial, transport_delay=0, boot_delay=1, install_failures=0,
+                 disappear_after=None, package=DEFAULT_PACKAGE, properties=None, state_dir=None):
+        self.serial = serial
+        self.transport_delay = transport_delay
+        self.boot_delay = boot_delay
+        self.install_failures = install_failures
+        self.disappear_after = disappear_after
+        self.package = package
+        self.properties = dict(DEFAULT_PROPERTIES, **(properties or {}))
+
+        self._owns_state_dir = state_dir is None
+        self.state_dir = state_dir or tempfile.mkdtemp(prefix=f'fake-{serial}-')
+        self.state = 'offline'
+        self.events = []
+        self.emulator = None # The connection of the fake emulator running it, if any
+        self.avd_dir = None
+        self._processes = set()
+        self._connections = set()
+        self._timers = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Wipes all the device's data, as for a factory reset (or an emulator's -wipe-data).
+        """
+        for name in ('data', 'sessions'):
+            shutil.rmtree(os.path.join(self.state_dir, name), ignore_errors=True)
+        os.makedirs(os.path.join(self.state_dir, 'data', 'app'))
+        os.makedirs(os.path.join(self.state_dir, 'sessions'))
+        # Consumed by the device tools, as writes fail:
+        with open(os.path.join(self.state_dir, 'install_failures'), 'w') as failures_file:
+            failures_file.write(str(self.install_failures))
+        self._write_state(booted=False)
+
+    def _write_state(self, booted):
+        properties = dict(self.properties)
+        if booted:
+            properties['sys.boot_completed'] = '1'
+        state = {
+            'serial': self.serial,
+            'booted': booted,
+            'properties': properties,
+            'package': self.package
+        }
+        temp_path = os.path.join(self.state_dir, 'device.json.tmp')
+        with open(temp_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(temp_path, os.path.join(self.state_dir, 'device.json'))
+
+    def installed_packages(self):
+        app_dir = os.path.join(self.state_dir, 'data', 'app')
+        if not os.path.isdir(app_dir):
+            return []
+        return sorted(
+            package.rsplit('-', 1)[0]
+            for install in os.listdir(app_dir)
+            for package in os.listdir(os.path.join(app_dir, install))
+        )
+
+    def _schedule(self, delay, callback):
+        timer = threading.Timer(max(delay, 0), callback)
+        timer.daemon = True
+        self._timers.append(timer)
+        timer.start()
+
+    def _attached(self, server):
+        self.state = 'offline'
+        self._write_state(booted=False)
+
+        def online():
+            self.state = 'device'
+            server._devices_changed()
+        self._schedule(self.transport_delay, online)
+        self._schedule(self.boot_delay, lambda: self._write_state(booted=True))
+        if self.disappear_after is not None:
+            self._schedule(self.disappear_after, lambda: server.detach(self.serial))
+
+    def _detached(self):
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+        self.state = 'offline'
+
+        with self._lock:
+            processes, self._processes = self._processes, set()
+            connections, self._connections = self._connections, set()
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+        for sock in connections:
+            _close(sock)
+
+    def _environment(self, server):
+        return dict(
+            os.environ,
+            PATH=os.pathsep.join([server.tools_dir, os.environ.get('PATH', '')]),
+            FAKE_DEVICE_DIR=self.state_dir,
+            FAKE_DEVICE_SERIAL=self.serial,
+            FAKE_ADB_PORT=str(server.port)
+        )
+
+    def run_service(self, server, sock, command, merge_stderr):
+        """
+        Runs a shell command (or an interactive shell, if it's empty) with the connection
+        as its stdin & stdout, until it exits.
+        """
+        process = subprocess.Popen(
+            ['sh', '-c', command] if command else ['sh'],
+            stdin=sock.fileno(),
+            stdout=sock.fileno(),
+            stderr=subprocess.STDOUT if merge_stderr else subprocess.DEVNULL,
+            cwd=self.state_dir,
+            env=self._environment(server)
+        )
+        with self._lock:
+            self._processes.add(process)
+            self._connections.add(sock)
+        try:
+            process.wait()
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+                self._connections.discard(sock)
+
+    def close(self):
+        self._detached()
+        if self._owns_state_dir:
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+
+
+def _close(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            self.server.fake.handle_connection(self.request)
+        except OSError:
+            pass # The client went away
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeAdbServer:
+    """
+    The fake ADB server. Devices can be attached & detached at any time, and emulators
+    attaching themselves get a FakeDevice with the emulator_settings given here. Call
+    start() (or use 'with') to listen, on 127.0.0.1.
+    """
+
+    def __init__(self, port=DEFAULT_PORT, emulator_settings=None):
+        self.requested_port = port
+        self.emulator_settings = emulator_settings or {}
+        self.devices = {}
+        self.on_event = [] # Callbacks, each called with (serial, event)
+        self._emulator_devices = {} # Serial -> device, kept between emulator runs
+        self._trackers = set()
+        self._lock = threading.RLock()
+        self._server = None
+        self.tools_dir = tempfile.mkdtemp(prefix='fake-device-tools-')
+        for tool in DEVICE_TOOLS:
+            path = os.path.join(self.tools_dir, tool)
+            with open(path, 'w') as wrapper:
+                wrapper.write(f'#!/bin/sh\nexec "{sys.executable}" "{DEVICE_TOOLS_SCRIPT}" {tool} "$@"\n')
+            os.chmod(path, 0o755)
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._server = _ThreadingServer(('127.0.0.1', self.requested_port), _Handler)
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever, name='fake-adb', daemon=True).start()
+        return self
+
+    def close(self):
+        for serial in list(self.devices):
+            self.detach(serial)
+        for device in self._emulator_devices.values():
+            device.close()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        shutil.rmtree(self.tools_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def attach(self, device):
+        with self._lock:
+            self.devices[device.serial] = device
+            device._attached(self)
+        self._devices_changed()
+        return device
+
+    def detach(self, serial):
+        with self._lock:
+            device = self.devices.pop(serial, None)
+        if device is None:
+            return
+        device._detached()
+        if device.emulator is not None:
+            _close(device.emulator)
+            device.emulator = None
+        self._devices_changed()
+
+    def _device_list(self):
+        with self._lock:
+            return ''.join(f'{serial}\t{device.state}\n' for serial, device in self.devices.items())
+
+    def _devices_changed(self):
+        device_list = _hex_string(self._device_list())
+        with self._lock:
+            trackers = list(self._trackers)
+        for sock in trackers:
+            try:
+                sock.sendall(device_list)
+            except OSError:
+                with self._lock:
+                    self._trackers.discard(sock)
+
+    def _find_device(self, serial):
+        with self._lock:
+            if serial is None:
+                candidates = list(self.devices.values())
+                if len(candidates) != 1:
+                    return None, 'no devices/emulators found' if not candidates else 'more than one device/emulator'
+                device = candidates[0]
+            else:
+                device = self.devices.get(serial)
+                if device is None:
+                    return None, f"device '{serial}' not found"
+        if device.state != 'device':
+            return None, 'device offline'
+        return device, None
+
+    def handle_connection(self, sock):
+        request = _read_request(sock)
+        if request is None:
+            return
+
+        if request == 'host:version':
+            _okay(sock, '0029')
+        elif request in ('host:devices', 'host:devices-l'):
+            _okay(sock, self._device_list())
+        elif request == 'host:track-devices':
+            with self._lock:
+                _okay(sock, self._device_list())
+                self._trackers.add(sock)
+            try:
+                while sock.recv(1024): # Until the client disconnects
+                    pass
+            finally:
+                with self._lock:
+                    self._trackers.discard(sock)
+        elif request == 'host:kill':
+            # Acknowledged, but the fake server keeps running, so a harness can use it for
+            # run after run.
+            _okay(sock)
+        elif request.startswith('host:fake-emulator:'):
+            self._run_emulator(sock, json.loads(request[len('host:fake-emulator:'):]))
+        elif request.startswith(('host:transport:', 'host:transport-any')):
+            serial = request[len('host:transport:'):] if request.startswith('host:transport:') else None
+            device, error = self._find_device(serial)
+            if device is None:
+                _fail(sock, error)
+                return
+            _okay(sock)
+            self._handle_device_service(sock, device)
+        elif request.startswith('host-serial:'):
+            serial, _, command = request[len('host-serial:'):].partition(':')
+            self._handle_host_serial(sock, serial, command)
+        else:
+            _fail(sock, f'unknown host service: {request}')
+
+    def _handle_device_service(self, sock, device):
+        service = _read_request(sock)
+        if service is None:
+            return
+
+        if service.startswith('shell:'):
+            _okay(sock)
+            device.run_service(self, sock, service[len('shell:'):], merge_stderr=True)
+        elif service.startswith('exec:'):
+            _okay(sock)
+            device.run_service(self, sock, service[len('exec:'):], merge_stderr=False)
+        elif service.startswith('reverse:'):
+            _okay(sock)
+            _okay(sock)
+        else:
+            _fail(sock, f'unsupported device service: {service}')
+
+    def _handle_host_serial(self, sock, serial, command):
+        with self._lock:
+            device = self.devices.get(serial)
+        if device is None:
+            _fail(sock, f"device '{serial}' not found")
+        elif command.startswith(('forward:', 'killforward:')):
+            _okay(sock)
+            _okay(sock)
+        elif command.startswith('fake-event:'):
+            event = json.loads(command[len('fake-event:'):])
+            device.events.append(event)
+            _okay(sock)
+            for callback in list(self.on_event):
+                callback(serial, event)
+        elif command.startswith('fake-emu:'):
+            self._handle_emulator_command(sock, device, command[len('fake-emu:'):].split())
+        else:
+            _fail(sock, f'unsupported host service: {command}')
+
+    def _run_emulator(self, sock, emulator):
+        serial = f"emulator-{emulator['port']}"
+        with self._lock:
+            if serial in self.devices:
+                _fail(sock, f'{serial} is already running')
+                return
+            device = self._emulator_devices.get(serial)
+            if device is None:
+                device = self._emulator_devices[serial] = FakeDevice(serial, **self.emulator_settings)
+            elif emulator.get('wipe'):
+                device.reset()
+            device.emulator = sock
+            device.avd_dir = emulator.get('avd_dir')
+            _okay(sock)
+            self.attach(device)
+
+        try:
+            while sock.recv(1024): # Until the emulator exits
+                pass
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                if self.devices.get(serial) is device:
+                    self.detach(serial)
+
+    def _handle_emulator_command(self, sock, device, command):
+        if device.emulator is None:
+            _fail(sock, f'{device.serial} is not an emulator')
+        elif command == ['kill']:
+            _okay(sock, 'OK: killing emulator, bye bye\n')
+            self.detach(device.serial)
+        elif command[:3] == ['avd', 'snapshot', 'save'] and len(command) == 4:
+            if device.avd_dir:
+                snapshot_dir = os.path.join(device.avd_dir, 'snapshots', command[3])
+                os.makedirs(snapshot_dir, exist_ok=True)
+                with open(os.path.join(snapshot_dir, 'snapshot.pb'), 'w') as snapshot:
+                    json.dump({'packages': device.installed_packages(), 'saved': time.time()}, snapshot)
+            _okay(sock, 'OK\n')
+        else:
+            _okay(sock, f"KO: unknown command: {' '.join(command)}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--device', action='append', default=[], help='Serial of a device to attach at startup')
+    parser.add_argument('--transport-delay', type=float, default=0)
+    parser.add_argument('--boot-delay', type=float, default=1)
+    parser.add_argument('--install-failures', type=int, default=0)
+    parser.add_argument('--disappear-after', type=float)
+    args = parser.parse_args()
+
+    settings = {
+        'transport_delay': args.transport_delay,
+        'boot_delay': args.boot_delay,
+        'install_failures': args.install_failures,
+        'disappear_after': args.disappear_after
+    }
+    with FakeAdbServer(args.port, emulator_settings=settings) as server:
+        for serial in args.device:
+            server.attach(FakeDevice(serial, **settings))
+        server.on_event.append(lambda serial, event: print(f"{serial}: {json.dumps(event)}"))
+        print(f"Fake ADB server listening on 127.0.0.1:{server.port}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
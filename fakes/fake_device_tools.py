@@ -0,0 +1,298 @@
+"""
+Fake versions of the Android device tools that the orchestration scripts use,
+run by fake_adb.py's devices (each tool on their PATH runs this script, with
+the tool's name as the first argument).
+
+Each works on the device's state directory ($FAKE_DEVICE_DIR): its properties
+and whether it has booted (device.json, written by the server), install sessions
+and installed packages. Input and app launches are reported to the fake ADB
+server, so a harness can react to them.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import socket
+import sys
+import uuid
+
+STATE_DIR = os.environ.get('FAKE_DEVICE_DIR', '.')
+
+# As listed by 'getevent -p' on an emulator:
+TOUCHSCREEN_LISTING = """add device 1: /dev/input/event2
+  name:     "virtio_input_multi_touch_1"
+  events:
+    KEY (0001): 014a
+    ABS (0003): 002f  : value 0, min 0, max 9, fuzz 0, flat 0, resolution 0
+                0035  : value 0, min 0, max 32767, fuzz 0, flat 0, resolution 0
+                0036  : value 0, min 0, max 32767, fuzz 0, flat 0, resolution 0
+                0039  : value 0, min 0, max 65535, fuzz 0, flat 0, resolution 0
+  input props:
+    INPUT_PROP_DIRECT
+add device 2: /dev/input/event0
+  name:     "Power Button"
+  events:
+    KEY (0001): 0074
+"""
+DISPLAY_SIZE = '1440x2560'
+
+
+def _device():
+    with open(os.path.join(STATE_DIR, 'device.json')) as state_file:
+        return json.load(state_file)
+
+
+def _report(event):
+    """
+    Passes an event to the fake ADB server, for its on_event callbacks.
+    """
+    payload = f"host-serial:{os.environ['FAKE_DEVICE_SERIAL']}:fake-event:{json.dumps(event)}".encode('utf-8')
+    with socket.create_connection(('127.0.0.1', int(os.environ['FAKE_ADB_PORT'])), timeout=10) as sock:
+        sock.sendall(b'%04x' % len(payload) + payload)
+        sock.recv(4)
+
+
+def _require_boot():
+    if not _device()['booted']:
+        sys.stderr.write("cmd: Can't find service: package\n")
+        sys.exit(20)
+
+
+def _app_dir():
+    return os.path.join(STATE_DIR, 'data', 'app')
+
+
+def _installed_apks(package):
+    """
+    Returns the paths of the package's installed APKs, base first.
+    """
+    app_dir = _app_dir()
+    for install in sorted(os.listdir(app_dir)):
+        for name in os.listdir(os.path.join(app_dir, install)):
+            if name.rsplit('-', 1)[0] == package:
+                package_dir = os.path.join(app_dir, install, name)
+                return sorted(
+                    (os.path.join(package_dir, apk) for apk in os.listdir(package_dir)),
+                    key=lambda path: (os.path.basename(path) != 'base.apk', path)
+                )
+    return []
+
+
+def _uninstall(package):
+    for path in _installed_apks(package)[:1]:
+        shutil.rmtree(os.path.dirname(os.path.dirname(path)))
+
+
+def _take_install_failure():
+    """
+    Returns True if this write should fail, using up one of the device's scripted failures.
+    """
+    with open(os.path.join(STATE_DIR, 'install_failures'), 'r+') as failures_file:
+        fcntl.flock(failures_file, fcntl.LOCK_EX)
+        remaining = int(failures_file.read() or 0)
+        if remaining <= 0:
+            return False
+        failures_file.seek(0)
+        failures_file.truncate()
+        failures_file.write(str(remaining - 1))
+        return True
+
+
+def _size_option(args):
+    if '-S' in args:
+        return int(args[args.index('-S') + 1])
+    return None
+
+
+def _positional(args):
+    """
+    Drops options (and the values of those taking one) from pm arguments.
+    """
+    positional = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in ('-S', '-i', '--user', '--install-location', '-p'):
+            skip = True
+        elif not arg.startswith('-') or arg == '-':
+            positional.append(arg)
+    return positional
+
+
+def _session_dir(session_id):
+    return os.path.join(STATE_DIR, 'sessions', session_id)
+
+
+def _write_session_file(session_id, name, size):
+    stdin = sys.stdin.buffer
+    if _take_install_failure():
+        stdin.read(min(size, 64 * 1024)) # Partway through, as if the connection dropped
+        print(f"Error: failed to write {name}: Broken pipe")
+        sys.exit(1)
+
+    path = os.path.join(_session_dir(session_id), name)
+    remaining = size
+    with open(path, 'wb') as output:
+        while remaining > 0:
+            chunk = stdin.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            output.write(chunk)
+            remaining -= len(chunk)
+    if remaining:
+        print(f"Error: expected {size} bytes for {name}, got {size - remaining}")
+        sys.exit(1)
+    print(f"Success: streamed {size} bytes")
+
+
+def _commit_session(session_id):
+    session_dir = _session_dir(session_id)
+    names = sorted(os.listdir(session_dir))
+    if not names:
+        print("Failure [INSTALL_FAILED_INVALID_APK: No APKs in session]")
+        sys.exit(1)
+
+    with open(os.path.join(session_dir, names[0]), 'rb') as base:
+        first_line = base.readline(256).decode('utf-8', errors='replace').strip()
+    package = first_line[len('package:'):] if first_line.startswith('package:') else _device()['package']
+
+    _uninstall(package)
+    package_dir = os.path.join(_app_dir(), f'~~{uuid.uuid4().hex[:22]}==', f'{package}-{uuid.uuid4().hex[:22]}==')
+    os.makedirs(package_dir)
+    for index, name in enumerate(names):
+        os.replace(os.path.join(session_dir, name), os.path.join(package_dir, 'base.apk' if index == 0 else name))
+    shutil.rmtree(session_dir)
+    print("Success")
+
+
+def package_manager(args):
+    _require_boot()
+    command, args = (args[0], args[1:]) if args else ('help', [])
+
+    if command == 'path':
+        package = _positional(args)[0]
+        if package == 'android':
+            print("package:/system/framework/framework-res.apk")
+            return
+        paths = _installed_apks(package)
+        for path in paths:
+            print(f"package:{path}")
+        sys.exit(0 if paths else 1)
+    elif command == 'list' and args[:1] == ['packages']:
+        for install in sorted(os.listdir(_app_dir())):
+            for name in os.listdir(os.path.join(_app_dir(), install)):
+                print(f"package:{name.rsplit('-', 1)[0]}")
+    elif command == 'install-create':
+        session_id = str(int.from_bytes(os.urandom(3), 'big'))
+        os.makedirs(_session_dir(session_id))
+        print(f"Success: created install session [{session_id}]")
+    elif command == 'install-write':
+        session_id, name = _positional(args)[:2]
+        if not os.path.isdir(_session_dir(session_id)):
+            print(f"Failure [INSTALL_FAILED_INTERNAL_ERROR: Unknown session {session_id}]")
+            sys.exit(1)
+        _write_session_file(session_id, name, _size_option(args))
+    elif command == 'install-commit':
+        _commit_session(_positional(args)[0])
+    elif command == 'install-abandon':
+        shutil.rmtree(_session_dir(_positional(args)[0]), ignore_errors=True)
+        print("Success")
+    elif command == 'install':
+        # Streamed from stdin (with -S), as a single session
+        session_id = str(int.from_bytes(os.urandom(3), 'big'))
+        os.makedirs(_session_dir(session_id))
+        _write_session_file(session_id, 'base.apk', _size_option(args))
+        _commit_session(session_id)
+    elif command == 'uninstall':
+        package = _positional(args)[0]
+        if not _installed_apks(package):
+            print("Failure [DELETE_FAILED_INTERNAL_ERROR]")
+            sys.exit(1)
+        _uninstall(package)
+        print("Success")
+    else:
+        sys.stderr.write(f"Unknown command: {command}\n")
+        sys.exit(1)
+
+
+def getprop(args):
+    properties = _device()['properties']
+    if args:
+        print(properties.get(args[0], args[1] if len(args) > 1 else ''))
+    else:
+        for name, value in sorted(properties.items()):
+            print(f"[{name}]: [{value}]")
+
+
+def cmd(args):
+    if args[:1] != ['package']:
+        sys.stderr.write(f"cmd: Can't find service: {args[0] if args else ''}\n")
+        sys.exit(20)
+    package_manager(args[1:])
+
+
+def input_command(args):
+    _report({'type': 'input', 'args': args})
+
+
+def _start_app(package):
+    if not _installed_apks(package):
+        print("** No activities found to run, monkey aborted.")
+        sys.exit(251)
+    _report({'type': 'app_start', 'package': package})
+
+
+def monkey(args):
+    _require_boot()
+    _start_app(args[args.index('-p') + 1])
+    print("Events injected: 1")
+
+
+def am(args):
+    _require_boot()
+    if args[:1] == ['start'] and '-n' in args:
+        _start_app(args[args.index('-n') + 1].split('/')[0])
+        print("Starting: Intent {}")
+    else:
+        sys.stderr.write(f"Unsupported am command: {' '.join(args)}\n")
+        sys.exit(1)
+
+
+def wm(args):
+    if args[:1] == ['size']:
+        print(f"Physical size: {DISPLAY_SIZE}")
+
+
+def getevent(args):
+    if '-p' in args:
+        sys.stdout.write(TOUCHSCREEN_LISTING)
+
+
+def sendevent(args):
+    with open(os.path.join(STATE_DIR, 'input-events.log'), 'a') as log:
+        log.write(' '.join(args) + '\n')
+
+
+def ip(args):
+    if args[:1] == ['route'] and _device()['booted']:
+        print("default via 10.0.2.2 dev eth0 table 1022 proto static")
+
+
+TOOLS = {
+    'getprop': getprop,
+    'pm': package_manager,
+    'cmd': cmd,
+    'input': input_command,
+    'monkey': monkey,
+    'am': am,
+    'wm': wm,
+    'getevent': getevent,
+    'sendevent': sendevent,
+    'ip': ip
+}
+
+
+if __name__ == '__main__':
+    TOOLS[sys.argv[1]](sys.argv[2:])
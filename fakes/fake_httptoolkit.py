@@ -0,0 +1,594 @@
+"""
+A stand-in for a local HTTP Toolkit server, emitting canned exchanges instead of
+proxying real traffic, for running the orchestration scripts offline.
+
+It serves the parts of the API server (version, config, interceptors and the
+filtered /exchanges/:proxyPort/stream) and the Mockttp admin server (starting &
+stopping sessions, their keep-alive stream, setting rules and GraphQL traffic
+subscriptions) that httptoolkit_api.py uses, with the same Origin checks.
+
+Activating an interceptor makes the session emit its canned exchanges: after
+emit_delay, or (with an ADB server given, from fake_adb.py) once the intercepted
+device launches an app, as when the real app starts sending traffic. By default
+those are a device register request as TikTok sends it (with fresh ids each
+time), preceded by a failed attempt and some unrelated traffic, so filters are
+exercised too.
+
+    python3 fakes/fake_httptoolkit.py [--api-port 45457] [--admin-port 45456] [--emit-delay 0.5] [--exchanges canned.jsonl]
+
+The exchanges file, if given, holds one exchange per line in the stream's own format.
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import http.server
+import json
+import os
+import queue
+import random
+import struct
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+FAKES_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(FAKES_DIR))
+
+from httptoolkit_api import ORIGIN # noqa: E402
+
+DEFAULT_API_PORT = 45457
+DEFAULT_ADMIN_PORT = 45456
+FIRST_PROXY_PORT = 8000
+
+DEVICE_REGISTER_URL = 'https://log16-normal-useast5.tiktokv.us/service/2/device_register/'
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def _message(headers, body, **fields):
+    return dict(
+        fields,
+        headers=headers,
+        body=base64.b64encode(body).decode('ascii'),
+        timingEvents={'startTime': time.time() * 1000},
+        tags=[]
+    )
+
+
+def make_exchange(method, url, status, request_body=b'', response_body=b'', response_headers=None):
+    """
+    Builds an exchange, in the format the API server's exchange stream sends.
+    """
+    host = urlsplit(url).netloc
+    return {
+        'id': str(uuid.uuid4()),
+        'request': _message(
+            {'host': host, 'user-agent': 'okhttp/3.12.13', 'content-length': str(len(request_body))},
+            request_body,
+            protocol='https',
+            httpVersion='1.1',
+            method=method,
+            url=url
+        ),
+        'response': _message(
+            dict({'content-length': str(len(response_body))}, **(response_headers or {})),
+            response_body,
+            statusCode=status,
+            statusMessage=http.HTTPStatus(status).phrase
+        )
+    }
+
+
+def default_exchanges():
+    """
+    The canned traffic of one app launch: unrelated requests, a failed device register
+    attempt, and then a successful one, with a gzipped body holding new ids.
+    """
+    device_id = str(random.randrange(7 * 10**18, 8 * 10**18))
+    install_id = str(random.randrange(7 * 10**18, 8 * 10**18))
+    register_body = json.dumps({
+        'server_time': int(time.time()),
+        'device_id': int(device_id),
+        'install_id': int(install_id),
+        'new_user': 1,
+        'device_id_str': device_id,
+        'install_id_str': install_id
+    }).encode()
+
+    return [
+        make_exchange('GET', 'https://www.tiktok.com/robots.txt', 200, response_body=b'User-agent: *\n'),
+        make_exchange('POST', DEVICE_REGISTER_URL, 503, b'{}', b'{"message": "retry"}',
+            {'content-type': 'application/json'}),
+        make_exchange('POST', DEVICE_REGISTER_URL, 200, b'{}', gzip.compress(register_body),
+            {'content-type': 'application/json; charset=utf-8', 'content-encoding': 'gzip'})
+    ]
+
+
+def _matches(filters, exchange):
+    # As in src/exchange-stream.ts
+    request, response = exchange['request'], exchange['response']
+
+    def headers_match(predicates, headers):
+        for name, expected in predicates.items():
+            value = headers.get(name)
+            if value is None:
+                return False
+            if expected is not None and expected not in (value if isinstance(value, list) else [value]):
+                return False
+        return True
+
+    return (
+        (not filters['urlPrefix'] or request['url'].startswith(filters['urlPrefix'])) and
+        (not filters['method'] or request['method'] == filters['method']) and
+        (filters['status'] is None or response['statusCode'] == filters['status']) and
+        headers_match(filters['requestHeaders'], request['headers']) and
+        headers_match(filters['responseHeaders'], response['headers'])
+    )
+
+
+def _parse_filters(query):
+    def header_predicates(values):
+        predicates = {}
+        for value in values:
+            name, separator, expected = value.partition(':')
+            predicates[name.strip().lower()] = expected.strip() if separator else None
+        return predicates
+
+    status = query.get('status', [None])[0]
+    return {
+        'urlPrefix': query.get('urlPrefix', [None])[0],
+        'method': (query.get('method', [None])[0] or '').upper() or None,
+        'status': int(status) if status is not None else None,
+        'requestHeaders': header_predicates(query.get('requestHeader', [])),
+        'responseHeaders': header_predicates(query.get('responseHeader', []))
+    }
+
+
+class _ServerWebSocket:
+    """
+    The server side of a WebSocket, over a handler's connection, after the handshake.
+    """
+
+    def __init__(self, handler):
+        self._rfile = handler.rfile
+        self._wfile = handler.wfile
+        self._lock = threading.Lock()
+
+    @classmethod
+    def accept(cls, handler, subprotocol=None):
+        key = handler.headers.get('Sec-WebSocket-Key', '')
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        handler.send_response(101)
+        handler.send_header('Upgrade', 'websocket')
+        handler.send_header('Connection', 'Upgrade')
+        handler.send_header('Sec-WebSocket-Accept', accept)
+        if subprotocol:
+            handler.send_header('Sec-WebSocket-Protocol', subprotocol)
+        handler.end_headers()
+        handler.wfile.flush()
+        return cls(handler)
+
+    def send(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        with self._lock:
+            self._wfile.write(header + payload)
+            self._wfile.flush()
+
+    def send_json(self, data):
+        self.send(0x1, json.dumps(data).encode('utf-8'))
+
+    def recv(self):
+        """
+        Returns the next message's payload, or None once the client has closed the connection.
+        """
+        while True:
+            head = self._rfile.read(2)
+            if len(head) < 2:
+                return None
+            opcode = head[0] & 0x0F
+            length = head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', self._rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', self._rfile.read(8))[0]
+            mask = self._rfile.read(4) if head[1] & 0x80 else b'\0\0\0\0'
+            payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(self._rfile.read(length)))
+
+            if opcode == 0x8: # Close
+                try:
+                    self.send(0x8, payload[:2])
+                except OSError:
+                    pass
+                return None
+            elif opcode == 0x9: # Ping
+                self.send(0xA, payload)
+            elif opcode != 0xA:
+                return payload
+
+    def close(self):
+        try:
+            self.send(0x8, struct.pack('!H', 1000))
+        except (OSError, ValueError):
+            pass
+
+
+class FakeSession:
+    def __init__(self, session_id, proxy_port):
+        self.id = session_id
+        self.proxy_port = proxy_port
+        self.stopped = threading.Event()
+        self.rules = []
+        self.intercepted_devices = set()
+        self.subscribers = [] # Queues of exchanges (or None, once stopped)
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscriber = queue.Queue()
+        with self._lock:
+            if self.stopped.is_set():
+                subscriber.put(None)
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def emit(self, exchanges):
+        with self._lock:
+            for exchange in exchanges:
+                for subscriber in self.subscribers:
+                    subscriber.put(exchange)
+
+    def stop(self):
+        with self._lock:
+            self.stopped.set()
+            for subscriber in self.subscribers:
+                subscriber.put(None)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {'error': {'code': status, 'message': message}})
+
+    def _read_json(self):
+        length = int(self.headers.get('content-length') or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _authorized(self):
+        if self.headers.get('origin') != ORIGIN:
+            self._send_error(403, 'Invalid CORS headers')
+            return False
+        if self.fake.auth_token and self.headers.get('authorization') != f'Bearer {self.fake.auth_token}':
+            self._send_error(403, 'Invalid auth token')
+            return False
+        return True
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if not self._authorized():
+            return
+        routes = self.fake.api_routes if self.server.role == 'api' else self.fake.admin_routes
+        try:
+            routes(self, method, parts, parse_qs(url.query))
+        except (ValueError, KeyError) as e:
+            self._send_error(400, f'Bad request: {e}')
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class FakeHttpToolkitServer:
+    """
+    The fake server: both its API & admin servers, on 127.0.0.1. exchanges is a function
+    returning the exchanges to emit for each activation (default_exchanges by default).
+    Call start() (or use 'with') to listen.
+    """
+
+    def __init__(self, api_port=DEFAULT_API_PORT, admin_port=DEFAULT_ADMIN_PORT, adb_server=None,
+                 exchanges=default_exchanges, emit_delay=0.5, auth_token=None):
+        self.requested_ports = (api_port, admin_port)
+        self.adb_server = adb_server
+        self.exchanges = exchanges
+        self.emit_delay = emit_delay
+        self.auth_token = auth_token
+        self.sessions = {}
+        self.activations = [] # (interceptor id, proxy port, options), in order
+        self._servers = []
+        self._lock = threading.Lock()
+
+        if adb_server is not None:
+            adb_server.on_event.append(self._on_device_event)
+
+    @property
+    def api_url(self):
+        return f'http://127.0.0.1:{self._servers[0].server_address[1]}'
+
+    @property
+    def admin_url(self):
+        return f'http://127.0.0.1:{self._servers[1].server_address[1]}'
+
+    def start(self):
+        for role, port in zip(('api', 'admin'), self.requested_ports):
+            server = _Server(('127.0.0.1', port), _Handler)
+            server.role = role
+            server.fake = self
+            threading.Thread(target=server.serve_forever, name=f'fake-htk-{role}', daemon=True).start()
+            self._servers.append(server)
+        return self
+
+    def close(self):
+        for session in list(self.sessions.values()):
+            session.stop()
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        if self.adb_server is not None and self._on_device_event in self.adb_server.on_event:
+            self.adb_server.on_event.remove(self._on_device_event)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _session_for_port(self, proxy_port):
+        with self._lock:
+            return next(
+                (session for session in self.sessions.values()
+                    if session.proxy_port == proxy_port and not session.stopped.is_set()),
+                None
+            )
+
+    def emit(self, proxy_port, exchanges=None):
+        """
+        Sends exchanges (by default, the canned ones) to the session's subscribers.
+        """
+        session = self._session_for_port(proxy_port)
+        if session is not None:
+            session.emit(self.exchanges() if exchanges is None else exchanges)
+
+    def _emit_later(self, proxy_port):
+        timer = threading.Timer(self.emit_delay, self.emit, (proxy_port,))
+        timer.daemon = True
+        timer.start()
+
+    def _on_device_event(self, serial, event):
+        if event.get('type') != 'app_start':
+            return
+        with self._lock:
+            sessions = [session for session in self.sessions.values() if serial in session.intercepted_devices]
+        for session in sessions:
+            self._emit_later(session.proxy_port)
+
+    # API server:
+
+    def api_routes(self, handler, method, parts, query):
+        if method == 'GET' and parts == ['version']:
+            handler._send_json(200, {'version': '1.0.0-fake'})
+        elif method == 'GET' and parts == ['config']:
+            handler._send_json(200, {'config': {
+                'certificatePath': '',
+                'certificateContent': '',
+                'certificateFingerprint': '',
+                'networkInterfaces': {},
+                'systemProxy': None,
+                'dnsServers': [],
+                'ruleParameterKeys': []
+            }})
+        elif method == 'GET' and parts == ['interceptors']:
+            handler._send_json(200, {'interceptors': [
+                {'id': 'android-adb', 'version': '1.0.0', 'isActivable': True, 'isActive': False}
+            ]})
+        elif method == 'GET' and len(parts) == 3 and parts[0] == 'interceptors' and parts[2] == 'metadata':
+            device_ids = []
+            if self.adb_server is not None:
+                device_ids = [serial for serial, device in self.adb_server.devices.items() if device.state == 'device']
+            handler._send_json(200, {'interceptorMetadata': {'deviceIds': device_ids}})
+        elif method == 'POST' and len(parts) == 4 and parts[0] == 'interceptors' and parts[2] == 'activate':
+            self._activate(handler, parts[1], int(parts[3]), handler._read_json())
+        elif method == 'POST' and parts == []:
+            handler._read_json()
+            handler._send_json(200, {'data': {'deactivateInterceptor': True}})
+        elif method == 'GET' and len(parts) == 3 and parts[0] == 'exchanges' and parts[2] == 'stream':
+            self._stream_exchanges(handler, int(parts[1]), _parse_filters(query))
+        else:
+            handler._send_error(404, f'No route for {method} /{"/".join(parts)}')
+
+    def _activate(self, handler, interceptor_id, proxy_port, options):
+        session = self._session_for_port(proxy_port)
+        if session is None:
+            handler._send_error(404, f'No proxy session is running on port {proxy_port}')
+            return
+
+        self.activations.append((interceptor_id, proxy_port, options))
+        device_id = options.get('deviceId')
+        if self.adb_server is not None and device_id:
+            # Traffic starts once the app is launched on the device
+            session.intercepted_devices.add(device_id)
+        else:
+            self._emit_later(proxy_port)
+        handler._send_json(200, {'result': {'success': True, 'metadata': {}}})
+
+    def _stream_exchanges(self, handler, proxy_port, filters):
+        session = self._session_for_port(proxy_port)
+        if session is None:
+            handler._send_error(404, f'No proxy session is running on port {proxy_port}')
+            return
+
+        subscriber = session.subscribe()
+        handler.send_response(200)
+        handler.send_header('content-type', 'application/x-ndjson')
+        handler.send_header('transfer-encoding', 'chunked')
+        handler.end_headers()
+        handler.wfile.flush()
+
+        try:
+            while True:
+                exchange = subscriber.get()
+                if exchange is None:
+                    break
+                if _matches(filters, exchange):
+                    line = json.dumps(exchange).encode('utf-8') + b'\n'
+                    handler.wfile.write(b'%x\r\n' % len(line) + line + b'\r\n')
+                    handler.wfile.flush()
+            handler.wfile.write(b'0\r\n\r\n')
+        except OSError:
+            pass # The client went away
+        finally:
+            session.unsubscribe(subscriber)
+            handler.close_connection = True
+
+    # Admin server:
+
+    def admin_routes(self, handler, method, parts, query):
+        if method == 'POST' and parts == ['start']:
+            http_options = handler._read_json().get('plugins', {}).get('http', {})
+            with self._lock:
+                used_ports = {session.proxy_port for session in self.sessions.values() if not session.stopped.is_set()}
+                port = http_options.get('port')
+                if port is None:
+                    port = next(port for port in range(FIRST_PROXY_PORT, 65536) if port not in used_ports)
+                elif port in used_ports:
+                    handler._send_error(500, f'Port {port} is already in use')
+                    return
+                session = FakeSession(str(uuid.uuid4()), port)
+                self.sessions[session.id] = session
+            handler._send_json(200, {'id': session.id, 'pluginData': {'http': {'port': port}}})
+            return
+
+        session = self.sessions.get(parts[1]) if len(parts) >= 2 and parts[0] == 'session' else None
+        if session is None:
+            handler._send_error(404, f'No session found for /{"/".join(parts)}')
+        elif method == 'GET' and parts[2:] == ['stream']:
+            self._hold_session_stream(handler, session)
+        elif method == 'GET' and parts[2:] == ['subscription']:
+            self._run_subscription(handler, session)
+        elif method == 'POST' and parts[2:] == []:
+            variables = handler._read_json().get('variables', {})
+            session.rules = variables.get('rules', []) + variables.get('wsRules', [])
+            handler._send_json(200, {'data': {
+                'setRules': [{'id': rule['id']} for rule in variables.get('rules', [])],
+                'setWebSocketRules': [{'id': rule['id']} for rule in variables.get('wsRules', [])]
+            }})
+        elif method == 'POST' and parts[2:] == ['stop']:
+            session.stop()
+            handler._send_json(200, {'success': True})
+        else:
+            handler._send_error(404, f'No route for {method} /{"/".join(parts)}')
+
+    def _hold_session_stream(self, handler, session):
+        # The real server shuts a session down when this disconnects; here it just ends
+        # the stream when the session is stopped.
+        websocket = _ServerWebSocket.accept(handler)
+        handler.close_connection = True
+        threading.Thread(target=lambda: (session.stopped.wait(), websocket.close()), daemon=True).start()
+        while websocket.recv() is not None:
+            pass
+
+    def _run_subscription(self, handler, session):
+        websocket = _ServerWebSocket.accept(handler, 'graphql-ws')
+        handler.close_connection = True
+        subscriber = session.subscribe()
+        operations = {} # Subscription field -> operation id
+
+        def forward():
+            while True:
+                exchange = subscriber.get()
+                if exchange is None:
+                    websocket.close()
+                    return
+                events = [
+                    ('requestReceived', dict(exchange['request'], id=exchange['id'])),
+                    ('responseCompleted', dict(exchange['response'], id=exchange['id']))
+                ]
+                for field, event in events:
+                    if field in operations:
+                        websocket.send_json({
+                            'id': operations[field],
+                            'type': 'data',
+                            'payload': {'data': {field: event}}
+                        })
+        threading.Thread(target=forward, daemon=True).start()
+
+        try:
+            while True:
+                message = websocket.recv()
+                if message is None:
+                    break
+                message = json.loads(message)
+                if message.get('type') == 'connection_init':
+                    websocket.send_json({'type': 'connection_ack'})
+                elif message.get('type') == 'start':
+                    query = message['payload']['query']
+                    for field in ('requestReceived', 'responseCompleted', 'requestAborted'):
+                        if field in query:
+                            operations[field] = message['id']
+        except OSError:
+            pass
+        finally:
+            session.unsubscribe(subscriber)
+            subscriber.put(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--api-port', type=int, default=DEFAULT_API_PORT)
+    parser.add_argument('--admin-port', type=int, default=DEFAULT_ADMIN_PORT)
+    parser.add_argument('--emit-delay', type=float, default=0.5)
+    parser.add_argument('--exchanges', help='JSONL file of exchanges to emit, instead of the defaults')
+    args = parser.parse_args()
+
+    exchanges = default_exchanges
+    if args.exchanges:
+        with open(args.exchanges) as exchanges_file:
+            canned = [json.loads(line) for line in exchanges_file if line.strip()]
+        exchanges = lambda: canned # noqa: E731
+
+    with FakeHttpToolkitServer(args.api_port, args.admin_port, exchanges=exchanges, emit_delay=args.emit_delay) as server:
+        print(f"Fake HTTP Toolkit API server on {server.api_url}, admin server on {server.admin_url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+A fake Android SDK, whose adb and emulator binaries work against fake_adb.py's
+server (on $ANDROID_ADB_SERVER_PORT, or 5037), along with a fake rootAVD script.
+
+create_sdk() lays out a directory that can be passed to run_all_in_python.py as
+the SDK path: platform-tools/adb, emulator/emulator and rootAVD/rootAVD.sh, each
+a wrapper running this script.
+
+The emulator attaches itself to the fake server as emulator-<port> until it's
+killed (by a signal, 'kill' on its console, or with 'adb emu kill'). Like the
+real emulator, it serves a console on 127.0.0.1:<port>, which needs auth with
+the token in ~/.emulator_console_auth_token (created if it doesn't exist), and
+passes every other command on to the server's 'adb emu'. adb supports the commands the
+orchestration scripts use: start-server, kill-server, devices, emu, shell and
+install (not --incremental, which is reported as unsupported).
+"""
+
+import base64
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+
+FAKES_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(FAKES_DIR))
+
+from adb_client import AdbClient, AdbConnectionPool, AdbError # noqa: E402
+from emulator import AVD_NAME, avd_directory, default_avd_home, home_directory # noqa: E402
+from emulator_console import AUTH_TOKEN_FILE, console_auth_token # noqa: E402
+
+DEFAULT_EMULATOR_PORT = 5554
+
+TOOLS = {
+    'adb': os.path.join('platform-tools', 'adb'),
+    'emulator': os.path.join('emulator', 'emulator'),
+    'rootavd': os.path.join('rootAVD', 'rootAVD.sh')
+}
+
+
+def create_sdk(directory):
+    """
+    Creates the fake SDK's binaries within the directory, and returns their paths by name.
+    """
+    paths = {}
+    for tool, relative_path in TOOLS.items():
+        path = paths[tool] = os.path.join(directory, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as wrapper:
+            wrapper.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" {tool} "$@"\n')
+        os.chmod(path, 0o755)
+    return paths
+
+
+def _client():
+    return AdbClient(timeout=10)
+
+
+def _host_serial_request(serial, request):
+    with _client().connect() as connection:
+        connection.send(f'host-serial:{serial}:{request}')
+        return connection.read_hex_string()
+
+
+def adb(args):
+    serial = os.environ.get('ANDROID_SERIAL')
+    if args[:1] == ['-s']:
+        serial, args = args[1], args[2:]
+    command, args = (args[0], args[1:]) if args else ('help', [])
+
+    try:
+        if command == 'start-server':
+            _client().connect().close()
+        elif command == 'kill-server':
+            with _client().connect() as connection:
+                connection.send('host:kill')
+        elif command == 'devices':
+            print("List of devices attached")
+            for device_serial, state in _client().devices().items():
+                print(f"{device_serial}\t{state}")
+        elif command == 'emu':
+            if serial is None:
+                serial = next(s for s in _client().devices() if s.startswith('emulator-'))
+            sys.stdout.write(_host_serial_request(serial, f"fake-emu:{' '.join(args)}"))
+        elif command == 'shell':
+            sys.stdout.write(_client().shell(serial, ' '.join(args)))
+        elif command == 'install':
+            if '--incremental' in args:
+                sys.stderr.write("adb: the fake SDK doesn't support incremental installs\n")
+                sys.exit(1)
+            with AdbConnectionPool(_client()) as pool:
+                pool.device(serial).install(args[-1], *args[:-1])
+            print("Success")
+        else:
+            sys.stderr.write(f"adb: the fake SDK doesn't support '{command}'\n")
+            sys.exit(1)
+    except (AdbError, OSError) as e:
+        sys.stderr.write(f"adb: error: {e}\n")
+        sys.exit(1)
+
+
+def _console_token():
+    token = console_auth_token()
+    path = os.path.join(home_directory(), AUTH_TOKEN_FILE)
+    if token is None and not os.path.exists(path):
+        token = base64.b64encode(os.urandom(12)).decode()
+        with open(path, 'w') as token_file:
+            token_file.write(token)
+    return token
+
+
+def _console_session(sock, serial, token):
+    def reply(text):
+        sock.sendall(text.replace('\n', '\r\n').encode('utf-8'))
+
+    authenticated = token is None
+    try:
+        if authenticated:
+            reply("Android Console: type 'help' for a list of commands\nOK\n")
+        else:
+            reply(
+                "Android Console: Authentication required\n"
+                "Android Console: type 'auth <auth_token>' to authenticate\n"
+                "Android Console: you can find your <auth_token> in \n"
+                f"'{os.path.join(home_directory(), AUTH_TOKEN_FILE)}'\nOK\n"
+            )
+        for line in sock.makefile('rb'):
+            command = line.decode('utf-8', errors='replace').strip()
+            if not command:
+                continue
+            elif command.startswith('auth '):
+                authenticated = command[len('auth '):] == token
+                reply('OK\n' if authenticated else f"KO: authentication token does not match ~/{AUTH_TOKEN_FILE}\n")
+            elif not authenticated:
+                reply("KO: unknown command, try 'help'\n")
+            else:
+                # Stays open after a kill, until the process exits, as for the real emulator
+                reply(_host_serial_request(serial, f'fake-emu:{command}'))
+    except (AdbError, OSError):
+        sock.close()
+
+
+def _serve_console(listener, serial, token):
+    while True:
+        sock, _ = listener.accept()
+        threading.Thread(target=_console_session, args=(sock, serial, token), daemon=True).start()
+
+
+def emulator(args):
+    port = int(args[args.index('-port') + 1]) if '-port' in args else DEFAULT_EMULATOR_PORT
+    avd_name = next((arg[1:] for arg in args if arg.startswith('@')), AVD_NAME)
+
+    # Signals end the run, as for the real emulator:
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, lambda *_: sys.exit(0))
+
+    try:
+        listener = socket.create_server(('127.0.0.1', port))
+    except OSError as e:
+        sys.stderr.write(f"ERROR   | Couldn't listen for console connections on port {port}: {e}\n")
+        sys.exit(1)
+    threading.Thread(target=_serve_console, args=(listener, f'emulator-{port}', _console_token()), daemon=True).start()
+
+    try:
+        connection = _client().connect()
+        connection.send('host:fake-emulator:' + json.dumps({
+            'port': port,
+            'avd_dir': avd_directory(default_avd_home(), avd_name),
+            'wipe': '-wipe-data' in args
+        }))
+    except (AdbError, OSError) as e:
+        sys.stderr.write(f"ERROR   | Couldn't attach to the fake ADB server: {e}\n")
+        sys.exit(1)
+
+    print(f"INFO    | Fake emulator running {avd_name} as emulator-{port} ({' '.join(args)})", flush=True)
+    connection.set_timeout(None)
+    try:
+        while connection.sock.recv(1024): # Until killed via the console or adb
+            pass
+    except OSError:
+        pass
+    print("INFO    | Fake emulator stopped", flush=True)
+
+
+def rootavd(args):
+    # Answers rootAVD's menu prompt from stdin, as the real script does
+    sys.stdin.read()
+    print(f"Fake rootAVD: patched {' '.join(args)}", flush=True)
+
+
+if __name__ == '__main__':
+    {'adb': adb, 'emulator': emulator, 'rootavd': rootavd}[sys.argv[1]](sys.argv[2:])
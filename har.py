@@ -0,0 +1,477 @@
+"""
+Streaming HAR 1.2 export & import of captured exchanges, in bounded memory.
+
+HarWriter appends each exchange to the file as it's written (so a long capture
+can be archived as it runs, and a crash loses at most the entry being written).
+Bodies are written decoded, as HAR expects: small ones inline as text (or base64,
+if binary), and larger ones either to a side file in the bodies directory (named
+by content hash, so repeated bodies are stored once, and referenced by the
+content's '_file' field) or streamed into the HAR as base64 in chunks, without
+ever building the whole entry in memory.
+
+iter_entries() reads HAR files (from here, browsers or HTTP Toolkit's UI) lazily,
+holding one entry at a time, and har_exchanges() turns those back into Exchange
+objects for reprocessing, loading side files as needed.
+
+    python3 har.py export exchanges.jsonl capture.har [--bodies capture-bodies]
+    python3 har.py import capture.har [exchanges.jsonl]
+    python3 har.py count capture.har
+
+export reads exchanges as streamed by the API server (decoding their bodies
+across cores), and import writes them back out in that format.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import re
+import sys
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlsplit
+
+from httptoolkit_api import CapturedRequest, CapturedResponse, Exchange
+
+HAR_VERSION = '1.2'
+CREATOR = {'name': 'httptoolkit-server python tooling', 'version': '1.0'}
+
+# Bodies larger than this go to side files (or are streamed in as base64 chunks):
+INLINE_LIMIT = 64 << 10
+# A multiple of 3, so chunks encode to base64 without padding in between:
+BASE64_CHUNK = 3 << 18
+READ_CHUNK = 1 << 20
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_TEXT_TYPES = re.compile(r'^(text/|application/([\w.+-]*\+)?(json|xml|javascript|x-www-form-urlencoded)\b)')
+
+# Stands in for bodies streamed into an entry after it's serialized:
+_STREAMED = f'\0{uuid.uuid4().hex}\0'
+
+
+class HarError(Exception):
+    pass
+
+
+def _iso_time(epoch_ms):
+    return datetime.fromtimestamp(epoch_ms / 1000, timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _epoch_ms(iso_time):
+    try:
+        return datetime.fromisoformat(iso_time.replace('Z', '+00:00')).timestamp() * 1000
+    except (AttributeError, ValueError):
+        return None
+
+
+def _har_headers(headers):
+    return [
+        {'name': name, 'value': value}
+        for name, values in headers.items()
+        for value in (values if isinstance(values, list) else [values])
+    ]
+
+
+def _captured_headers(har_headers):
+    headers = {}
+    for header in har_headers or []:
+        name, value = header['name'].lower(), header['value']
+        if name in headers:
+            existing = headers[name]
+            headers[name] = (existing if isinstance(existing, list) else [existing]) + [value]
+        else:
+            headers[name] = value
+    return headers
+
+
+def _http_version(version):
+    return f'HTTP/{version}' if version else 'HTTP/1.1'
+
+
+def _timings(timing_events):
+    """
+    Splits Mockttp's timing events into HAR's phases, in ms. Connection phases aren't
+    captured (-1), and the required send, wait & receive phases are 0 where unknown.
+    Also returns the total time, or -1.
+    """
+    start = timing_events.get('startTimestamp')
+    body_received = timing_events.get('bodyReceivedTimestamp')
+    headers_sent = timing_events.get('headersSentTimestamp')
+    response_sent = timing_events.get('responseSentTimestamp')
+
+    def between(first, second):
+        return round(max(second - first, 0), 3) if first is not None and second is not None else -1
+
+    timings = {
+        'blocked': -1,
+        'dns': -1,
+        'connect': -1,
+        'ssl': -1,
+        'send': max(between(start, body_received), 0),
+        'wait': max(between(body_received, headers_sent), 0),
+        'receive': max(between(headers_sent, response_sent), 0)
+    }
+    return timings, between(start, response_sent)
+
+
+class HarWriter:
+    """
+    Writes exchanges to a HAR file, one entry at a time. bodies_dir (relative to the
+    HAR file, unless absolute) is where large bodies are written, if given. Close it
+    (or use 'with') to finish the file.
+    """
+
+    def __init__(self, path, bodies_dir=None, inline_limit=INLINE_LIMIT, creator=CREATOR):
+        self.path = path
+        self.bodies_dir = bodies_dir
+        self.inline_limit = inline_limit
+        self.count = 0
+        self._file = open(path, 'w', encoding='utf-8')
+        log = json.dumps({'version': HAR_VERSION, 'creator': creator, 'pages': []})
+        self._file.write(f'{{"log": {log[:-1]}, "entries": [\n')
+
+    def close(self):
+        if self._file is not None:
+            self._file.write('\n]}}\n')
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _side_file(self, body):
+        """
+        Writes the body to the bodies directory, if not there already. Returns its path,
+        relative to the HAR file's directory.
+        """
+        name = hashlib.sha256(body).hexdigest()
+        base_dir = os.path.dirname(os.path.abspath(self.path))
+        relative_path = os.path.join(self.bodies_dir, name)
+        path = os.path.join(base_dir, relative_path)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(temp_path, 'wb') as body_file:
+                body_file.write(body)
+            os.replace(temp_path, path)
+        return relative_path
+
+    def _body(self, body, mime_type, streamed):
+        """
+        Returns the HAR fields for a decoded body: inline text, inline base64, a side file,
+        or (with the body appended to streamed) base64 to be streamed in later.
+        """
+        if len(body) > self.inline_limit:
+            if self.bodies_dir:
+                return {'_file': self._side_file(body)}
+            streamed.append(body)
+            return {'text': _STREAMED, 'encoding': 'base64'}
+
+        if _TEXT_TYPES.match(mime_type or '') or not mime_type:
+            try:
+                return {'text': body.decode('utf-8')}
+            except UnicodeDecodeError:
+                pass
+        return {'text': base64.b64encode(body).decode('ascii'), 'encoding': 'base64'}
+
+    @staticmethod
+    def _decoded(message):
+        try:
+            return message.decoded_body(), False
+        except Exception: # Corrupt or truncated bodies fail in all sorts of ways
+            return message.body, True
+
+    def write(self, exchange):
+        request, response = exchange.request, exchange.response
+        streamed = [] # Large bodies, in the order their placeholders appear
+
+        timing_events = response.timing_events or request.timing_events
+        timings, total_time = _timings(timing_events)
+        start_time = timing_events.get('startTime')
+        http_version = _http_version(request.http_version)
+
+        entry = {
+            'startedDateTime': _iso_time(start_time) if start_time is not None else _iso_time(0),
+            'time': max(total_time, 0),
+            'request': {
+                'method': request.method,
+                'url': request.url,
+                'httpVersion': http_version,
+                'cookies': [],
+                'headers': _har_headers(request.headers),
+                'queryString': [
+                    {'name': name, 'value': value}
+                    for name, value in parse_qsl(urlsplit(request.url).query, keep_blank_values=True)
+                ],
+                'headersSize': -1,
+                'bodySize': len(request.body)
+            },
+            'response': {
+                'status': response.status_code,
+                'statusText': response.status_message,
+                'httpVersion': http_version,
+                'cookies': [],
+                'headers': _har_headers(response.headers),
+                'redirectURL': response.header('location') or '',
+                'headersSize': -1,
+                'bodySize': len(response.body)
+            },
+            'cache': {},
+            'timings': timings,
+            '_id': exchange.id
+        }
+
+        if request.body:
+            body, undecoded = self._decoded(request)
+            mime_type = request.header('content-type') or ''
+            entry['request']['postData'] = dict(self._body(body, mime_type, streamed), mimeType=mime_type)
+            if undecoded:
+                entry['request']['postData']['_undecoded'] = True
+
+        body, undecoded = self._decoded(response)
+        mime_type = response.header('content-type') or ''
+        entry['response']['content'] = dict(
+            self._body(body, mime_type, streamed),
+            size=len(body),
+            compression=len(body) - len(response.body),
+            mimeType=mime_type
+        )
+        if undecoded:
+            entry['response']['content']['_undecoded'] = True
+
+        separator = ',\n' if self.count else ''
+        parts = json.dumps(entry).split(json.dumps(_STREAMED)[1:-1])
+        self._file.write(separator + parts[0])
+        for body, part in zip(streamed, parts[1:]):
+            for offset in range(0, len(body), BASE64_CHUNK):
+                self._file.write(base64.b64encode(body[offset:offset + BASE64_CHUNK]).decode('ascii'))
+            self._file.write(part)
+        self._file.flush()
+        self.count += 1
+
+
+class _JsonReader:
+    """
+    Reads JSON values one at a time from a text file, buffering only what the current
+    value needs.
+    """
+
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, file, chunk_size=READ_CHUNK):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def _fill(self):
+        # Grow reads with the buffer, so a large value is re-scanned only a few times
+        chunk = self.file.read(max(self.chunk_size, len(self.buffer) - self.position))
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        if not chunk:
+            self.eof = True
+        return bool(chunk)
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character, or None at the end of the file.
+        """
+        while True:
+            self.position = _WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                return None
+
+    def expect(self, characters):
+        character = self.peek()
+        if character is None:
+            raise EOFError()
+        if character not in characters:
+            raise HarError(f"Invalid HAR: expected one of {characters!r}, found {character!r}")
+        self.position += 1
+        return character
+
+    def value(self):
+        if self.peek() is None:
+            raise EOFError()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue
+                raise EOFError() from e
+            # A number running up to the end of the buffer may continue after it:
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+            self.position = end
+            return value
+
+
+def _members(reader):
+    """
+    Reads an object's members, yielding each key with the reader positioned at its value,
+    which the caller must read.
+    """
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.position += 1
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        yield key
+        if reader.expect(',}') == '}':
+            return
+
+
+def iter_entries(path, allow_truncated=False):
+    """
+    Yields each entry of a HAR file in turn, reading only as much of the file as needed.
+    A truncated file (e.g. from a capture that crashed) raises HarError once its complete
+    entries have been yielded, or just ends with allow_truncated.
+    """
+    count = 0
+    with open(path, encoding='utf-8-sig') as har_file:
+        reader = _JsonReader(har_file)
+        try:
+            for key in _members(reader):
+                if key != 'log':
+                    reader.value()
+                    continue
+                for log_key in _members(reader):
+                    if log_key != 'entries':
+                        reader.value()
+                        continue
+                    reader.expect('[')
+                    if reader.peek() == ']':
+                        reader.position += 1
+                        continue
+                    while True:
+                        yield reader.value()
+                        count += 1
+                        if reader.expect(',]') == ']':
+                            break
+                return
+        except EOFError:
+            if not allow_truncated:
+                raise HarError(f"{path} is truncated (or invalid) after {count} complete entries")
+
+
+def _load_body(fields, base_dir):
+    if '_file' in fields:
+        with open(os.path.join(base_dir, fields['_file']), 'rb') as body_file:
+            return body_file.read()
+    text = fields.get('text') or ''
+    if fields.get('encoding') == 'base64':
+        return base64.b64decode(text)
+    return text.encode('utf-8')
+
+
+def har_exchanges(path, allow_truncated=False):
+    """
+    Yields each entry of a HAR file as an Exchange. HAR bodies are decoded, so their
+    content-encoding headers are dropped (unless the body couldn't be decoded when
+    exported).
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for entry in iter_entries(path, allow_truncated):
+        exchange_id = entry.get('_id') or str(uuid.uuid4())
+        har_request, har_response = entry['request'], entry.get('response') or {}
+        start_time = _epoch_ms(entry.get('startedDateTime'))
+        timing_events = {'startTime': start_time} if start_time is not None else {}
+
+        messages = []
+        for har_message, body_fields in (
+            (har_request, har_request.get('postData')),
+            (har_response, har_response.get('content'))
+        ):
+            headers = _captured_headers(har_message.get('headers'))
+            body = _load_body(body_fields, base_dir) if body_fields else b''
+            if not (body_fields or {}).get('_undecoded'):
+                headers.pop('content-encoding', None)
+                if 'content-length' in headers:
+                    headers['content-length'] = str(len(body))
+            messages.append((headers, body))
+
+        (request_headers, request_body), (response_headers, response_body) = messages
+        http_version = (har_request.get('httpVersion') or '').upper()
+        yield Exchange(
+            CapturedRequest(
+                id=exchange_id,
+                method=har_request.get('method', ''),
+                url=har_request.get('url', ''),
+                protocol=urlsplit(har_request.get('url', '')).scheme,
+                http_version=http_version[len('HTTP/'):] if http_version.startswith('HTTP/') else http_version,
+                headers=request_headers,
+                body=request_body,
+                timing_events=timing_events
+            ),
+            CapturedResponse(
+                id=exchange_id,
+                status_code=har_response.get('status', 0),
+                status_message=har_response.get('statusText', ''),
+                headers=response_headers,
+                body=response_body,
+                timing_events=timing_events
+            )
+        )
+
+
+def main():
+    # Imported here, as only the CLI needs a decoding pool:
+    from exchange_decoding import decode_exchanges, read_exchanges
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Write JSONL exchanges as a HAR file')
+    export_parser.add_argument('exchanges', help='JSONL exchanges (- for stdin)')
+    export_parser.add_argument('har')
+    export_parser.add_argument('--bodies', help='Directory for large bodies, relative to the HAR file')
+
+    import_parser = subparsers.add_parser('import', help='Write a HAR file out as JSONL exchanges')
+    import_parser.add_argument('har')
+    import_parser.add_argument('output', nargs='?', help='Defaults to stdout')
+    import_parser.add_argument('--allow-truncated', action='store_true')
+
+    count_parser = subparsers.add_parser('count', help='Count the entries in a HAR file')
+    count_parser.add_argument('har')
+    count_parser.add_argument('--allow-truncated', action='store_true')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'export':
+            input_file = sys.stdin if args.exchanges == '-' else open(args.exchanges, encoding='utf-8')
+            try:
+                with HarWriter(args.har, bodies_dir=args.bodies) as writer:
+                    for exchange in decode_exchanges(read_exchanges(input_file)):
+                        writer.write(exchange)
+            finally:
+                if input_file is not sys.stdin:
+                    input_file.close()
+            print(f"Exported {writer.count} exchanges to {args.har}", file=sys.stderr)
+        elif args.command == 'import':
+            output_file = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+            try:
+                for exchange in har_exchanges(args.har, args.allow_truncated):
+                    output_file.write(json.dumps(exchange.to_event()) + '\n')
+            finally:
+                if output_file is not sys.stdout:
+                    output_file.close()
+        elif args.command == 'count':
+            print(sum(1 for _ in iter_entries(args.har, args.allow_truncated)))
+    except HarError as e:
+        sys.exit(str(e))
+
+
+if __name__ == '__main__':
+    main()
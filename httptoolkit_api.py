@@ -0,0 +1,811 @@
+"""
+A headless client for a locally running HTTP Toolkit server.
+
+This talks directly to the two local servers that the web UI normally drives:
+
+* The HTTP Toolkit API server (127.0.0.1:45457, see src/api/rest-api.ts and
+  src/api/graphql-api.ts), used to query config and activate interceptors.
+* The Mockttp admin server (127.0.0.1:45456), used to start a proxy session,
+  configure its rules and subscribe to the traffic it sees.
+
+No browser is involved at all: captured traffic arrives as structured
+Exchange objects. Only the standard library is required (brotli/zstandard
+are used if installed, for decoding those content-encodings).
+"""
+
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from urllib.parse import quote, urlencode, urlsplit
+
+# Overridable to point the scripts at another server (e.g. fakes/fake_httptoolkit.py):
+API_URL = os.environ.get('HTK_API_URL', 'http://127.0.0.1:45457')
+ADMIN_URL = os.environ.get('HTK_ADMIN_URL', 'http://127.0.0.1:45456')
+
+# Both servers reject requests without an allowed Origin (see ALLOWED_ORIGINS in src/constants.ts)
+ORIGIN = 'https://app.httptoolkit.tech'
+
+
+class HTTPToolkitError(Exception):
+    pass
+
+
+def local_certificate_path():
+    """
+    Returns the path of the CA certificate generated by a local server using its
+    default config directory (matching env-paths' config path, as used in src/index.ts).
+    """
+    if sys.platform == 'darwin':
+        config_path = os.path.expanduser('~/Library/Preferences/httptoolkit')
+    elif sys.platform == 'win32':
+        config_path = os.path.join(os.environ.get('APPDATA', ''), 'httptoolkit', 'Config')
+    else:
+        config_path = os.path.join(
+            os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config'),
+            'httptoolkit'
+        )
+    return os.path.join(config_path, 'ca.pem')
+
+
+def decode_body(body, content_encoding):
+    """
+    Decodes a raw HTTP body according to its content-encoding header value,
+    undoing each encoding in reverse order of application.
+    """
+    if isinstance(content_encoding, list):
+        content_encoding = ', '.join(content_encoding)
+
+    encodings = [e.strip().lower() for e in (content_encoding or '').split(',') if e.strip()]
+    for encoding in reversed(encodings):
+        if encoding == 'identity':
+            continue
+        elif encoding in ('gzip', 'x-gzip'):
+            body = gzip.decompress(body)
+        elif encoding == 'deflate':
+            try:
+                body = zlib.decompress(body)
+            except zlib.error:
+                # Plenty of servers send raw deflate data without the zlib wrapper
+                body = zlib.decompress(body, -zlib.MAX_WBITS)
+        elif encoding == 'br':
+            try:
+                import brotli
+            except ImportError:
+                raise HTTPToolkitError("Decoding brotli bodies requires the 'brotli' package")
+            body = brotli.decompress(body)
+        elif encoding == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise HTTPToolkitError("Decoding zstd bodies requires the 'zstandard' package")
+            body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        else:
+            raise HTTPToolkitError(f"Unsupported content-encoding: {encoding}")
+    return body
+
+
+def _header(headers, name):
+    value = headers.get(name)
+    if isinstance(value, list):
+        return ', '.join(value)
+    return value
+
+
+@dataclass
+class _Message:
+    id: str
+    headers: dict
+    body: bytes
+    timing_events: dict = field(default_factory=dict)
+    tags: list = field(default_factory=list)
+    # The decoded body, once decoded (here, or in bulk by exchange_decoding.py)
+    decoded: bytes = field(default=None, repr=False, compare=False)
+
+    def header(self, name):
+        """Returns the value of a header (case-insensitive), joining repeated headers."""
+        return _header(self.headers, name.lower())
+
+    def decoded_body(self):
+        if self.decoded is None:
+            self.decoded = decode_body(self.body, self.header('content-encoding'))
+        return self.decoded
+
+    def text(self, encoding='utf-8'):
+        return self.decoded_body().decode(encoding, errors='replace')
+
+    def json(self):
+        return json.loads(self.decoded_body())
+
+    def _event(self, decoded=False):
+        headers, body = self.headers, self.body
+        if decoded:
+            body = self.decoded_body()
+            headers = {name: value for name, value in headers.items() if name != 'content-encoding'}
+            if 'content-length' in headers:
+                headers['content-length'] = str(len(body))
+        return {
+            'headers': headers,
+            'body': base64.b64encode(body).decode('ascii'),
+            'timingEvents': self.timing_events,
+            'tags': self.tags
+        }
+
+
+@dataclass
+class CapturedRequest(_Message):
+    method: str = ''
+    url: str = ''
+    protocol: str = ''
+    http_version: str = ''
+
+    @classmethod
+    def from_event(cls, event):
+        return cls(
+            id=event['id'],
+            method=event['method'],
+            url=event['url'],
+            protocol=event.get('protocol', ''),
+            http_version=event.get('httpVersion', ''),
+            headers=event.get('headers') or {},
+            body=base64.b64decode(event.get('body') or ''),
+            timing_events=event.get('timingEvents') or {},
+            tags=event.get('tags') or []
+        )
+
+    def to_event(self, decoded=False):
+        return dict(
+            self._event(decoded),
+            protocol=self.protocol,
+            httpVersion=self.http_version,
+            method=self.method,
+            url=self.url
+        )
+
+
+@dataclass
+class CapturedResponse(_Message):
+    status_code: int = 0
+    status_message: str = ''
+
+    @classmethod
+    def from_event(cls, event):
+        return cls(
+            id=event['id'],
+            status_code=event['statusCode'],
+            status_message=event.get('statusMessage', ''),
+            headers=event.get('headers') or {},
+            body=base64.b64decode(event.get('body') or ''),
+            timing_events=event.get('timingEvents') or {},
+            tags=event.get('tags') or []
+        )
+
+    def to_event(self, decoded=False):
+        return dict(self._event(decoded), statusCode=self.status_code, statusMessage=self.status_message)
+
+
+@dataclass
+class Exchange:
+    request: CapturedRequest
+    response: CapturedResponse
+
+    @property
+    def id(self):
+        return self.request.id
+
+    @classmethod
+    def from_event(cls, event):
+        return cls(
+            CapturedRequest.from_event(dict(event['request'], id=event['id'])),
+            CapturedResponse.from_event(dict(event['response'], id=event['id']))
+        )
+
+    def to_event(self, decoded=False):
+        """
+        Returns the exchange in the format the API server streams it in. With decoded,
+        bodies are included decoded, without their content-encoding headers.
+        """
+        return {
+            'id': self.id,
+            'request': self.request.to_event(decoded),
+            'response': self.response.to_event(decoded)
+        }
+
+
+class _WebSocket:
+    """
+    A minimal RFC 6455 client, covering just what the Mockttp admin server needs: text
+    messages, fragmentation, and replying to the server's keep-alive pings.
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._closed = False
+
+    @classmethod
+    async def connect(cls, url, headers=None, subprotocol=None):
+        parsed = urlsplit(url)
+        host = parsed.hostname
+        port = parsed.port or 80
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        reader, writer = await asyncio.open_connection(host, port)
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        lines = [
+            f'GET {path} HTTP/1.1',
+            f'Host: {host}:{port}',
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            f'Sec-WebSocket-Key: {key}',
+            'Sec-WebSocket-Version: 13'
+        ]
+        if subprotocol:
+            lines.append(f'Sec-WebSocket-Protocol: {subprotocol}')
+        for name, value in (headers or {}).items():
+            lines.append(f'{name}: {value}')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        status_line = await reader.readline()
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if status_line.split(b' ')[1:2] != [b'101']:
+            writer.close()
+            raise HTTPToolkitError(f"WebSocket connection to {url} failed: {status_line.decode().strip()}")
+
+        expected_accept = base64.b64encode(hashlib.sha1(
+            (key + '258EAFA5-E914-47DA-95CA-C5AB0DC85B11').encode()
+        ).digest()).decode()
+        if response_headers.get('sec-websocket-accept') != expected_accept:
+            writer.close()
+            raise HTTPToolkitError(f"WebSocket connection to {url} returned an invalid accept key")
+
+        return cls(reader, writer)
+
+    async def _read_frame(self):
+        head = await self._reader.readexactly(2)
+        fin = head[0] & 0x80
+        opcode = head[0] & 0x0F
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', await self._reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', await self._reader.readexactly(8))[0]
+        mask = await self._reader.readexactly(4) if head[1] & 0x80 else None
+        payload = await self._reader.readexactly(length)
+        if mask:
+            payload = _mask(payload, mask)
+        return fin, opcode, payload
+
+    async def _send_frame(self, opcode, payload):
+        length = len(payload)
+        header = bytearray([0x80 | opcode])
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 1 << 16:
+            header.append(0x80 | 126)
+            header += struct.pack('!H', length)
+        else:
+            header.append(0x80 | 127)
+            header += struct.pack('!Q', length)
+        mask = os.urandom(4)
+        self._writer.write(bytes(header) + mask + _mask(payload, mask))
+        await self._writer.drain()
+
+    async def recv(self):
+        """
+        Returns the next complete message (str for text, bytes for binary),
+        or None once the connection has closed.
+        """
+        message = bytearray()
+        message_opcode = None
+        while True:
+            try:
+                fin, opcode, payload = await self._read_frame()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self._closed = True
+                return None
+
+            if opcode == 0x9:  # Ping
+                await self._send_frame(0xA, payload)
+                continue
+            elif opcode == 0xA:  # Pong
+                continue
+            elif opcode == 0x8:  # Close
+                if not self._closed:
+                    self._closed = True
+                    try:
+                        await self._send_frame(0x8, payload[:2])
+                    except ConnectionError:
+                        pass
+                    self._writer.close()
+                return None
+
+            if opcode != 0x0:
+                message_opcode = opcode
+            message += payload
+            if fin:
+                return message.decode('utf-8') if message_opcode == 0x1 else bytes(message)
+
+    async def send(self, message):
+        if isinstance(message, str):
+            await self._send_frame(0x1, message.encode('utf-8'))
+        else:
+            await self._send_frame(0x2, message)
+
+    async def send_json(self, data):
+        await self.send(json.dumps(data))
+
+    async def recv_json(self):
+        message = await self.recv()
+        return None if message is None else json.loads(message)
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._send_frame(0x8, struct.pack('!H', 1000))
+        except ConnectionError:
+            pass
+        self._writer.close()
+
+
+def _mask(payload, mask):
+    if not payload:
+        return b''
+    repeated_mask = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (
+        int.from_bytes(payload, 'big') ^ int.from_bytes(repeated_mask, 'big')
+    ).to_bytes(len(payload), 'big')
+
+
+_EXCHANGE_SUBSCRIPTIONS = {
+    'request': """subscription OnRequest {
+        requestReceived {
+            id, protocol, method, url, path, hostname,
+            headers, body, timingEvents, tags
+        }
+    }""",
+    'response': """subscription OnResponse {
+        responseCompleted {
+            id, statusCode, statusMessage,
+            headers, body, timingEvents, tags
+        }
+    }""",
+    'abort': """subscription OnAbort {
+        requestAborted { id }
+    }"""
+}
+
+
+class ExchangeSubscription:
+    """
+    A live subscription to the traffic of a Mockttp session. Requests and responses
+    are received as separate events, and joined here into complete exchanges.
+
+    Use with 'async for', and close() (or use 'async with') when done.
+    """
+
+    def __init__(self, websocket):
+        self._websocket = websocket
+        self._pending_requests = {}
+
+    async def _start(self):
+        await self._websocket.send_json({'type': 'connection_init', 'payload': {}})
+        for operation_id, query in _EXCHANGE_SUBSCRIPTIONS.items():
+            await self._websocket.send_json({
+                'id': operation_id,
+                'type': 'start',
+                'payload': {'query': query, 'variables': {}}
+            })
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            message = await self._websocket.recv_json()
+            if message is None:
+                raise StopAsyncIteration
+
+            message_type = message.get('type')
+            if message_type in ('error', 'connection_error'):
+                raise HTTPToolkitError(f"Subscription failed: {message.get('payload')}")
+            elif message_type != 'data':
+                continue  # connection_ack, keep-alives, etc.
+
+            payload = message.get('payload') or {}
+            if payload.get('errors'):
+                raise HTTPToolkitError(f"Subscription failed: {payload['errors']}")
+            data = payload.get('data') or {}
+
+            if data.get('requestReceived'):
+                request = CapturedRequest.from_event(data['requestReceived'])
+                self._pending_requests[request.id] = request
+            elif data.get('requestAborted'):
+                self._pending_requests.pop(data['requestAborted']['id'], None)
+            elif data.get('responseCompleted'):
+                response = CapturedResponse.from_event(data['responseCompleted'])
+                request = self._pending_requests.pop(response.id, None)
+                if request is not None:
+                    return Exchange(request, response)
+
+    async def close(self):
+        await self._websocket.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class ExchangeStream:
+    """
+    A filtered stream of completed exchanges, read as newline-delimited JSON from the
+    API server's /exchanges/:proxyPort/stream endpoint. Filtering happens server-side,
+    so only matching exchanges are ever sent.
+
+    The stream connects on first iteration, or on entering it with 'async with'. Use
+    the latter to be sure the subscription is live before triggering any traffic.
+    """
+
+    def __init__(self, api_url, path, headers):
+        self._api_url = api_url
+        self._path = path
+        self._headers = headers
+        self._reader = None
+        self._writer = None
+        self._chunked = False
+        self._buffer = b''
+
+    async def open(self):
+        if self._reader is not None:
+            return
+
+        parsed = urlsplit(self._api_url)
+        self._reader, self._writer = await asyncio.open_connection(parsed.hostname, parsed.port or 80)
+
+        lines = [
+            f'GET {self._path} HTTP/1.1',
+            f'Host: {parsed.netloc}',
+            'Accept: application/x-ndjson',
+            'Connection: close'
+        ] + [f'{name}: {value}' for name, value in self._headers.items()]
+        self._writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        status_line = (await self._reader.readline()).decode('latin-1').strip()
+        response_headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        self._chunked = response_headers.get('transfer-encoding', '').lower() == 'chunked'
+
+        status_parts = status_line.split(' ')
+        if len(status_parts) < 2 or status_parts[1] != '200':
+            body = b''
+            while (chunk := await self._read_chunk()) is not None:
+                body += chunk
+            await self.close()
+            message = body.decode('utf-8', errors='replace')
+            try:
+                message = json.loads(message)['error']['message']
+            except (ValueError, KeyError, TypeError):
+                pass
+            raise HTTPToolkitError(f"Exchange stream failed with '{status_line}': {message}")
+
+    async def _read_chunk(self):
+        if not self._chunked:
+            data = await self._reader.read(65536)
+            return data or None
+
+        size_line = await self._reader.readline()
+        if not size_line:
+            return None
+        size = int(size_line.split(b';')[0].strip(), 16)
+        if size == 0:
+            return None
+        data = await self._reader.readexactly(size)
+        await self._reader.readline()  # Trailing CRLF
+        return data
+
+    async def _read_line(self):
+        while b'\n' not in self._buffer:
+            chunk = await self._read_chunk()
+            if chunk is None:
+                line, self._buffer = self._buffer, b''
+                return line or None
+            self._buffer += chunk
+
+        line, _, self._buffer = self._buffer.partition(b'\n')
+        return line
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self.open()
+        while True:
+            try:
+                line = await self._read_line()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                line = None
+
+            if line is None:
+                await self.close()
+                raise StopAsyncIteration
+            if line.strip():
+                return Exchange.from_event(json.loads(line))
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class HTTPToolkitAPI:
+    """
+    Drives a local HTTP Toolkit server in place of the web UI. Typical usage:
+
+        async with HTTPToolkitAPI() as api:
+            async with api.exchanges(url_prefix='https://example.com/', status=200) as exchanges:
+                await api.activate_interceptor('android-adb', {'deviceId': ...})
+                async for exchange in exchanges:
+                    ...
+
+    Entering the context starts a proxy session, which is stopped again on exit.
+    """
+
+    def __init__(self, api_url=API_URL, admin_url=ADMIN_URL, auth_token=None, timeout=30):
+        self.api_url = api_url.rstrip('/')
+        self.admin_url = admin_url.rstrip('/')
+        self.auth_token = auth_token or os.environ.get('HTK_SERVER_TOKEN')
+        self.timeout = timeout
+
+        self.session_id = None
+        self.proxy_port = None
+        self._stream = None
+        self._stream_task = None
+
+        # Never send our own API traffic through any configured HTTP(S)_PROXY:
+        self._opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+    def _headers(self):
+        headers = {'Origin': ORIGIN}
+        if self.auth_token:
+            headers['Authorization'] = f'Bearer {self.auth_token}'
+        return headers
+
+    def _request_sync(self, method, url, body=None):
+        headers = self._headers()
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        request = urllib.request.Request(url, data=data, method=method, headers=headers)
+        try:
+            with self._opener.open(request, timeout=self.timeout) as response:
+                payload = response.read()
+        except urllib.error.HTTPError as e:
+            message = e.read().decode('utf-8', errors='replace')
+            try:
+                message = json.loads(message)['error']['message']
+            except (ValueError, KeyError, TypeError):
+                pass
+            raise HTTPToolkitError(f"{method} {url} failed with {e.code}: {message}") from None
+        except urllib.error.URLError as e:
+            raise HTTPToolkitError(f"{method} {url} failed: {e.reason}") from None
+
+        return json.loads(payload) if payload else None
+
+    async def _request(self, method, url, body=None):
+        return await asyncio.to_thread(self._request_sync, method, url, body)
+
+    async def _graphql(self, url, query, variables=None):
+        result = await self._request('POST', url, {'query': query, 'variables': variables or {}})
+        if result.get('errors'):
+            raise HTTPToolkitError(f"GraphQL query failed: {result['errors']}")
+        return result['data']
+
+    def _ws_url(self, path):
+        return 'ws' + self.admin_url[len('http'):] + path
+
+    # API server:
+
+    async def version(self):
+        return (await self._request('GET', f'{self.api_url}/version'))['version']
+
+    async def wait_until_available(self, timeout=120):
+        """
+        Waits for the server to start answering API requests, e.g. just after starting it.
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return await self.version()
+            except HTTPToolkitError:
+                if time.time() > deadline:
+                    raise
+                await asyncio.sleep(0.5)
+
+    async def config(self):
+        proxy_query = f'?proxyPort={self.proxy_port}' if self.proxy_port else ''
+        return (await self._request('GET', f'{self.api_url}/config{proxy_query}'))['config']
+
+    async def interceptors(self):
+        proxy_query = f'?proxyPort={self.proxy_port}' if self.proxy_port else ''
+        return (await self._request('GET', f'{self.api_url}/interceptors{proxy_query}'))['interceptors']
+
+    async def interceptor_metadata(self, interceptor_id):
+        return (await self._request(
+            'GET', f'{self.api_url}/interceptors/{quote(interceptor_id)}/metadata'
+        ))['interceptorMetadata']
+
+    async def activate_interceptor(self, interceptor_id, options=None):
+        """
+        Activates an interceptor for the current session's proxy. Note that failures
+        aren't always thrown: check the 'success' field of the returned result.
+        """
+        self._require_session()
+        return (await self._request(
+            'POST',
+            f'{self.api_url}/interceptors/{quote(interceptor_id)}/activate/{self.proxy_port}',
+            options or {}
+        ))['result']
+
+    async def deactivate_interceptor(self, interceptor_id):
+        self._require_session()
+        # Only available via the GraphQL API for now:
+        data = await self._graphql(f'{self.api_url}/', """
+            mutation Deactivate($id: ID!, $proxyPort: Int!) {
+                deactivateInterceptor(id: $id, proxyPort: $proxyPort)
+            }
+        """, {'id': interceptor_id, 'proxyPort': self.proxy_port})
+        return data['deactivateInterceptor']
+
+    # Mockttp admin server:
+
+    def _require_session(self):
+        if self.session_id is None:
+            raise HTTPToolkitError("No proxy session is running")
+
+    async def start_session(self, port=None):
+        """
+        Starts a proxy session (as the UI does on load) which passes through all
+        traffic, and returns its proxy port.
+        """
+        plugin_options = {'options': {}}
+        if port is not None:
+            plugin_options['port'] = port
+
+        result = await self._request('POST', f'{self.admin_url}/start', {
+            'plugins': {'http': plugin_options}
+        })
+        self.session_id = result['id']
+        self.proxy_port = result['pluginData']['http']['port']
+
+        # The session is shut down by the server as soon as its stream disconnects, so we
+        # hold it open (and answer its keep-alive pings) until the session is stopped:
+        self._stream = await _WebSocket.connect(
+            self._ws_url(f'/session/{self.session_id}/stream'),
+            headers=self._headers()
+        )
+        self._stream_task = asyncio.ensure_future(self._drain_stream())
+
+        await self._graphql(f'{self.admin_url}/session/{self.session_id}/', """
+            mutation SetRules($rules: [MockRule!]!, $wsRules: [WebSocketMockRule!]!) {
+                setRules(input: $rules) { id }
+                setWebSocketRules(input: $wsRules) { id }
+            }
+        """, {
+            'rules': [{
+                'id': str(uuid.uuid4()),
+                'matchers': [{'type': 'wildcard'}],
+                'handler': {'type': 'passthrough'}
+            }],
+            'wsRules': [{
+                'id': str(uuid.uuid4()),
+                'matchers': [{'type': 'wildcard'}],
+                'handler': {'type': 'ws-passthrough'}
+            }]
+        })
+
+        return self.proxy_port
+
+    async def _drain_stream(self):
+        while await self._stream.recv() is not None:
+            pass
+
+    async def stop_session(self):
+        if self.session_id is None:
+            return
+
+        try:
+            await self._request('POST', f'{self.admin_url}/session/{self.session_id}/stop')
+        finally:
+            if self._stream_task:
+                self._stream_task.cancel()
+            if self._stream:
+                await self._stream.close()
+            self.session_id = self.proxy_port = None
+            self._stream = self._stream_task = None
+
+    async def subscribe(self):
+        """
+        Subscribes to all traffic passing through the session, via Mockttp's own
+        subscriptions. Prefer exchanges() to receive only the traffic you need.
+        Subscribe before triggering any traffic you're waiting for, to be sure not
+        to miss it.
+        """
+        self._require_session()
+        websocket = await _WebSocket.connect(
+            self._ws_url(f'/session/{self.session_id}/subscription'),
+            headers=self._headers(),
+            subprotocol='graphql-ws'
+        )
+        subscription = ExchangeSubscription(websocket)
+        await subscription._start()
+        return subscription
+
+    def exchanges(self, url_prefix=None, method=None, status=None,
+                  request_headers=None, response_headers=None):
+        """
+        Streams completed exchanges from the session that match all the given filters,
+        which are evaluated by the server. Header filters map header names to a required
+        value, or to None to require only that the header is present.
+        """
+        self._require_session()
+
+        query = []
+        if url_prefix is not None:
+            query.append(('urlPrefix', url_prefix))
+        if method is not None:
+            query.append(('method', method))
+        if status is not None:
+            query.append(('status', str(status)))
+        for param, headers in (('requestHeader', request_headers), ('responseHeader', response_headers)):
+            for name, value in (headers or {}).items():
+                query.append((param, name if value is None else f'{name}:{value}'))
+
+        path = f'/exchanges/{self.proxy_port}/stream'
+        if query:
+            path += '?' + urlencode(query)
+        return ExchangeStream(self.api_url, path, self._headers())
+
+    async def __aenter__(self):
+        await self.start_session()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop_session()
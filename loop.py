@@ -1,14 +1,454 @@
+"""
+Supervisor for continuous capture runs.
+
+Runs N workers, each repeatedly running run_all_in_python.py in its own process
+group, with its own emulator port (and so serial), proxy port and temp dir, so
+that workers don't interfere with one another.
+
+Each run's outcome is classified as success, timeout or crash, and failures are
+attributed to the phase that failed, using the run's trace (see run_trace.py).
+Repeated failures of the same kind back off exponentially. Counters are printed
+after each run and written to loop_stats.json in the work directory.
+
+While running, individual workers can be controlled without disturbing others:
+
+    python3 loop.py --workers 2 [--android-sdk /path/to/sdk]
+    python3 loop.py ctl status
+    python3 loop.py ctl drain 1      # Finish the current run, then idle
+    python3 loop.py ctl resume 1     # Start running again after a drain
+    python3 loop.py ctl restart 1    # Stop the current run now & start afresh
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import socketserver
 import subprocess
+import sys
+import threading
 import time
-import os
+from collections import Counter
+
+RUN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_all_in_python.py')
+WORK_DIR = 'run_workers'
+
+CONTROL_PORT = 45460
+BASE_EMULATOR_PORT = 5554  # Emulators use a pair of ports each: console port & console port + 1
+BASE_PROXY_PORT = 8000
+
+RUN_TIMEOUT = 15 * 60
+TERMINATE_GRACE_PERIOD = 60  # Cleanup stops the emulator & writes the trace, so give it time
 
-PORT = 45456
+RUN_INTERVAL = 1
+BACKOFF_BASE = 5
+BACKOFF_MAX = 10 * 60
 
-while True:
+
+def failed_phase(trace_path):
+    """
+    Returns the phase a failed run was in, from its trace. That's the innermost
+    failed span, i.e. the one that started last: spans only fail when the failure
+    propagates out of them, so parents always start before their failed children.
+    """
     try:
-        # Run the main process
-        process = subprocess.run(['python3', 'run_all_in_python.py'])
-    except subprocess.CalledProcessError:
-        # This happens if no process is using the port, which is fine
-        pass
-    time.sleep(1)
\ No newline at end of file
+        with open(trace_path) as trace_file:
+            spans = json.load(trace_file)['spans']
+    except (OSError, ValueError, KeyError):
+        return 'unknown'  # Killed before writing a trace, or failed before starting one
+
+    failed = [span for span in spans if span['outcome'] == 'error']
+    if not failed:
+        return 'unknown'
+    return max(failed, key=lambda span: span['start'])['phase']
+
+
+class Backoff:
+    """
+    Exponential backoff for repeated failures of the same kind. A success, or a
+    failure of a different kind, starts again from the base delay.
+    """
+
+    def __init__(self, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+        self.base = base
+        self.maximum = maximum
+        self.kind = None
+        self.failures = 0
+
+    def failure(self, kind):
+        if kind != self.kind:
+            self.kind = kind
+            self.failures = 0
+        self.failures += 1
+
+        delay = min(self.base * 2 ** (self.failures - 1), self.maximum)
+        # Jitter, so workers failing for a shared reason don't retry in lockstep
+        return delay * random.uniform(0.8, 1.2)
+
+    def reset(self):
+        self.kind = None
+        self.failures = 0
+
+
+class RunStats:
+    """
+    Counts run outcomes, in total and per worker, with failures broken down by phase.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = Counter()
+        self.by_worker = {}
+        self.run_time = 0.0
+
+    def record(self, worker_id, outcome, phase, duration):
+        key = outcome if outcome == 'success' else f'{outcome}:{phase}'
+        with self._lock:
+            self.totals[key] += 1
+            self.by_worker.setdefault(worker_id, Counter())[key] += 1
+            self.run_time += duration
+
+    def to_json(self):
+        with self._lock:
+            runs = sum(self.totals.values())
+
+            def breakdown(counter):
+                result = {'success': counter['success'], 'timeout': {}, 'crash': {}}
+                for key, count in counter.items():
+                    if key != 'success':
+                        outcome, _, phase = key.partition(':')
+                        result[outcome][phase] = count
+                return result
+
+            return {
+                'runs': runs,
+                'mean_run_time': round(self.run_time / runs, 1) if runs else None,
+                'totals': breakdown(self.totals),
+                'workers': {str(worker_id): breakdown(counter) for worker_id, counter in self.by_worker.items()}
+            }
+
+    def summary(self):
+        stats = self.to_json()['totals']
+        failures = [
+            f"{outcome} in {phase} x{count}"
+            for outcome in ('timeout', 'crash')
+            for phase, count in sorted(stats[outcome].items(), key=lambda item: -item[1])
+        ]
+        return f"{stats['success']} succeeded" + (f", {', '.join(failures)}" if failures else '')
+
+
+class Worker:
+    def __init__(self, supervisor, worker_id):
+        self.supervisor = supervisor
+        self.id = worker_id
+        self.emulator_port = BASE_EMULATOR_PORT + 2 * worker_id
+        self.proxy_port = BASE_PROXY_PORT + worker_id
+        self.directory = os.path.abspath(os.path.join(supervisor.work_dir, f'worker-{worker_id}'))
+
+        self.state = 'starting'
+        self.backoff = Backoff()
+        self.draining = False
+        self.runs = 0
+        self.last_result = None
+
+        self._condition = threading.Condition()
+        self._process = None
+        self._restart_requested = False
+        self._thread = threading.Thread(target=self._run, name=f'worker-{worker_id}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def join(self):
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def drain(self):
+        with self._condition:
+            self.draining = True
+            self._condition.notify_all()
+
+    def resume(self):
+        with self._condition:
+            self.draining = False
+            self._condition.notify_all()
+
+    def restart(self):
+        with self._condition:
+            self.draining = False
+            self._restart_requested = True
+            self.backoff.reset()
+            self._condition.notify_all()
+
+    def wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def _interrupted(self):
+        return self.supervisor.stopping.is_set() or self._restart_requested
+
+    def _run(self):
+        while not self.supervisor.stopping.is_set():
+            with self._condition:
+                while self.draining and not self.supervisor.stopping.is_set():
+                    self.state = 'drained'
+                    self._condition.wait()
+                if self.supervisor.stopping.is_set():
+                    break
+                self._restart_requested = False
+
+            delay = self._run_once()
+
+            # Wait before the next run, unless restarted, drained or stopped meanwhile
+            with self._condition:
+                self.state = 'waiting'
+                self._condition.wait_for(lambda: self._interrupted() or self.draining, timeout=delay)
+        self.state = 'stopped'
+
+    def _environment(self, run_id):
+        temp_dir = os.path.join(self.directory, 'tmp')
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+
+        return {
+            **os.environ,
+            'HTK_WORKER_ID': str(self.id),
+            'HTK_RUN_ID': run_id,
+            'HTK_EMULATOR_PORT': str(self.emulator_port),
+            'HTK_PROXY_PORT': str(self.proxy_port),
+            'HTK_TRACE_DIR': os.path.join(self.directory, 'traces'),
+            'TMPDIR': temp_dir,
+            'TEMP': temp_dir,
+            'TMP': temp_dir
+        }
+
+    def _run_once(self):
+        """
+        Runs the capture script once, and returns how long to wait before the next run.
+        """
+        self.runs += 1
+        run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-w{self.id}-{self.runs}"
+        log_dir = os.path.join(self.directory, 'logs')
+        os.makedirs(log_dir, exist_ok=True)
+        log_path = os.path.join(log_dir, f'{run_id}.log')
+
+        self.state = 'running'
+        start_time = time.time()
+        timed_out = False
+
+        with open(log_path, 'wb') as log_file:
+            self._process = subprocess.Popen(
+                [sys.executable, RUN_SCRIPT, *self.supervisor.script_args],
+                env=self._environment(run_id),
+                cwd=os.path.dirname(RUN_SCRIPT),
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                # A group of its own, so the emulator & other children can be stopped with it
+                start_new_session=True
+            )
+            try:
+                while self._process.poll() is None:
+                    if self._interrupted():
+                        break
+                    if time.time() - start_time > self.supervisor.run_timeout:
+                        timed_out = True
+                        break
+                    time.sleep(0.5)
+
+                if self._process.poll() is None:
+                    self._terminate()
+            finally:
+                returncode = self._process.returncode
+                self._process = None
+
+        duration = time.time() - start_time
+        if self._interrupted() and not timed_out:
+            # Stopped on request: not the run's fault, so not counted
+            self.last_result = {'run_id': run_id, 'outcome': 'stopped'}
+            return 0
+
+        if timed_out:
+            outcome = 'timeout'
+        elif returncode == 0:
+            outcome = 'success'
+        else:
+            outcome = 'crash'
+        phase = None if outcome == 'success' else failed_phase(
+            os.path.join(self.directory, 'traces', f'{run_id}.json')
+        )
+
+        self.last_result = {
+            'run_id': run_id,
+            'outcome': outcome,
+            'phase': phase,
+            'duration': round(duration, 1),
+            'log': log_path
+        }
+        self.supervisor.stats.record(self.id, outcome, phase, duration)
+        self.supervisor.write_stats()
+
+        if outcome == 'success':
+            self.backoff.reset()
+            delay = RUN_INTERVAL
+            print(f"[worker {self.id}] Run {run_id} succeeded in {duration:.0f}s")
+        else:
+            delay = self.backoff.failure((outcome, phase))
+            print(
+                f"[worker {self.id}] Run {run_id}: {outcome} in {phase} after {duration:.0f}s "
+                f"(failure {self.backoff.failures} of this kind, retrying in {delay:.0f}s, log: {log_path})"
+            )
+        print(f"Totals: {self.supervisor.stats.summary()}")
+        return delay
+
+    def _terminate(self):
+        """
+        Stops the current run's process group: SIGTERM first, so the run can clean up
+        its emulator and write its trace, then SIGKILL if it doesn't exit in time.
+        """
+        process = self._process
+        for sig, timeout in ((signal.SIGTERM, TERMINATE_GRACE_PERIOD), (signal.SIGKILL, 10)):
+            try:
+                os.killpg(process.pid, sig)
+            except ProcessLookupError:
+                break
+            try:
+                process.wait(timeout=timeout)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'draining': self.draining,
+            'emulator_serial': f'emulator-{self.emulator_port}',
+            'proxy_port': self.proxy_port,
+            'consecutive_failures': self.backoff.failures,
+            'last_result': self.last_result
+        }
+
+
+class Supervisor:
+    def __init__(self, worker_count, script_args=(), run_timeout=RUN_TIMEOUT, work_dir=WORK_DIR):
+        self.script_args = list(script_args)
+        self.run_timeout = run_timeout
+        self.work_dir = work_dir
+        self.stats = RunStats()
+        self.stopping = threading.Event()
+        self.workers = {worker_id: Worker(self, worker_id) for worker_id in range(worker_count)}
+        self._stats_lock = threading.Lock()
+
+    def write_stats(self):
+        path = os.path.join(self.work_dir, 'loop_stats.json')
+        with self._stats_lock:
+            with open(path + '.tmp', 'w') as stats_file:
+                json.dump(self.stats.to_json(), stats_file, indent=2)
+            os.replace(path + '.tmp', path)
+
+    def command(self, line):
+        """
+        Handles a control command, returning a JSON-serializable response.
+        """
+        action, _, target = line.strip().partition(' ')
+        if action == 'status':
+            return {
+                'workers': [worker.to_json() for worker in self.workers.values()],
+                'stats': self.stats.to_json()
+            }
+        if action not in ('drain', 'resume', 'restart'):
+            return {'error': f"Unknown command {action!r}"}
+
+        if target in ('', 'all'):
+            workers = list(self.workers.values())
+        elif target.isdigit() and int(target) in self.workers:
+            workers = [self.workers[int(target)]]
+        else:
+            return {'error': f"Unknown worker {target!r}"}
+
+        for worker in workers:
+            getattr(worker, action)()
+        return {'ok': True, 'workers': [worker.id for worker in workers]}
+
+    def stop(self):
+        self.stopping.set()
+        for worker in self.workers.values():
+            worker.wake()
+
+    def run(self, control_port=CONTROL_PORT):
+        os.makedirs(self.work_dir, exist_ok=True)
+        supervisor = self
+
+        class ControlHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    response = supervisor.command(line.decode('utf-8'))
+                    self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        control_server = socketserver.ThreadingTCPServer(('127.0.0.1', control_port), ControlHandler)
+        control_server.daemon_threads = True
+        threading.Thread(target=control_server.serve_forever, daemon=True).start()
+
+        def handle_signal(signum, frame):
+            print("\nStopping workers...")
+            self.stop()
+        signal.signal(signal.SIGINT, handle_signal)
+        signal.signal(signal.SIGTERM, handle_signal)
+
+        print(f"Starting {len(self.workers)} worker(s), control port {control_port}")
+        for worker in self.workers.values():
+            worker.start()
+            # Stagger start up, so emulators aren't all cold booting at once
+            if self.stopping.wait(5):
+                break
+
+        # Workers stop (and stop their runs) in parallel
+        for worker in self.workers.values():
+            worker.join()
+
+        control_server.shutdown()
+        print(f"Stopped. Totals: {self.stats.summary()}")
+
+
+def send_command(command, control_port=CONTROL_PORT):
+    with socket.create_connection(('127.0.0.1', control_port), timeout=10) as sock:
+        sock.sendall(command.encode('utf-8') + b'\n')
+        response = sock.makefile('rb').readline()
+    return json.loads(response)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'ctl':
+        parser = argparse.ArgumentParser(prog='loop.py ctl', description='Control a running supervisor')
+        parser.add_argument('command', choices=['status', 'drain', 'resume', 'restart'])
+        parser.add_argument('worker', nargs='?', default='all', help='Worker id, or "all"')
+        parser.add_argument('--control-port', type=int, default=CONTROL_PORT)
+        args = parser.parse_args(sys.argv[2:])
+
+        command = args.command if args.command == 'status' else f'{args.command} {args.worker}'
+        print(json.dumps(send_command(command, args.control_port), indent=2))
+        return
+
+    parser = argparse.ArgumentParser(description='Run capture workers continuously')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--android-sdk', help='Android SDK path, passed to run_all_in_python.py')
+    parser.add_argument('--timeout', type=int, default=RUN_TIMEOUT, help='Maximum seconds per run')
+    parser.add_argument('--work-dir', default=WORK_DIR)
+    parser.add_argument('--control-port', type=int, default=CONTROL_PORT)
+    args = parser.parse_args()
+
+    supervisor = Supervisor(
+        args.workers,
+        script_args=[args.android_sdk] if args.android_sdk else [],
+        run_timeout=args.timeout,
+        work_dir=args.work_dir
+    )
+    supervisor.run(args.control_port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+# Any copyright is dedicated to the Public Domain.
+# http://creativecommons.org/publicdomain/zero/1.0/
+
+# Creates the precomplete file containing the remove and rmdir application
+# update instructions which is used to remove files and directories that are no
+# longer present in a complete update. Shared by the createprecomplete.py script
+# for each platform.
+# For symlinks, remove instructions are always generated.
+#
+# Optionally, directory listings can be cached between runs (--cache). Each
+# directory is then only listed again if its mtime has changed (i.e. entries
+# were added, removed or renamed within it), so regenerating the file for a
+# large, mostly unchanged bundle only needs a stat of each directory.
+
+import argparse
+import json
+import os
+import time
+
+
+# TODO When TOR_BROWSER_DATA_OUTSIDE_APP_DIR is used on all platforms,
+# we should remove all lines in this file that contain:
+#      TorBrowser/Data
+
+EXCLUDED_FILE_SUFFIXES = ("channel-prefs.js", "update-settings.ini")
+EXCLUDED_FILE_PATHS = frozenset([
+    "TorBrowser/Data/Browser/profiles.ini",
+    "TorBrowser/Data/Browser/profile.default/bookmarks.html",
+    "TorBrowser/Data/Tor/torrc"
+])
+# Any path containing "distribution/" is excluded, i.e. everything within (and
+# including) directories whose names end with this:
+EXCLUDED_DIR_SUFFIX = "distribution"
+
+CACHE_VERSION = 1
+# Directories modified this recently might still change within the same mtime,
+# so their listings aren't cached:
+CACHE_MIN_AGE_NS = 2 * 10**9
+
+
+# Entry kinds in directory listings:
+FILE = "f"
+DIR = "d"
+DIR_SYMLINK = "l" # Never followed, and removed like a file
+
+
+def _entry_kind(entry):
+    if not entry.is_dir():
+        return FILE
+    return DIR_SYMLINK if entry.is_symlink() else DIR
+
+
+def _list_dir(abs_dir_path):
+    """ Returns a list of (name, kind) for each entry in the directory, or an
+        empty list if it can't be read.
+    """
+    try:
+        with os.scandir(abs_dir_path) as entries:
+            return [(entry.name, _entry_kind(entry)) for entry in entries]
+    except OSError:
+        return []
+
+
+def _pack_listing(entries):
+    # Cached as one newline-separated string of names per kind, which is far
+    # quicker to save & load than a list per entry.
+    names = {}
+    for name, kind in entries:
+        names.setdefault(kind, []).append(name)
+    return dict((kind, "\n".join(kind_names)) for kind, kind_names in names.items())
+
+
+def _unpack_listing(packed):
+    return [(name, kind) for kind, kind_names in packed.items() for name in kind_names.split("\n")]
+
+
+class ListingCache(object):
+    """ Directory listings from a previous run, keyed by path relative to the
+        root, each with the directory's mtime when it was listed.
+    """
+
+    def __init__(self, cache_path, root_path):
+        self.cache_path = cache_path
+        self.root_path = os.path.abspath(root_path)
+        self.listings = {}
+        self.updated_listings = {}
+        self.changed = True
+        self.scan_started_ns = time.time_ns()
+
+        try:
+            with open(cache_path) as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            return # No usable cache, so everything is listed
+
+        if cache.get("version") == CACHE_VERSION and cache.get("root") == self.root_path:
+            self.listings = cache["listings"]
+            self.changed = False
+
+    def list_dir(self, abs_dir_path, rel_dir_path):
+        try:
+            mtime_ns = os.stat(abs_dir_path).st_mtime_ns
+        except OSError:
+            return []
+
+        cached = self.listings.get(rel_dir_path)
+        if cached is not None and cached[0] == mtime_ns:
+            self.updated_listings[rel_dir_path] = cached
+            return _unpack_listing(cached[1])
+
+        entries = _list_dir(abs_dir_path)
+        self.changed = True
+        if self.scan_started_ns - mtime_ns > CACHE_MIN_AGE_NS:
+            self.updated_listings[rel_dir_path] = (mtime_ns, _pack_listing(entries))
+        return entries
+
+    def save(self):
+        # Only directories seen in this run are kept, so removed ones drop out
+        if not self.changed and len(self.updated_listings) == len(self.listings):
+            return # Nothing to update
+
+        temp_path = self.cache_path + ".tmp"
+        with open(temp_path, "w") as cache_file:
+            json.dump({
+                "version": CACHE_VERSION,
+                "root": self.root_path,
+                "listings": self.updated_listings
+            }, cache_file)
+        os.replace(temp_path, self.cache_path)
+
+
+def iter_build_entries(root_path, cache=None):
+    """ Yields (rel_path, is_dir) for each file and directory within root_path,
+        excluding any file paths ending with channel-prefs.js or
+        update-settings.ini, and anything within distribution directories.
+        Directory paths end with a "/". To support Tor Browser updates, excludes:
+          TorBrowser/Data/Browser/profiles.ini
+          TorBrowser/Data/Browser/profile.default/bookmarks.html
+          TorBrowser/Data/Tor/torrc
+    """
+    list_dir = cache.list_dir if cache is not None else (lambda abs_path, rel_path: _list_dir(abs_path))
+
+    pending = [(root_path, "")]
+    while pending:
+        abs_dir_path, rel_dir_path = pending.pop()
+        for name, kind in list_dir(abs_dir_path, rel_dir_path):
+            rel_path = rel_dir_path + name
+            if kind == FILE:
+                if not (name.endswith(EXCLUDED_FILE_SUFFIXES) or rel_path in EXCLUDED_FILE_PATHS):
+                    yield rel_path, False
+            elif name.endswith(EXCLUDED_DIR_SUFFIX):
+                continue
+            elif kind == DIR_SYMLINK:
+                yield rel_path, False
+            else:
+                rel_path += "/"
+                pending.append((os.path.join(abs_dir_path, name), rel_path))
+                yield rel_path, True
+
+
+def get_build_entries(root_path, cache=None):
+    """ Iterates through the root_path, creating a list for each file and
+        directory, each sorted in reverse order. See iter_build_entries.
+    """
+    rel_file_path_list = []
+    rel_dir_path_list = []
+    for rel_path, is_dir in iter_build_entries(root_path, cache):
+        (rel_dir_path_list if is_dir else rel_file_path_list).append(rel_path)
+
+    rel_file_path_list.sort(reverse=True)
+    rel_dir_path_list.sort(reverse=True)
+    return rel_file_path_list, rel_dir_path_list
+
+
+def iter_precomplete_lines(rel_file_path_list, rel_dir_path_list):
+    """ Yields each line of the precomplete file, as bytes (no OS specific
+        line endings, and paths exactly as on disk).
+    """
+    for rel_file_path in rel_file_path_list:
+        yield b'remove "' + os.fsencode(rel_file_path) + b'"\n'
+
+    for rel_dir_path in rel_dir_path_list:
+        yield b'rmdir "' + os.fsencode(rel_dir_path) + b'"\n'
+
+
+def generate_precomplete(root_path, cache_path=None):
+    """ Creates the precomplete file containing the remove and rmdir
+        application update instructions. The given directory is used
+        for the location to enumerate and to create the precomplete file.
+        If a cache path is given, directory listings are reused from (and
+        saved to) that file.
+    """
+    rel_path_precomplete = "precomplete"
+    # If inside a Mac bundle use the root of the bundle for the path.
+    if os.path.basename(root_path) == "Resources":
+        root_path = os.path.abspath(os.path.join(root_path, '../../'))
+        rel_path_precomplete = "Contents/Resources/precomplete"
+
+    precomplete_file_path = os.path.join(root_path, rel_path_precomplete)
+    cache = ListingCache(cache_path, root_path) if cache_path else None
+
+    # Open the file so it exists (and is listed) before building the list of files.
+    with open(precomplete_file_path, "wb") as precomplete_file:
+        rel_file_path_list, rel_dir_path_list = get_build_entries(root_path, cache)
+        precomplete_file.writelines(iter_precomplete_lines(rel_file_path_list, rel_dir_path_list))
+
+    if cache is not None:
+        cache.save()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Creates the precomplete file for the current directory.")
+    parser.add_argument("--cache", metavar="PATH",
+                        help="Reuse unchanged directory listings from this file, and update it. "
+                             "Keep it outside the directory being packaged.")
+    args = parser.parse_args(argv)
+    generate_precomplete(os.getcwd(), args.cache)
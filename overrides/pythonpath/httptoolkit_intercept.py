@@ -1,16 +1,134 @@
-def preload_real_module(*module_names):
-    # Re-importing the real module at the top level of an override fails after deleting it from
-    # sys.modules['httplib'] in Python 2. Some interesting issues there ofc, but doing this
-    # instead works nicely in both Python 2 & 3.
-    import sys, os
-
-    override_path = os.path.dirname(os.path.abspath(__file__))
-    original_sys_path = list(sys.path)
-    sys.path = [p for p in sys.path if p != override_path and p != '']
-
-    for mod in module_names:
-        if mod in sys.modules:
-            del sys.modules[mod]
-        __import__(mod)
-
-    sys.path = original_sys_path
\ No newline at end of file
+# Import hooks that patch HTTP client modules for interception, when (and only when) they're
+# actually imported.
+#
+# A finder on sys.meta_path recognises the modules we patch, finds the real module exactly as the
+# import system otherwise would, and patches it as soon as it has loaded. Nothing is imported up
+# front, sys.path is never touched, and lazy importers (e.g. Mercurial's hgdemandimport) keep
+# working, since modules are patched whenever they're really loaded.
+
+import sys
+
+# Module name -> the module in httptoolkit_patches with a patch(module) function for it:
+PATCHES = {
+    'http.client': 'http_client', # Python 3
+    'urllib3': 'urllib3', # Also covers requests
+    'httpx': 'httpx',
+    'httplib': 'httplib', # Python 2
+    'httplib2': 'httplib2',
+    'aiohttp': 'aiohttp',
+    'stripe': 'stripe'
+}
+
+def _apply_patch(module):
+    patch_module = __import__('httptoolkit_patches.' + PATCHES[module.__name__], fromlist=['patch'])
+    patch_module.patch(module)
+
+class _PatchingLoader(object):
+    # Wraps the real loader for a module, patching the module once it has been executed
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def create_module(self, spec):
+        create_module = getattr(self.loader, 'create_module', None)
+        return create_module(spec) if create_module else None
+
+    def exec_module(self, module):
+        self.loader.exec_module(module)
+
+        # Once loaded, the module should look exactly as it would without us:
+        if getattr(module, '__loader__', None) is self:
+            module.__loader__ = self.loader
+        spec = getattr(module, '__spec__', None)
+        if spec is not None and spec.loader is self:
+            spec.loader = self.loader
+
+        _apply_patch(module)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+class InterceptingFinder(object):
+    # Python 3.4+:
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in PATCHES:
+            return None
+
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        if spec.loader is None or not hasattr(spec.loader, 'exec_module'):
+            return spec # Namespace package or legacy loader: leave it alone
+        spec.loader = _PatchingLoader(spec.loader)
+        return spec
+
+    # Python 2 (which ignores find_spec):
+    def find_module(self, fullname, path=None):
+        if fullname in PATCHES:
+            return self
+        return None
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+
+        # Load it as normal, then patch it. This uses imp, not __import__, since lazy importers
+        # (like hgdemandimport) replace __import__ and wouldn't actually load anything.
+        # All our Python 2 targets are top-level modules, so imp can find them directly.
+        import imp
+        found = imp.find_module(fullname)
+        try:
+            module = imp.load_module(fullname, *found)
+        finally:
+            if found[0]:
+                found[0].close()
+
+        _apply_patch(module)
+        return module
+
+def install():
+    if any(isinstance(finder, InterceptingFinder) for finder in sys.meta_path):
+        return
+    sys.meta_path.insert(0, InterceptingFinder())
+
+    # Anything imported before we were installed gets patched now:
+    for name in PATCHES:
+        if name in sys.modules:
+            _apply_patch(sys.modules[name])
+
+def load_next_sitecustomize(override_path):
+    # We're loaded via sitecustomize, which shadows any other sitecustomize module (some distros
+    # use these). This finds & runs the next one on the path, as Python would have without us.
+    search_path = [p for p in sys.path if p not in (override_path, '')]
+
+    if sys.version_info[0] < 3:
+        import imp
+        try:
+            found = imp.find_module('sitecustomize', search_path)
+        except ImportError:
+            return
+        try:
+            sys.modules['sitecustomize'] = imp.load_module('sitecustomize', *found)
+        finally:
+            if found[0]:
+                found[0].close()
+        return
+
+    # This runs in every Python process, so we avoid importlib.util (which is slow to import, relative
+    # to startup) and use the path finder that's already loaded.
+    path_finder = next(f for f in sys.meta_path if getattr(f, '__name__', None) == 'PathFinder')
+    spec = path_finder.find_spec('sitecustomize', search_path)
+    if spec is None or spec.loader is None:
+        return
+    module = type(sys)('sitecustomize')
+    module.__spec__ = spec
+    module.__loader__ = spec.loader
+    module.__file__ = spec.origin
+    sys.modules['sitecustomize'] = module
+    spec.loader.exec_module(module)
@@ -0,0 +1,2 @@
+# Patches for each intercepted module, applied by httptoolkit_intercept's import hook once the real
+# module has loaded. Each module here has a patch(module) function, taking the module to patch.
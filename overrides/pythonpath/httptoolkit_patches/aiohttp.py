@@ -0,0 +1,189 @@
+import os, functools, threading, weakref
+
+from httptoolkit_timing import TIMING_ENABLED, RequestTiming, count_connection_request, _clock
+
+# Sends all aiohttp traffic through the proxy, with one CA-loaded SSL context for the whole process.
+#
+# Proxy settings are resolved once, here, rather than from the environment for each request (which
+# aiohttp does for sessions with trust_env, in a worker thread in recent versions), and connectors
+# that would use aiohttp's default SSL context use our shared context instead, rather than loading
+# the CA again (per connection, in older versions). Connectors are otherwise left as configured.
+
+_proxyUrl = os.environ['HTTP_PROXY']
+_certPath = os.environ['SSL_CERT_FILE']
+
+_lock = threading.Lock()
+_ssl_context = None
+_contexts_with_ca = weakref.WeakSet()
+
+def _get_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        with _lock:
+            if _ssl_context is None:
+                import ssl
+                _ssl_context = ssl.create_default_context(cafile=_certPath)
+    return _ssl_context
+
+def _inject_ca(context):
+    if context in _contexts_with_ca:
+        return
+
+    with _lock:
+        if context in _contexts_with_ca:
+            return
+        context.load_verify_locations(_certPath)
+        try:
+            _contexts_with_ca.add(context)
+        except TypeError:
+            pass # Not weak-referenceable, so we'll just have to load the CA each time
+
+def _inject_ca_if_context(ssl_setting):
+    # aiohttp's ssl settings can also be True/False/None or a Fingerprint, which need nothing
+    if hasattr(ssl_setting, 'load_verify_locations'):
+        _inject_ca(ssl_setting)
+
+_trace_config = None
+
+def _get_trace_config(aiohttp):
+    # Records the timing of each request, using aiohttp's own tracing hooks. aiohttp sets up
+    # connections (TCP, proxy tunnel & TLS) in one step, so those are reported as one 'connect' phase.
+    global _trace_config
+    if _trace_config is not None:
+        return _trace_config
+
+    trace_config = aiohttp.TraceConfig()
+
+    def _start_timing(context, method, url):
+        context.timing = RequestTiming('aiohttp', method, str(url))
+        context.phase_started = _clock()
+
+    async def on_request_start(session, context, params):
+        _start_timing(context, params.method, params.url)
+
+    async def on_connection_queued_start(session, context, params):
+        context.queued = _clock()
+
+    async def on_connection_queued_end(session, context, params):
+        context.timing.add('queue', context.queued)
+
+    async def on_connection_create_start(session, context, params):
+        context.connecting = _clock()
+
+    async def on_connection_create_end(session, context, params):
+        context.timing.add('connect', context.connecting)
+        context.phase_started = _clock()
+
+    async def on_connection_reuseconn(session, context, params):
+        context.phase_started = _clock()
+
+    async def on_request_headers_sent(session, context, params):
+        context.timing.add('send', context.phase_started)
+        context.phase_started = _clock()
+
+    def _response_started(context, response):
+        timing = context.timing
+        timing.add('wait', context.phase_started)
+        timing.status = response.status
+
+        connection = getattr(response, '_httptoolkit_connection', None)
+        if connection is not None:
+            count_connection_request(connection[0], timing, connection[1])
+
+    async def on_request_end(session, context, params):
+        response = params.response
+        _response_started(context, response)
+        if response.content.at_eof():
+            context.timing.finish() # No body, already complete
+        else:
+            context.timing.response_started = _clock()
+            response._httptoolkit_timing = context.timing
+
+    async def on_request_redirect(session, context, params):
+        _response_started(context, params.response)
+        context.timing.finish()
+
+        # Redirects are followed within the same traced request, so time the next hop separately:
+        location = params.response.headers.get('Location')
+        next_url = params.response.url.join(type(params.url)(location)) if location else params.url
+        _start_timing(context, params.method, next_url)
+
+    async def on_request_exception(session, context, params):
+        context.timing.finish(error=params.exception)
+
+    for name, callback in list(locals().items()):
+        if name.startswith('on_') and hasattr(trace_config, name):
+            getattr(trace_config, name).append(callback)
+
+    # Short responses can be fully read, releasing their connection, before the request 'ends', so
+    # the connection is noted as soon as the response starts:
+    _response_start = aiohttp.ClientResponse.start
+    @functools.wraps(_response_start)
+    def _new_response_start(self, connection, *k, **kw):
+        transport = connection.transport
+        sockname = transport.get_extra_info('sockname') if transport is not None else None
+        if sockname:
+            self._httptoolkit_connection = (connection.protocol, sockname[1])
+        return _response_start(self, connection, *k, **kw)
+    aiohttp.ClientResponse.start = _new_response_start
+
+    # Responses release their connection once the body has been read (or when closed early):
+    for method_name in ('_response_eof', 'release', 'close'):
+        _body_complete = getattr(aiohttp.ClientResponse, method_name, None)
+        if _body_complete is None:
+            continue
+        def _wrap(_body_complete):
+            @functools.wraps(_body_complete)
+            def _timed_body_complete(self, *k, **kw):
+                timing = getattr(self, '_httptoolkit_timing', None)
+                if timing is not None:
+                    self._httptoolkit_timing = None
+                    timing.add('body', timing.response_started)
+                    timing.finish()
+                return _body_complete(self, *k, **kw)
+            return _timed_body_complete
+        setattr(aiohttp.ClientResponse, method_name, _wrap(_body_complete))
+
+    _trace_config = trace_config
+    return trace_config
+
+def patch(aiohttp):
+    import inspect
+    TCPConnector = aiohttp.TCPConnector
+    ClientSession = aiohttp.ClientSession
+
+    # Connectors using the default SSL settings use our shared context, and any others trust our CA:
+    _supports_ssl_param = 'ssl' in inspect.signature(TCPConnector.__init__).parameters # aiohttp 3+
+    _connector_init = TCPConnector.__init__
+    @functools.wraps(_connector_init)
+    def _new_connector_init(self, *k, **kw):
+        ssl_setting = kw.get('ssl', True)
+        if kw.get('ssl_context') is not None:
+            _inject_ca(kw['ssl_context'])
+        elif ssl_setting is True:
+            if _supports_ssl_param and kw.get('verify_ssl', True) and kw.get('fingerprint') is None:
+                kw['ssl'] = _get_ssl_context()
+        else:
+            _inject_ca_if_context(ssl_setting)
+        _connector_init(self, *k, **kw)
+    TCPConnector.__init__ = _new_connector_init
+
+    # Trace all sessions, if we're timing requests:
+    if TIMING_ENABLED:
+        _session_init = ClientSession.__init__
+        @functools.wraps(_session_init)
+        def _new_client_session_init(self, *k, **kw):
+            kw['trace_configs'] = list(kw.get('trace_configs') or []) + [_get_trace_config(aiohttp)]
+            _session_init(self, *k, **kw)
+        ClientSession.__init__ = _new_client_session_init
+
+    # Whatever proxy was configured, all traffic goes via ours (HTTP Toolkit handles upstream proxies),
+    # and per-request SSL contexts trust our CA:
+    _request = ClientSession._request
+    @functools.wraps(_request)
+    def _new_request(self, *k, **kw):
+        kw['proxy'] = _proxyUrl
+        _inject_ca_if_context(kw.get('ssl'))
+        _inject_ca_if_context(kw.get('ssl_context'))
+        return _request(self, *k, **kw)
+    ClientSession._request = _new_request
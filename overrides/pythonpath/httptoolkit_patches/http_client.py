@@ -0,0 +1,194 @@
+import os, functools, threading, weakref
+from collections import OrderedDict
+
+from httptoolkit_tunnel_pool import POOLING_ENABLED, tunnel_pool
+from httptoolkit_timing import TIMING_ENABLED, instrument_http_client
+
+_httpProxy = os.environ['HTTP_PROXY']
+[_proxyHost, _proxyPort] = _httpProxy.split('://')[1].split(':')
+_certPath = os.environ['SSL_CERT_FILE']
+
+# The patched http.client module, once patched:
+_client = None
+
+def _build_default_context():
+    import ssl
+    context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    context.options |= ssl.OP_NO_SSLv2
+    context.options |= ssl.OP_NO_SSLv3
+    return context
+
+# Loading & parsing our CA for every connection is expensive, so it's loaded into each context only
+# once: one shared context for connections that don't bring their own, and once per context for
+# those that do. Contexts are tracked weakly, so this doesn't keep them alive.
+_ca_lock = threading.Lock()
+_contexts_with_ca = weakref.WeakSet()
+_default_context = None
+
+def _get_default_context():
+    global _default_context
+    if _default_context is None:
+        with _ca_lock:
+            if _default_context is None:
+                context = _build_default_context()
+                context.load_verify_locations(_certPath)
+                _default_context = _enable_session_resumption(context)
+    return _default_context
+
+def _inject_ca(context):
+    if context in _contexts_with_ca:
+        return
+
+    with _ca_lock:
+        if context in _contexts_with_ca:
+            return
+        context.load_verify_locations(_certPath)
+        try:
+            _contexts_with_ca.add(context)
+        except TypeError:
+            pass # Not weak-referenceable, so we'll just have to load the CA each time
+
+# All TLS connections go to the proxy, so with a shared context we can resume earlier TLS sessions
+# (per hostname, since the proxy presents a certificate for each) and skip most of each handshake.
+# TLS 1.3 only sends resumable sessions after the handshake, so sessions are saved on close too.
+# Only the most recently used hostnames' sessions are kept, so long-running processes that talk to
+# many hosts don't grow without limit.
+MAX_TLS_SESSIONS = 256
+_tls_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def _save_session(ssl_sock):
+    try:
+        session = ssl_sock.session
+    except (AttributeError, ValueError, OSError):
+        return
+    if session is not None and ssl_sock.server_hostname:
+        with _sessions_lock:
+            _tls_sessions[ssl_sock.server_hostname] = session
+            _tls_sessions.move_to_end(ssl_sock.server_hostname)
+            while len(_tls_sessions) > MAX_TLS_SESSIONS:
+                _tls_sessions.popitem(last=False)
+
+def _load_session(hostname):
+    with _sessions_lock:
+        session = _tls_sessions.get(hostname)
+        if session is not None:
+            _tls_sessions.move_to_end(hostname)
+        return session
+
+def _enable_session_resumption(context):
+    import ssl
+    if not hasattr(ssl.SSLSocket, 'session'):
+        return context # Python < 3.6
+
+    if hasattr(context, 'sslsocket_class'): # Python 3.7+
+        class SessionSavingSSLSocket(context.sslsocket_class):
+            def close(self):
+                _save_session(self)
+                super(SessionSavingSSLSocket, self).close()
+        context.sslsocket_class = SessionSavingSSLSocket
+
+    _wrap_socket = context.wrap_socket
+    def wrap_socket(sock, *k, **kw):
+        hostname = kw.get('server_hostname')
+        if hostname is not None and kw.get('session') is None:
+            kw['session'] = _load_session(hostname)
+
+        ssl_sock = _wrap_socket(sock, *k, **kw)
+        _save_session(ssl_sock)
+        return ssl_sock
+    context.wrap_socket = wrap_socket
+    return context
+
+# Optionally, keep tunnelled sockets when connections close, and reuse them for new connections to
+# the same target (see httptoolkit_tunnel_pool for details):
+def _tunnel_pool_key(connection):
+    context = connection._context if isinstance(connection, _client.HTTPSConnection) else None
+    return (connection._tunnel_host, connection._tunnel_port, context)
+
+def _reuse_pooled_socket(connection):
+    sock = tunnel_pool.acquire(_tunnel_pool_key(connection))
+    if sock is None:
+        return False
+
+    import socket
+    timeout = connection.timeout
+    sock.settimeout(socket.getdefaulttimeout() if timeout is socket._GLOBAL_DEFAULT_TIMEOUT else timeout)
+    connection.sock = sock
+    return True
+
+def _at_request_boundary(connection):
+    # Only reusable if no request is in progress and no response is still being read. A response
+    # that's still open holds a reference to the socket (even if the connection has dropped it).
+    response = getattr(connection, '_HTTPConnection__response', None)
+    return (
+        getattr(connection, '_HTTPConnection__state', None) == _client._CS_IDLE and
+        (response is None or response.isclosed()) and
+        getattr(connection.sock, '_io_refs', 1) == 0
+    )
+
+def patch(client):
+    global _client
+    _client = client
+    HTTPConnection = client.HTTPConnection
+    HTTPSConnection = client.HTTPSConnection
+
+    # Redirect and then tunnel all plain HTTP connections, except those from libraries that we patch
+    # to use the proxy themselves (like urllib3):
+    _http_connection_init = HTTPConnection.__init__
+    @functools.wraps(_http_connection_init)
+    def _new_http_connection_init(self, host, port=None, *k, **kw):
+        if self._httptoolkit_native_proxy:
+            return _http_connection_init(self, host, port, *k, **kw)
+        _http_connection_init(self, _proxyHost, int(_proxyPort), *k, **kw)
+        self.set_tunnel(host, port)
+    HTTPConnection.__init__ = _new_http_connection_init
+    HTTPConnection._httptoolkit_native_proxy = False
+
+    # Redirect & tunnel HTTPS connections, and inject our CA certificate:
+    _https_connection_init = HTTPSConnection.__init__
+    @functools.wraps(_https_connection_init)
+    def _new_https_connection_init(self, host, port=None, *k, **kw):
+        context = None
+        if 'context' in kw:
+            context = kw.get('context')
+        elif len(k) > 7:
+            context = k[7]
+
+        if context == None:
+            context = kw['context'] = _get_default_context()
+        else:
+            _inject_ca(context)
+
+        _https_connection_init(self, _proxyHost, int(_proxyPort), *k, **kw)
+        self.set_tunnel(host, port)
+    HTTPSConnection.__init__ = _new_https_connection_init
+
+    if POOLING_ENABLED:
+        _http_connect = HTTPConnection.connect
+        @functools.wraps(_http_connect)
+        def _new_http_connect(self):
+            # HTTPS connections call this to open their raw socket, but pool their TLS sockets themselves
+            if isinstance(self, HTTPSConnection) or self._httptoolkit_native_proxy or not _reuse_pooled_socket(self):
+                _http_connect(self)
+        HTTPConnection.connect = _new_http_connect
+
+        _https_connect = HTTPSConnection.connect
+        @functools.wraps(_https_connect)
+        def _new_https_connect(self):
+            if not _reuse_pooled_socket(self):
+                _https_connect(self)
+        HTTPSConnection.connect = _new_https_connect
+
+        _http_close = HTTPConnection.close
+        @functools.wraps(_http_close)
+        def _new_http_close(self):
+            sock = self.sock
+            if sock is not None and self._tunnel_host and not self._httptoolkit_native_proxy and _at_request_boundary(self):
+                self.sock = None
+                tunnel_pool.release(_tunnel_pool_key(self), sock)
+            _http_close(self)
+        HTTPConnection.close = _new_http_close
+
+    if TIMING_ENABLED:
+        instrument_http_client(client, 'http.client')
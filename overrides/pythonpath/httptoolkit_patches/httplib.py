@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+import os, functools, threading, weakref
+
+from httptoolkit_timing import TIMING_ENABLED, instrument_http_client
+
+_httpProxy = os.environ['HTTP_PROXY']
+[_proxyHost, _proxyPort] = _httpProxy.split('://')[1].split(':')
+_certPath = os.environ['SSL_CERT_FILE']
+
+def _build_default_context():
+    import ssl
+    context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    context.options |= ssl.OP_NO_SSLv2
+    context.options |= ssl.OP_NO_SSLv3
+    return context
+
+# Loading & parsing our CA for every connection is expensive, so it's loaded into each context only
+# once: one shared context for connections that don't bring their own, and once per context for
+# those that do. Contexts are tracked weakly, so this doesn't keep them alive.
+_ca_lock = threading.Lock()
+_contexts_with_ca = weakref.WeakSet()
+_default_context = None
+
+def _get_default_context():
+    global _default_context
+    if _default_context is None:
+        with _ca_lock:
+            if _default_context is None:
+                context = _build_default_context()
+                context.load_verify_locations(_certPath)
+                _default_context = context
+    return _default_context
+
+def _inject_ca(context):
+    if context in _contexts_with_ca:
+        return
+
+    with _ca_lock:
+        if context in _contexts_with_ca:
+            return
+        context.load_verify_locations(_certPath)
+        try:
+            _contexts_with_ca.add(context)
+        except TypeError:
+            pass # Not weak-referenceable, so we'll just have to load the CA each time
+
+def patch(httplib):
+    HTTPConnection = httplib.HTTPConnection
+    HTTPSConnection = httplib.HTTPSConnection
+
+    # Redirect and then tunnel all plain HTTP connections:
+    _http_connection_init = HTTPConnection.__init__
+    @functools.wraps(_http_connection_init)
+    def _new_http_connection_init(self, host, port=None, *k, **kw):
+        _http_connection_init(self, _proxyHost, _proxyPort, *k, **kw)
+        self.set_tunnel(host, port)
+    HTTPConnection.__init__ = _new_http_connection_init
+
+    # Redirect & tunnel HTTPS connections, and inject our CA certificate:
+    _https_connection_init = HTTPSConnection.__init__
+    @functools.wraps(_https_connection_init)
+    def _new_https_connection_init(self, host, port=None, *k, **kw):
+        context = None
+        if 'context' in kw:
+            context = kw.get('context')
+        elif len(k) > 7:
+            context = k[7]
+
+        if context == None:
+            context = kw['context'] = _get_default_context()
+        else:
+            _inject_ca(context)
+
+        _https_connection_init(self, _proxyHost, _proxyPort, *k, **kw)
+        self.set_tunnel(host, port)
+    HTTPSConnection.__init__ = _new_https_connection_init
+
+    if TIMING_ENABLED:
+        instrument_http_client(httplib, 'httplib')
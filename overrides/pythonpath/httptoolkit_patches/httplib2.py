@@ -0,0 +1,30 @@
+from __future__ import absolute_import
+import os, functools
+
+from httptoolkit_timing import TIMING_ENABLED, timed_phase
+
+_certPath = os.environ['SSL_CERT_FILE']
+
+def patch(httplib2):
+    # Ensure all connections trust our cert:
+    _http_init = httplib2.Http.__init__
+    @functools.wraps(_http_init)
+    def _new_http_init(self, *k, **kw):
+        kList = list(k)
+        if len(kList) > 3:
+            kList[3] = _certPath
+        else:
+            kw['ca_certs'] = _certPath
+        _http_init(self, *kList, **kw)
+    httplib2.Http.__init__ = _new_http_init
+
+    if TIMING_ENABLED:
+        # httplib2's connections are http.client's (or httplib's), so they're already timed, but they
+        # connect (including any TLS) themselves, before sending each request. The connect is timed
+        # for the request that follows it:
+        for connection_class, phase in (
+            (httplib2.HTTPConnectionWithTimeout, 'connect'),
+            (httplib2.HTTPSConnectionWithTimeout, 'secure connect')
+        ):
+            connection_class._httptoolkit_client = 'httplib2'
+            connection_class.connect = timed_phase(connection_class.connect, phase)
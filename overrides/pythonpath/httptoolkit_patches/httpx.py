@@ -0,0 +1,206 @@
+import os, functools, threading, weakref
+from collections import OrderedDict
+
+# Sends all httpx traffic through the proxy, sharing CA-loaded SSL contexts and connection pools
+# across clients.
+#
+# Each httpx client normally builds its own SSL context (loading the CA bundle) and its own pool
+# for every transport, and httpx.get() & co create a new client each time. Here transports use one
+# shared context (per HTTP/2 setting, as httpcore sets ALPN on the context for each connection) and
+# share their pool with any other transport with the same configuration. Closing a client leaves
+# shared pools open for reuse. Async pools are only shared within a single asyncio event loop.
+#
+# Only the most recently used pools are kept: older ones are closed, as soon as no open client is
+# still using them.
+
+_proxyUrl = os.environ['HTTP_PROXY']
+_certPath = os.environ['SSL_CERT_FILE']
+
+# Maximum number of pools kept open for reuse (separately for each asyncio event loop):
+_MAX_SHARED_POOLS = 100
+
+_lock = threading.Lock()
+_ssl_contexts = {} # http2 enabled -> shared context
+_contexts_with_ca = weakref.WeakSet()
+_closing_pools = set() # Async pools being closed, referenced until done
+
+class _SharedPools(object):
+    # The most recently used pools, by transport config, and how many open transports use each
+    def __init__(self):
+        self.pools = OrderedDict() # transport config -> pool
+        self.users = {} # id(pool) -> open transports using it
+
+    def acquire(self, key, pool):
+        # Returns the pool to use for the config (the given one, if there's none yet), and any pools
+        # that were evicted to make room and are unused, so they should be closed
+        with _lock:
+            shared = self.pools.pop(key, pool)
+            self.pools[key] = shared
+            self.users[id(shared)] = self.users.get(id(shared), 0) + 1
+
+            unused = []
+            while len(self.pools) > _MAX_SHARED_POOLS:
+                _, evicted = self.pools.popitem(last=False)
+                if not self.users.get(id(evicted)):
+                    self.users.pop(id(evicted), None)
+                    unused.append(evicted)
+            return shared, unused
+
+    def release(self, pool):
+        # Returns whether the pool should be closed: if it's been evicted, and nothing else uses it
+        with _lock:
+            users = self.users.get(id(pool), 0) - 1
+            if users > 0:
+                self.users[id(pool)] = users
+                return False
+            self.users.pop(id(pool), None)
+            return not any(shared is pool for shared in self.pools.values())
+
+_shared_pools = _SharedPools()
+_shared_async_pools = weakref.WeakKeyDictionary() # event loop -> _SharedPools
+
+def _get_ssl_context(http2):
+    context = _ssl_contexts.get(http2)
+    if context is None:
+        with _lock:
+            context = _ssl_contexts.get(http2)
+            if context is None:
+                import ssl
+                context = ssl.create_default_context(cafile=_certPath)
+                _ssl_contexts[http2] = context
+    return context
+
+def _inject_ca(context):
+    if context in _contexts_with_ca:
+        return
+
+    with _lock:
+        if context in _contexts_with_ca:
+            return
+        context.load_verify_locations(_certPath)
+        try:
+            _contexts_with_ca.add(context)
+        except TypeError:
+            pass # Not weak-referenceable, so we'll just have to load the CA each time
+
+def _pools_for(transport):
+    # The pools that this transport can share, or None if it can't share any
+    if not transport._httptoolkit_async:
+        return _shared_pools
+
+    import asyncio
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None # Not in a running asyncio loop (e.g. created outside one, or using trio)
+    with _lock:
+        pools = _shared_async_pools.get(loop)
+        if pools is None:
+            pools = _shared_async_pools[loop] = _SharedPools()
+        return pools
+
+def _config_value(httpx, value):
+    # A hashable value for a transport setting, equal for settings that make equivalent pools
+    if hasattr(value, 'load_verify_locations'):
+        # Contexts (and the certificates loaded into them) are mutable, so they're only the same
+        # by identity. A pool keeps its context alive, so the ID isn't reused while it's shared.
+        return ('ssl context', id(value))
+    if isinstance(value, httpx.Limits):
+        return (value.max_connections, value.max_keepalive_connections, value.keepalive_expiry)
+    if isinstance(value, httpx.Proxy):
+        return str(value.url)
+    if isinstance(value, (list, tuple)):
+        return tuple(_config_value(httpx, item) for item in value)
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+def _transport_key(httpx, transport, kw):
+    return (type(transport),) + tuple(sorted((name, _config_value(httpx, value)) for name, value in kw.items()))
+
+def _close_unused(pools):
+    for pool in pools:
+        if hasattr(pool, 'aclose'):
+            import asyncio
+            task = asyncio.ensure_future(pool.aclose())
+            _closing_pools.add(task)
+            task.add_done_callback(_closing_pools.discard)
+        else:
+            pool.close()
+
+def _release_pool(transport):
+    # As a transport using a shared pool closes: returns whether its pool should be closed too
+    if transport._httptoolkit_released:
+        return False
+    transport._httptoolkit_released = True
+    return transport._httptoolkit_pools.release(transport._pool)
+
+def _patch_transport(httpx, transport_class, is_async):
+    transport_class._httptoolkit_async = is_async
+    transport_class._httptoolkit_shared_pool = False
+    transport_class._httptoolkit_pools = None
+    transport_class._httptoolkit_released = False
+
+    _transport_init = transport_class.__init__
+    @functools.wraps(_transport_init)
+    def _new_transport_init(self, verify=True, *k, **kw):
+        if len(k) > 5 or kw.get('uds') is not None:
+            # Positional config (very rare) or a unix socket: just make sure our CA is trusted
+            if hasattr(verify, 'load_verify_locations'):
+                _inject_ca(verify)
+            return _transport_init(self, verify, *k, **kw)
+
+        if verify is False:
+            pass
+        elif hasattr(verify, 'load_verify_locations'):
+            _inject_ca(verify)
+        elif len(k) > 0 or kw.get('cert') is not None:
+            # Client certificates are loaded into the context, so these need one of their own:
+            import ssl
+            verify = ssl.create_default_context(cafile=_certPath)
+        else:
+            verify = _get_ssl_context(bool(kw.get('http2')))
+
+        # Whatever proxy was configured, all traffic goes via ours (HTTP Toolkit handles upstream proxies):
+        kw['proxy'] = httpx.Proxy(url=_proxyUrl)
+
+        _transport_init(self, verify, *k, **kw)
+
+        pools = _pools_for(self)
+        if pools is None:
+            return
+        key = _transport_key(httpx, self, dict(kw, verify=verify, cert=k[0] if k else kw.get('cert')))
+        self._pool, unused = pools.acquire(key, self._pool)
+        self._httptoolkit_pools = pools
+        self._httptoolkit_shared_pool = True
+        _close_unused(unused)
+    transport_class.__init__ = _new_transport_init
+
+    # Shared pools stay open when a client closes, for the next client to reuse, unless they've been
+    # evicted from the shared pools (and this was the last client using them):
+    for method_name in ('close', '__exit__', 'aclose', '__aexit__'):
+        method = getattr(transport_class, method_name, None)
+        if method is None:
+            continue
+
+        if is_async and method_name in ('aclose', '__aexit__'):
+            def _wrap(method):
+                @functools.wraps(method)
+                async def _new_method(self, *k, **kw):
+                    if not self._httptoolkit_shared_pool or _release_pool(self):
+                        return await method(self, *k, **kw)
+                return _new_method
+        else:
+            def _wrap(method):
+                @functools.wraps(method)
+                def _new_method(self, *k, **kw):
+                    if not self._httptoolkit_shared_pool or _release_pool(self):
+                        return method(self, *k, **kw)
+                return _new_method
+        setattr(transport_class, method_name, _wrap(method))
+
+def patch(httpx):
+    _patch_transport(httpx, httpx.HTTPTransport, False)
+    _patch_transport(httpx, httpx.AsyncHTTPTransport, True)
@@ -0,0 +1,5 @@
+from __future__ import absolute_import
+import os
+
+def patch(stripe):
+    stripe.ca_bundle_path = os.environ['SSL_CERT_FILE']
@@ -0,0 +1,150 @@
+from __future__ import absolute_import
+import os, functools, threading, weakref
+
+# Sends all urllib3 traffic (and so all requests traffic) through the proxy, using one set of
+# connection pools and one CA-loaded SSL context for the whole process.
+#
+# Without this, every PoolManager (one or more per requests.Session, and a new session for every
+# requests.get() call) opens its own connections to the proxy, and urllib3 reloads the CA file for
+# every TLS connection. Here all managers share a single pool container: pools are keyed by their
+# full configuration, so managers with the same settings share connections (keeping keep-alive
+# across sessions) and any with different settings still get pools of their own.
+
+_proxyUrl = os.environ['HTTP_PROXY']
+_certPath = os.environ['SSL_CERT_FILE']
+
+# Maximum number of (target, configuration) pools kept open across the process:
+_MAX_SHARED_POOLS = 100
+
+# TLS settings that urllib3 applies to the context for each connection. Pools using any of these
+# need a context of their own, so they build one as normal (but trusting our CA).
+_PER_POOL_TLS_KEYS = (
+    'cert_file', 'key_file', 'key_password', 'assert_hostname', 'assert_fingerprint',
+    'ssl_version', 'ssl_minimum_version', 'ssl_maximum_version'
+)
+
+_lock = threading.Lock()
+_shared_pools = None
+_ssl_contexts = {} # verify mode -> shared context
+_contexts_with_ca = weakref.WeakSet()
+
+def _get_shared_pools(urllib3):
+    global _shared_pools
+    if _shared_pools is None:
+        with _lock:
+            if _shared_pools is None:
+                _shared_pools = urllib3._collections.RecentlyUsedContainer(
+                    _MAX_SHARED_POOLS,
+                    dispose_func=lambda pool: pool.close()
+                )
+    return _shared_pools
+
+def _get_ssl_context(urllib3, verify_mode):
+    # urllib3 sets verify_mode & check_hostname on the context for each connection, so connections
+    # only share a context with others using the same verification settings.
+    context = _ssl_contexts.get(verify_mode)
+    if context is None:
+        with _lock:
+            context = _ssl_contexts.get(verify_mode)
+            if context is None:
+                context = urllib3.util.ssl_.create_urllib3_context(cert_reqs=verify_mode)
+                context.load_verify_locations(_certPath)
+                _ssl_contexts[verify_mode] = context
+    return context
+
+def _inject_ca(context):
+    if context in _contexts_with_ca:
+        return
+
+    with _lock:
+        if context in _contexts_with_ca:
+            return
+        context.load_verify_locations(_certPath)
+        try:
+            _contexts_with_ca.add(context)
+        except TypeError:
+            pass # Not weak-referenceable, so we'll just have to load the CA each time
+
+def _https_pool_context(urllib3, request_context):
+    request_context = dict(request_context)
+    ssl_context = request_context.get('ssl_context')
+
+    if ssl_context is not None:
+        _inject_ca(ssl_context)
+    elif any(request_context.get(key) is not None for key in _PER_POOL_TLS_KEYS):
+        request_context['ca_certs'] = _certPath
+        request_context['ca_cert_dir'] = None
+        request_context['ca_cert_data'] = None
+        return request_context
+    else:
+        verify_mode = urllib3.util.ssl_.resolve_cert_reqs(request_context.get('cert_reqs'))
+        request_context['ssl_context'] = _get_ssl_context(urllib3, verify_mode)
+
+    # With a context that already trusts our CA, urllib3 doesn't need to load any CA files:
+    request_context['ca_certs'] = None
+    request_context['ca_cert_dir'] = None
+    request_context['ca_cert_data'] = None
+    return request_context
+
+def patch(urllib3):
+    PoolManager = urllib3.poolmanager.PoolManager
+    ProxyManager = urllib3.poolmanager.ProxyManager
+
+    # urllib3 connects via the proxy itself, so the http.client patch must leave its connections alone:
+    urllib3.connection.HTTPConnection._httptoolkit_native_proxy = True
+
+    def _proxy_manager_for(manager):
+        # Plain PoolManagers don't use a proxy, so their requests go through an equivalent
+        # ProxyManager instead (cheap, since all managers share pools anyway):
+        proxy_manager = getattr(manager, '_httptoolkit_proxy_manager', None)
+        if proxy_manager is None:
+            proxy_manager = ProxyManager(_proxyUrl, headers=manager.headers, **manager.connection_pool_kw)
+            manager._httptoolkit_proxy_manager = proxy_manager
+        return proxy_manager
+
+    _pool_manager_init = PoolManager.__init__
+    @functools.wraps(_pool_manager_init)
+    def _new_pool_manager_init(self, *k, **kw):
+        _pool_manager_init(self, *k, **kw)
+        self.pools = _get_shared_pools(urllib3)
+    PoolManager.__init__ = _new_pool_manager_init
+
+    # Whatever proxy was configured, all traffic goes via ours (HTTP Toolkit handles upstream proxies):
+    _proxy_manager_init = ProxyManager.__init__
+    @functools.wraps(_proxy_manager_init)
+    def _new_proxy_manager_init(self, proxy_url=None, *k, **kw):
+        _proxy_manager_init(self, _proxyUrl, *k, **kw)
+    ProxyManager.__init__ = _new_proxy_manager_init
+
+    _new_pool = PoolManager._new_pool
+    @functools.wraps(_new_pool)
+    def _new_new_pool(self, scheme, host, port, request_context=None):
+        if scheme == 'https':
+            request_context = _https_pool_context(urllib3, request_context or self.connection_pool_kw)
+        return _new_pool(self, scheme, host, port, request_context)
+    PoolManager._new_pool = _new_new_pool
+
+    _connection_from_host = PoolManager.connection_from_host
+    @functools.wraps(_connection_from_host)
+    def _new_connection_from_host(self, host, port=None, scheme='http', pool_kwargs=None):
+        if not isinstance(self, ProxyManager):
+            return _proxy_manager_for(self).connection_from_host(host, port, scheme, pool_kwargs)
+        return _connection_from_host(self, host, port, scheme, pool_kwargs)
+    PoolManager.connection_from_host = _new_connection_from_host
+
+    _urlopen = PoolManager.urlopen
+    @functools.wraps(_urlopen)
+    def _new_urlopen(self, method, url, redirect=True, **kw):
+        if not isinstance(self, ProxyManager):
+            return _proxy_manager_for(self).urlopen(method, url, redirect, **kw)
+        return _urlopen(self, method, url, redirect, **kw)
+    PoolManager.urlopen = _new_urlopen
+
+    # Pools are shared, so closing one manager (e.g. at the end of a requests session) mustn't
+    # close connections that other managers are using, or could reuse later:
+    _clear = PoolManager.clear
+    @functools.wraps(_clear)
+    def _new_clear(self):
+        if self.pools is not _shared_pools:
+            _clear(self)
+    PoolManager.clear = _new_clear
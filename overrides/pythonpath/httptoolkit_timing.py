@@ -0,0 +1,286 @@
+# Client-side timing for intercepted requests, reported to HTTP Toolkit over UDP.
+#
+# HTTP Toolkit only sees each request's timing from the proxy's side. The patched clients also
+# record what the client itself spent on each request: waiting for a pooled connection, connecting,
+# tunnelling & TLS through the proxy, sending, waiting for the response and reading its body.
+#
+# Records are buffered in memory and sent in batches from a background thread, so requests never
+# wait for reporting, and if nothing is listening they're just dropped. Each includes the client's
+# local port on its connection to the proxy, and its request number on that connection, so it can be
+# matched to the exchange that HTTP Toolkit captured (whose remotePort is the same port).
+#
+# Enabled when HTTP_TOOLKIT_TIMING_PORT is set. Records are sent to that UDP port, on the proxy's host.
+
+import os, atexit, collections, functools, json, socket, threading, time, weakref
+
+TIMING_PORT = os.environ.get('HTTP_TOOLKIT_TIMING_PORT')
+TIMING_ENABLED = bool(TIMING_PORT) and 'HTTP_PROXY' in os.environ
+
+FLUSH_INTERVAL = 0.1 # Seconds between batches
+MAX_BUFFERED_RECORDS = 1000 # Beyond this, the oldest unsent records are dropped
+MAX_DATAGRAM_SIZE = 8192
+
+# Monotonic & high resolution where available (i.e. Python 3):
+_clock = getattr(time, 'perf_counter', time.time)
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+class RequestTiming(object):
+    def __init__(self, client, method, url):
+        self.client = client
+        self.method = method
+        self.url = url
+        self.start_time = time.time()
+        self.started = _clock()
+        self.durations = {} # Phase name -> seconds
+        self.status = None
+        self.local_port = None
+        self.connection_request = None
+        self.request_sent = None
+        self.response_started = None
+        self._finished = False
+
+    def add(self, phase, started, ended=None):
+        # Adds the time since 'started' (a _clock() value) to the given phase
+        duration = (ended if ended is not None else _clock()) - started
+        self.durations[phase] = self.durations.get(phase, 0) + duration
+
+    def finish(self, error=None):
+        if self._finished:
+            return
+        self._finished = True
+
+        total = _clock() - self.started
+        record = {
+            'client': self.client,
+            'method': self.method,
+            'url': self.url,
+            'startTime': round(self.start_time * 1000, 3),
+            'totalDuration': _ms(total),
+            'phases': dict((phase, _ms(duration)) for phase, duration in self.durations.items())
+        }
+        if self.status is not None:
+            record['status'] = self.status
+        if self.local_port is not None:
+            record['localPort'] = self.local_port
+            record['connectionRequest'] = self.connection_request
+        if error is not None:
+            record['error'] = '%s: %s' % (type(error).__name__, error)
+        reporter.add(record)
+
+# Requests sent so far on each connection to the proxy (keyed weakly by socket, or similar):
+_connection_requests = weakref.WeakKeyDictionary()
+
+def count_connection_request(connection, timing, local_port):
+    try:
+        count = _connection_requests.get(connection, 0) + 1
+        _connection_requests[connection] = count
+    except TypeError:
+        return # Not weak-referenceable
+    timing.local_port = local_port
+    timing.connection_request = count
+
+class _Reporter(object):
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._records = collections.deque(maxlen=MAX_BUFFERED_RECORDS)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._socket = None
+        self._address = None
+
+    def add(self, record):
+        if self._pid != os.getpid():
+            self._reset() # Forked: the parent's thread doesn't exist here
+        self._records.append(record)
+
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='httptoolkit-timing')
+                    self._thread.daemon = True
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def _datagrams(self, records):
+        proxy_port = int(os.environ['HTTP_PROXY'].rsplit(':', 1)[1].strip('/'))
+        prefix = '{"proxyPort":%d,"pid":%d,"records":[' % (proxy_port, self._pid)
+        batch = []
+        size = len(prefix) + 2
+        for record in records:
+            serialized = json.dumps(record, separators=(',', ':'))
+            if batch and size + len(serialized) + 1 > MAX_DATAGRAM_SIZE:
+                yield prefix + ','.join(batch) + ']}'
+                batch = []
+                size = len(prefix) + 2
+            batch.append(serialized)
+            size += len(serialized) + 1
+        if batch:
+            yield prefix + ','.join(batch) + ']}'
+
+    def flush(self):
+        records = []
+        while True:
+            try:
+                records.append(self._records.popleft())
+            except IndexError:
+                break
+        if not records:
+            return
+
+        try:
+            if self._socket is None:
+                host = os.environ['HTTP_PROXY'].split('://')[-1].rsplit(':', 1)[0].strip('[]')
+                family, _, _, _, address = socket.getaddrinfo(host, int(TIMING_PORT), 0, socket.SOCK_DGRAM)[0]
+                self._socket = socket.socket(family, socket.SOCK_DGRAM)
+                self._socket.setblocking(False)
+                self._address = address
+
+            for datagram in self._datagrams(records):
+                self._socket.sendto(datagram.encode('utf-8'), self._address)
+        except (socket.error, ValueError):
+            pass # Timing is best-effort: never let it affect the app
+
+reporter = _Reporter()
+
+if TIMING_ENABLED:
+    atexit.register(reporter.flush)
+
+def _request_url(connection, url, is_https):
+    if '://' in url:
+        return url # Already absolute (e.g. sent to a proxy)
+    host = connection._tunnel_host or connection.host
+    port = connection._tunnel_port or connection.port
+    scheme = 'https' if is_https else 'http'
+    default_port = 443 if is_https else 80
+    if ':' in host:
+        host = '[%s]' % host
+    return '%s://%s%s%s' % (scheme, host, '' if port in (None, default_port) else ':%s' % port, url)
+
+def timed_phase(method, phase):
+    # Wraps a connection method, adding its duration to the phase of the connection's current request.
+    # Connections made before any request (as httplib2 does) are timed for the next request instead.
+    @functools.wraps(method)
+    def _timed_method(self, *k, **kw):
+        timing = self._httptoolkit_timing
+        if timing is None:
+            timing = self._httptoolkit_connect_timing
+            if timing is None:
+                timing = self._httptoolkit_connect_timing = RequestTiming(None, None, None)
+        started = _clock()
+        try:
+            return method(self, *k, **kw)
+        finally:
+            timing.add(phase, started)
+    return _timed_method
+
+def _split_connection_phases(timing):
+    durations = timing.durations
+    connect = durations.pop('connect', 0)
+    tunnel = durations.pop('tunnel', 0)
+    secure_connect = durations.pop('secure connect', 0)
+
+    if connect:
+        durations['tcp'] = connect - tunnel
+        if tunnel:
+            durations['tunnel'] = tunnel
+        if secure_connect:
+            durations['tls'] = secure_connect - connect
+    elif secure_connect:
+        # Connections that set up TLS without a separate plain connect (e.g. httplib2's)
+        durations['connect'] = secure_connect
+
+    # Everything else in request(), until now, was sending the request:
+    timing.add('send', timing.started)
+    durations['send'] -= max(connect, secure_connect)
+
+# Records the timing of each request made with http.client (or Python 2's httplib) connections.
+# Connection setup is split into TCP connect, CONNECT tunnel to the proxy, and TLS where possible.
+def instrument_http_client(client, client_name):
+    HTTPConnection = client.HTTPConnection
+    HTTPSConnection = client.HTTPSConnection
+    HTTPResponse = client.HTTPResponse
+
+    HTTPConnection._httptoolkit_client = client_name
+    HTTPConnection._httptoolkit_timing = None
+    HTTPConnection._httptoolkit_connect_timing = None # Phases of a connect made ahead of any request
+
+    # These phases include each other (connecting includes tunnelling, and each HTTPS connect
+    # includes a plain connect), and are separated out when the request is sent.
+    HTTPConnection._tunnel = timed_phase(HTTPConnection._tunnel, 'tunnel')
+    HTTPConnection.connect = timed_phase(HTTPConnection.connect, 'connect')
+    HTTPSConnection.connect = timed_phase(HTTPSConnection.connect, 'secure connect')
+
+    _request = HTTPConnection.request
+    @functools.wraps(_request)
+    def _timed_request(self, method, url, *k, **kw):
+        timing = RequestTiming(self._httptoolkit_client, method, _request_url(self, url, isinstance(self, HTTPSConnection)))
+        connect_timing = self._httptoolkit_connect_timing
+        if connect_timing is not None:
+            # Connected ahead of this request, so it's timed from the start of the connect:
+            self._httptoolkit_connect_timing = None
+            timing.start_time = connect_timing.start_time
+            timing.started = connect_timing.started
+            timing.durations = connect_timing.durations
+        self._httptoolkit_timing = timing
+        try:
+            _request(self, method, url, *k, **kw)
+        except Exception as e:
+            self._httptoolkit_timing = None
+            timing.finish(error=e)
+            raise
+
+        _split_connection_phases(timing)
+
+        timing.request_sent = _clock()
+        try:
+            count_connection_request(self.sock, timing, self.sock.getsockname()[1])
+        except (AttributeError, socket.error):
+            pass
+    HTTPConnection.request = _timed_request
+
+    _getresponse = HTTPConnection.getresponse
+    @functools.wraps(_getresponse)
+    def _timed_getresponse(self, *k, **kw):
+        timing = self._httptoolkit_timing
+        if timing is None:
+            return _getresponse(self, *k, **kw)
+        self._httptoolkit_timing = None
+
+        try:
+            response = _getresponse(self, *k, **kw)
+        except Exception as e:
+            timing.finish(error=e)
+            raise
+
+        timing.add('wait', timing.request_sent)
+        timing.status = response.status
+        if response.fp is None:
+            timing.finish() # No body, already complete
+        else:
+            timing.response_started = _clock()
+            response._httptoolkit_timing = timing
+        return response
+    HTTPConnection.getresponse = _timed_getresponse
+
+    # Responses close their connection once the body has been read (in Python 2, by closing):
+    HTTPResponse._httptoolkit_timing = None
+    body_complete_method = '_close_conn' if hasattr(HTTPResponse, '_close_conn') else 'close'
+    _body_complete = getattr(HTTPResponse, body_complete_method)
+    @functools.wraps(_body_complete)
+    def _timed_body_complete(self, *k, **kw):
+        timing = self._httptoolkit_timing
+        if timing is not None:
+            self._httptoolkit_timing = None
+            timing.add('body', timing.response_started)
+            timing.finish()
+        return _body_complete(self, *k, **kw)
+    setattr(HTTPResponse, body_complete_method, _timed_body_complete)
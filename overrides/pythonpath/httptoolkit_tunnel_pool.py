@@ -0,0 +1,105 @@
+# Opt-in pooling of tunnelled connections through the HTTP Toolkit proxy.
+#
+# Intercepted connections all go through the proxy: a TCP connect, then a CONNECT round trip, then
+# (for HTTPS) a TLS handshake with the proxy. Apps that create a fresh connection for every request
+# pay all of that every time, and multiply the proxy's handshake load. With pooling enabled, idle
+# tunnelled sockets are kept when their connection closes (if they're at a clean request boundary)
+# and handed to the next connection to the same target instead.
+#
+# Enabled by setting HTTP_TOOLKIT_POOL_TUNNELS=true. HTTP_TOOLKIT_POOL_IDLE_TIMEOUT (seconds) and
+# HTTP_TOOLKIT_POOL_MAX_PER_HOST configure eviction of idle sockets & the number kept per target.
+
+import os, select, threading, time
+
+def _env_number(name, default, parse):
+    try:
+        return parse(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+POOLING_ENABLED = os.environ.get('HTTP_TOOLKIT_POOL_TUNNELS', '').lower() in ('1', 'true', 'yes')
+# Node's default keep-alive timeout is 5 seconds, so by default we drop sockets just before the proxy would
+IDLE_TIMEOUT = _env_number('HTTP_TOOLKIT_POOL_IDLE_TIMEOUT', 4, float)
+MAX_IDLE_PER_HOST = _env_number('HTTP_TOOLKIT_POOL_MAX_PER_HOST', 4, int)
+
+def _is_alive(sock):
+    # An idle socket at a request boundary should have nothing to read. If it's readable, the proxy
+    # has closed it (or sent something unexpected), and either way it can't be reused.
+    try:
+        if hasattr(sock, 'pending') and sock.pending():
+            return False
+        readable, _, _ = select.select([sock], [], [], 0)
+        return not readable
+    except (ValueError, OSError, IOError, select.error):
+        return False
+
+def _close(sock):
+    try:
+        sock.close()
+    except Exception:
+        pass
+
+class TunnelPool(object):
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, max_idle_per_host=MAX_IDLE_PER_HOST):
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {} # key -> list of (released time, socket), oldest first
+        self._lock = threading.Lock()
+
+    def _evict_expired(self, now):
+        # Called with the lock held. Returns the sockets to close (outside the lock).
+        expired = []
+        for key in list(self._idle):
+            entries = self._idle[key]
+            while entries and now - entries[0][0] > self.idle_timeout:
+                expired.append(entries.pop(0)[1])
+            if not entries:
+                del self._idle[key]
+        return expired
+
+    def acquire(self, key):
+        """
+        Returns a live idle socket tunnelled to the key's target, or None.
+        """
+        to_close = []
+        sock = None
+        with self._lock:
+            to_close = self._evict_expired(time.time())
+            entries = self._idle.get(key)
+            while entries:
+                # Most recently used first, as it's the least likely to have been closed
+                _, candidate = entries.pop()
+                if _is_alive(candidate):
+                    sock = candidate
+                    break
+                to_close.append(candidate)
+            if entries is not None and not entries:
+                del self._idle[key]
+
+        for stale in to_close:
+            _close(stale)
+        return sock
+
+    def release(self, key, sock):
+        """
+        Keeps the socket for reuse, or closes it if there's no room.
+        """
+        now = time.time()
+        with self._lock:
+            to_close = self._evict_expired(now)
+            entries = self._idle.setdefault(key, [])
+            entries.append((now, sock))
+            if len(entries) > self.max_idle_per_host:
+                to_close.append(entries.pop(0)[1])
+
+        for stale in to_close:
+            _close(stale)
+
+    def clear(self):
+        with self._lock:
+            entries = [entry for key_entries in self._idle.values() for entry in key_entries]
+            self._idle.clear()
+        for _, sock in entries:
+            _close(sock)
+
+tunnel_pool = TunnelPool()
@@ -0,0 +1,9 @@
+# Python imports sitecustomize (if it's on the path) at startup, so this is our entrypoint for every
+# intercepted Python process. All it does is install our import hook: the modules we patch are only
+# loaded & patched if & when the process itself imports them.
+
+import os
+import httptoolkit_intercept
+
+httptoolkit_intercept.install()
+httptoolkit_intercept.load_next_sitecustomize(os.path.dirname(os.path.abspath(__file__)))
@@ -81,6 +81,8 @@ const packageApp = async () => {
     // only the relevant platform-specific NSS files.
     console.log('Building for Linux');
     await fs.mkdir(path.join(OUTPUT_DIR, 'nss'));
+    // Shared by each platform's createprecomplete.py:
+    await fs.copy(path.join(__dirname, 'nss', 'precomplete.py'), path.join(OUTPUT_DIR, 'nss', 'precomplete.py'));
     await fs.copy(path.join(__dirname, 'nss', 'linux'), path.join(OUTPUT_DIR, 'nss', 'linux'));
     await spawn(buildScript, ['linux'], { cwd: OUTPUT_DIR, stdio: 'inherit' });
 
@@ -0,0 +1,148 @@
+"""
+A small dependency-graph executor for orchestration steps.
+
+Steps declare the steps they depend on, and each step starts as soon as all of
+its dependencies have finished, so independent steps run concurrently on one
+asyncio loop. Coroutine functions run on the loop directly; plain functions
+(blocking subprocess & ADB work, mostly) run in worker threads.
+
+After a run, critical_path() returns the chain of steps that determined the
+total run time: shortening anything off that path won't make the run faster.
+"""
+
+import asyncio
+import time
+
+from run_trace import RunTrace
+
+
+class Step:
+    def __init__(self, name, func, depends_on=()):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.start = None
+        self.end = None
+        self.result = None
+        self.error = None
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+
+class Pipeline:
+    def __init__(self, trace=None):
+        self.trace = trace or RunTrace()
+        self.steps = {}
+
+    def add(self, name, func, depends_on=()):
+        if name in self.steps:
+            raise ValueError(f"Duplicate step {name}")
+        self.steps[name] = Step(name, func, depends_on)
+
+    def result(self, name):
+        return self.steps[name].result
+
+    def _ordered_steps(self):
+        """
+        Returns the steps in dependency order, raising ValueError for unknown
+        dependencies or cycles.
+        """
+        ordered = []
+        state = {}  # name -> 'visiting' | 'done'
+
+        def visit(step, path):
+            if state.get(step.name) == 'done':
+                return
+            if state.get(step.name) == 'visiting':
+                raise ValueError(f"Dependency cycle: {' -> '.join(path + [step.name])}")
+
+            state[step.name] = 'visiting'
+            for dependency in step.depends_on:
+                if dependency not in self.steps:
+                    raise ValueError(f"Step {step.name} depends on unknown step {dependency}")
+                visit(self.steps[dependency], path + [step.name])
+            state[step.name] = 'done'
+            ordered.append(step)
+
+        for step in self.steps.values():
+            visit(step, [])
+        return ordered
+
+    async def _run_step(self, step, tasks):
+        if step.depends_on:
+            await asyncio.gather(*(tasks[dependency] for dependency in step.depends_on))
+
+        with self.trace.span(step.name):
+            step.start = time.perf_counter()
+            try:
+                if asyncio.iscoroutinefunction(step.func):
+                    step.result = await step.func()
+                else:
+                    step.result = await asyncio.to_thread(step.func)
+            except Exception as e:
+                step.error = e
+                raise
+            finally:
+                step.end = time.perf_counter()
+        return step.result
+
+    async def run(self):
+        """
+        Runs every step, returning a dict of step name -> result.
+
+        If any step fails, all steps still running are cancelled and the first failure
+        is raised. Steps running in threads can't be interrupted, so they carry on in
+        the background until the blocking call they're in returns.
+        """
+        tasks = {}
+        for step in self._ordered_steps():
+            tasks[step.name] = asyncio.ensure_future(self._run_step(step, tasks))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+            # Dependents fail with their dependency's error too, so report the step that
+            # failed first:
+            failed = [step for step in self.steps.values() if step.error is not None]
+            if failed:
+                raise min(failed, key=lambda step: step.end).error
+            raise
+
+        return {name: step.result for name, step in self.steps.items()}
+
+    def critical_path(self):
+        """
+        Returns the finished steps that determined the total run time, in order: starting
+        from the step that finished last, repeatedly step back to whichever of its
+        dependencies finished last.
+        """
+        finished = [step for step in self.steps.values() if step.end is not None]
+        if not finished:
+            return []
+
+        path = [max(finished, key=lambda step: step.end)]
+        while True:
+            dependencies = [
+                self.steps[name] for name in path[-1].depends_on
+                if self.steps[name].end is not None
+            ]
+            if not dependencies:
+                break
+            path.append(max(dependencies, key=lambda step: step.end))
+        return list(reversed(path))
+
+    def print_critical_path(self):
+        path = self.critical_path()
+        if not path:
+            return
+        total = path[-1].end - path[0].start
+        steps = ' -> '.join(f'{step.name} ({step.duration:.1f}s)' for step in path)
+        print(f"Critical path ({total:.1f}s): {steps}")
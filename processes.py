@@ -0,0 +1,244 @@
+"""
+Asyncio-based management of the child processes used during a run (the HTTP
+Toolkit server, emulators, rootAVD, etc).
+
+All children's output is read on the event loop, rather than by threads per
+pipe, into one shared ring-buffered log. Each line is timestamped and tagged
+with the process it came from. Memory use is bounded, however much the
+children print, and the most recent output can be dumped when a run fails.
+
+Stopping processes escalates through a series of signals, waiting a little
+after each, and stop_all() shuts every child down in parallel. Processes that
+start children of their own (like the emulator, which runs QEMU) can be started
+in a process group of their own, so that stopping them signals the whole group,
+and only finishes once every process in it has exited.
+"""
+
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from collections import deque
+
+MAX_LOG_LINES = 5000
+MAX_LINE_LENGTH = 4096
+
+# (signal, seconds to wait for exit afterwards) stages for stopping processes. A
+# signal of None just waits, for processes that have been asked to exit some other way.
+DEFAULT_STOP_SIGNALS = (
+    (signal.SIGINT, 5),
+    (signal.SIGTERM, 5),
+    (getattr(signal, 'SIGKILL', signal.SIGTERM), 5)
+)
+
+
+def process_group_options():
+    """
+    Keyword arguments for subprocess/asyncio to start a process in a new process group.
+    """
+    if sys.platform == 'win32':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def signal_process_group(pgid, sig):
+    """
+    Sends a signal to every process in the group. Raises ProcessLookupError if the group
+    is empty.
+    """
+    if sys.platform == 'win32':
+        # Windows has no group signals, but can kill a process tree by its root's PID:
+        result = subprocess.run(['taskkill', '/F', '/T', '/PID', str(pgid)], capture_output=True)
+        if result.returncode != 0:
+            raise ProcessLookupError(pgid)
+    else:
+        os.killpg(pgid, sig)
+
+
+def process_group_running(pgid):
+    if sys.platform == 'win32':
+        return False  # The tree is killed together, with its root
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Exists, but signalling it isn't allowed
+    return True
+
+
+class RingLog:
+    """
+    A bounded log of (timestamp, source, line) entries, keeping only the most recent.
+    """
+
+    def __init__(self, max_lines=MAX_LOG_LINES, echo=True):
+        self.lines = deque(maxlen=max_lines)
+        self.echo = echo
+        self.dropped = 0
+
+    def append(self, source, line):
+        if len(line) > MAX_LINE_LENGTH:
+            line = line[:MAX_LINE_LENGTH] + '...'
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        entry = (time.time(), source, line)
+        self.lines.append(entry)
+        if self.echo:
+            print(f"{source}: {line}")
+
+    @staticmethod
+    def format(entry):
+        timestamp, source, line = entry
+        clock = time.strftime('%H:%M:%S', time.localtime(timestamp))
+        return f"{clock}.{int(timestamp % 1 * 1000):03d} [{source}] {line}"
+
+    def tail(self, count=50, source=None):
+        entries = [entry for entry in self.lines if source is None or entry[1] == source]
+        return [self.format(entry) for entry in entries[-count:]]
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as log_file:
+            if self.dropped:
+                log_file.write(f"({self.dropped} earlier lines dropped)\n")
+            for entry in self.lines:
+                log_file.write(self.format(entry) + '\n')
+
+
+class ManagedProcess:
+    def __init__(self, name, process, stop_signals, process_group=False):
+        self.name = name
+        self.process = process
+        self.stop_signals = stop_signals
+        self.process_group = process_group # Whether it leads a process group, with the same ID as its PID
+        self._readers = []
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    def running(self):
+        return self.process.returncode is None
+
+    def group_running(self):
+        """
+        Whether any process in its group (if it has one) is still running, even once it's
+        exited itself.
+        """
+        return self.process_group and process_group_running(self.pid)
+
+    async def wait(self, timeout=None):
+        """
+        Waits for the process to exit and its output to be fully read, returning its
+        exit code. Raises asyncio.TimeoutError if it's still running after timeout.
+        """
+        returncode = await asyncio.wait_for(self.process.wait(), timeout)
+        # Output normally ends with the process, but not if it left children holding its pipes:
+        await asyncio.wait(self._readers, timeout=1)
+        return returncode
+
+
+class ProcessManager:
+    def __init__(self, log=None):
+        self.log = log or RingLog()
+        self.processes = []
+
+    async def _read_output(self, source, stream):
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # Line over the stream buffer limit: take what there is, as a partial line
+                line = await stream.read(64 * 1024)
+            if not line:
+                return
+            self.log.append(source, line.decode('utf-8', errors='replace').rstrip('\r\n'))
+
+    async def start(self, name, *args, env=None, input=None, stop_signals=DEFAULT_STOP_SIGNALS, process_group=False):
+        """
+        Starts a child process, logging its output as it's printed. If input is given,
+        it's written to the process's stdin, which is then closed. With process_group,
+        it's started in a new process group, which is signalled as a whole to stop it.
+        """
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            env=env,
+            stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            **(process_group_options() if process_group else {})
+        )
+        managed = ManagedProcess(name, process, stop_signals, process_group)
+        managed._readers = [
+            asyncio.ensure_future(self._read_output(f'{name} stdout', process.stdout)),
+            asyncio.ensure_future(self._read_output(f'{name} stderr', process.stderr))
+        ]
+
+        if input is not None:
+            process.stdin.write(input)
+            try:
+                await process.stdin.drain()
+            except ConnectionResetError:
+                pass  # Exited before reading it all
+            process.stdin.close()
+
+        self.processes.append(managed)
+        return managed
+
+    async def _wait_stopped(self, managed, timeout):
+        # Exit is judged by the tracked PID (and for groups, the group ID it leads), never
+        # by looking for processes by name, which could match other runs' processes:
+        deadline = time.monotonic() + timeout
+        returncode = await managed.wait(timeout)
+        while managed.group_running():
+            if time.monotonic() > deadline:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(0.1)
+        return returncode
+
+    async def stop(self, managed, stop_signals=None):
+        """
+        Stops the process, working through its stop signals (or the given ones instead)
+        until it exits. For a process group, every process left in the group is signalled
+        & waited for, even if the process that started it has already exited.
+        """
+        if not managed.running() and not managed.group_running():
+            return managed.returncode
+
+        for sig, timeout in stop_signals or managed.stop_signals:
+            try:
+                if sig is None:
+                    pass
+                elif managed.process_group:
+                    signal_process_group(managed.pid, sig)
+                elif sig == getattr(signal, 'SIGKILL', None) or sys.platform == 'win32':
+                    managed.process.kill()
+                else:
+                    managed.process.send_signal(sig)
+            except ProcessLookupError:
+                return await managed.wait()  # Exited already
+
+            try:
+                return await self._wait_stopped(managed, timeout)
+            except asyncio.TimeoutError:
+                stage = signal.Signals(sig).name if sig is not None else 'waiting'
+                self.log.append(managed.name, f"(still running {timeout}s after {stage})")
+
+        self.log.append(managed.name, f"(could not be stopped, pid {managed.pid})")
+        return None
+
+    async def stop_all(self):
+        """
+        Stops every running child, all in parallel.
+        """
+        await asyncio.gather(*(
+            self.stop(managed)
+            for managed in self.processes
+            if managed.running() or managed.group_running()
+        ))
@@ -0,0 +1,236 @@
+"""
+Storage for extracted values, shared safely by concurrent capture workers.
+
+Results live in a SQLite database in WAL mode. Any number of processes can
+write at once, and readers never block writers. Each commit is synced to
+disk, and each (device_id, install_id) pair is stored only once. Results are
+indexed by capture time for range queries, and can be streamed back out as
+JSONL in the same format extracted_values.jsonl used.
+
+    python3 results_store.py import extracted_values.jsonl
+    python3 results_store.py export [--since 2024-01-01] [--until ...] [out.jsonl]
+    python3 results_store.py count
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+RESULTS_DB = 'results.db'
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS results (
+        id INTEGER PRIMARY KEY,
+        device_id TEXT NOT NULL,
+        install_id TEXT NOT NULL,
+        new_user INTEGER,
+        captured_at REAL NOT NULL,
+        run_id TEXT,
+        worker_id TEXT,
+        data TEXT NOT NULL,
+        UNIQUE (device_id, install_id)
+    );
+    CREATE INDEX IF NOT EXISTS results_captured_at ON results (captured_at);
+"""
+
+
+class ResultsImportError(ValueError):
+    pass
+
+
+class ResultsStore:
+    def __init__(self, path=RESULTS_DB, timeout=30):
+        # Autocommit mode, so each write is its own short transaction. Concurrent
+        # writers wait (up to timeout) for the write lock, rather than failing.
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=FULL')
+        self.connection.executescript(SCHEMA)
+
+    def add(self, values, captured_at=None, run_id=None, worker_id=None):
+        """
+        Stores a set of extracted values. Returns False, storing nothing, if a result
+        with the same device & install ids is already stored.
+        """
+        cursor = self.connection.execute(
+            """
+            INSERT OR IGNORE INTO results
+                (device_id, install_id, new_user, captured_at, run_id, worker_id, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                values['device_id_str'],
+                values['install_id_str'],
+                values.get('new_user'),
+                captured_at if captured_at is not None else time.time(),
+                run_id,
+                worker_id,
+                json.dumps(values)
+            )
+        )
+        return cursor.rowcount == 1
+
+    def get(self, device_id, install_id=None):
+        query = 'SELECT * FROM results WHERE device_id = ?'
+        params = [device_id]
+        if install_id is not None:
+            query += ' AND install_id = ?'
+            params.append(install_id)
+        row = self.connection.execute(query, params).fetchone()
+        return self._to_result(row) if row else None
+
+    def query(self, since=None, until=None, limit=None):
+        """
+        Yields results captured in [since, until) (as epoch seconds), oldest first.
+        Rows are read lazily, so this is safe for any number of results.
+        """
+        query = 'SELECT * FROM results WHERE 1=1'
+        params = []
+        if since is not None:
+            query += ' AND captured_at >= ?'
+            params.append(since)
+        if until is not None:
+            query += ' AND captured_at < ?'
+            params.append(until)
+        query += ' ORDER BY captured_at, id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        for row in self.connection.execute(query, params):
+            yield self._to_result(row)
+
+    def count(self, since=None, until=None):
+        query = 'SELECT COUNT(*) FROM results WHERE 1=1'
+        params = []
+        if since is not None:
+            query += ' AND captured_at >= ?'
+            params.append(since)
+        if until is not None:
+            query += ' AND captured_at < ?'
+            params.append(until)
+        return self.connection.execute(query, params).fetchone()[0]
+
+    def export_jsonl(self, output, since=None, until=None, metadata=False):
+        """
+        Writes results to the given file object as JSONL, one set of extracted values
+        per line (plus capture time, run & worker, if metadata is set). Returns the
+        number of lines written.
+        """
+        written = 0
+        for result in self.query(since, until):
+            line = result if metadata else result['values']
+            output.write(json.dumps(line) + '\n')
+            written += 1
+        return written
+
+    def import_jsonl(self, input_file):
+        """
+        Stores each set of values from a JSONL file (e.g. extracted_values.jsonl, or an
+        export with metadata, whose capture time, run & worker are kept), skipping
+        duplicates. Returns (added, skipped) counts. Raises a ResultsImportError for a
+        malformed line, importing nothing.
+        """
+        added = skipped = 0
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            for line_number, line in enumerate(input_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    result = json.loads(line)
+                    if 'values' in result:
+                        stored = self.add(
+                            result['values'],
+                            result.get('captured_at'),
+                            result.get('run_id'),
+                            result.get('worker_id')
+                        )
+                    else:
+                        stored = self.add(result)
+                except (ValueError, TypeError, KeyError) as e:
+                    raise ResultsImportError(f"Line {line_number} isn't a valid result: {e!r}") from None
+                if stored:
+                    added += 1
+                else:
+                    skipped += 1
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        return added, skipped
+
+    @staticmethod
+    def _to_result(row):
+        return {
+            'values': json.loads(row['data']),
+            'captured_at': row['captured_at'],
+            'run_id': row['run_id'],
+            'worker_id': row['worker_id']
+        }
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _timestamp(value):
+    """
+    Parses an ISO date/time or epoch seconds argument.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage stored capture results')
+    parser.add_argument('--db', default=RESULTS_DB)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help='Import results from a JSONL file')
+    import_parser.add_argument('path')
+
+    export_parser = commands.add_parser('export', help='Export results as JSONL')
+    export_parser.add_argument('path', nargs='?', help='Output file (default: stdout)')
+    export_parser.add_argument('--since', type=_timestamp)
+    export_parser.add_argument('--until', type=_timestamp)
+    export_parser.add_argument('--metadata', action='store_true', help='Include capture time, run & worker')
+
+    count_parser = commands.add_parser('count', help='Count stored results')
+    count_parser.add_argument('--since', type=_timestamp)
+    count_parser.add_argument('--until', type=_timestamp)
+
+    args = parser.parse_args()
+
+    with ResultsStore(args.db) as store:
+        if args.command == 'import':
+            with open(args.path) as input_file:
+                try:
+                    added, skipped = store.import_jsonl(input_file)
+                except ResultsImportError as e:
+                    sys.exit(f"Nothing imported: {e}")
+            print(f"Imported {added} results ({skipped} duplicates skipped)")
+        elif args.command == 'export':
+            if args.path:
+                with open(args.path, 'w') as output:
+                    written = store.export_jsonl(output, args.since, args.until, args.metadata)
+                print(f"Exported {written} results to {args.path}")
+            else:
+                store.export_jsonl(sys.stdout, args.since, args.until, args.metadata)
+        elif args.command == 'count':
+            print(store.count(args.since, args.until))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,355 +1,450 @@
+import asyncio
 import subprocess
-import threading
 import time
-import re
 import sys
 import traceback
 import signal  # Added import for signal handling
 import os
-import tempfile
 from concurrent.futures import ThreadPoolExecutor
-import json  # Add import for JSON handling
-
-from playwright.sync_api import sync_playwright
+from contextlib import ExitStack
+
+from httptoolkit_api import HTTPToolkitAPI, HTTPToolkitError, local_certificate_path
+from extraction import Extractor
+from har import HarWriter
+from emulator import PreparedImageCache, emulator_command, emulator_env, home_directory
+from emulator_console import EmulatorConsoleError, console_port, kill_emulator
+from device_readiness import wait_for_device_ready
+from adb_client import AdbClient, AdbConnectionPool
+from apk_install import ApkInstaller
+from run_trace import TRACE_DIR, RunTrace, current_span
+from pipeline import Pipeline
+from processes import DEFAULT_STOP_SIGNALS, ProcessManager
+from results_store import ResultsStore
+
+TIKTOK_APK = 'tiktok-v30.1.2.apk'
+TIKTOK_PACKAGE = 'com.zhiliaoapp.musically'
+DEVICE_REGISTER_URL = 'https://log16-normal-useast5.tiktokv.us/service/2/device_register/'
+
+# The values we're after, wherever they are in the device register response body:
+DEVICE_REGISTER_EXTRACTOR = Extractor({
+    'device_id_str': {'path': '$..device_id_str', 'type': 'str'},
+    'new_user': {'path': '$..new_user', 'type': 'int'},
+    'install_id_str': {'path': '$..install_id_str', 'type': 'str'}
+})
+
+# Set by loop.py when this runs as one of several concurrent workers, so that each run
+# uses its own emulator & proxy port, and leaves other workers' emulators alone:
+EMULATOR_PORT = int(os.environ['HTK_EMULATOR_PORT']) if os.environ.get('HTK_EMULATOR_PORT') else None
+PROXY_PORT = int(os.environ['HTK_PROXY_PORT']) if os.environ.get('HTK_PROXY_PORT') else None
+EMULATOR_SERIAL = f'emulator-{EMULATOR_PORT}' if EMULATOR_PORT else None
+
+ROOTAVD_SCRIPT = os.environ.get('HTK_ROOTAVD', '/Users/anirudhrahul/Tiktok-SSL-Pinning-Bypass/rootAVD/rootAVD.sh')
+
+# If set, all of each run's traffic is archived here, as <run id>.har (with large bodies
+# in a bodies directory shared by all runs):
+HAR_DIR = os.environ.get('HTK_HAR_DIR')
 
 class HTTPToolkitClient:
-    def __init__(self, url="https://app.httptoolkit.tech"):
-        self.url = url
+    def __init__(self, device=None, trace=None, proxy_port=None):
+        # An AdbDevice, used both to pick the device to intercept and to drive it. This
+        # can be set later, so the session can be started while the device boots.
+        self.device = device
+        self.trace = trace or RunTrace()
+        self.proxy_port = proxy_port
+        self.api = HTTPToolkitAPI()
+        self.archive_task = None
 
     def launch_and_intercept(self):
         """
-        Launch HTTP Toolkit and initiate Android interception using Playwright
-        with a fresh, cacheless browser session. Returns a dictionary of
+        Start an HTTP Toolkit proxy session via the local server's API, and
+        intercept the Android device through it. Returns a dictionary of
         extracted values.
         """
-        with sync_playwright() as p:
-            # Create a temporary directory for user data (not used directly since unsupported)
-            with tempfile.TemporaryDirectory() as user_data_dir:
-                browser = p.chromium.launch(
-                    headless=True
-                )
-                context = browser.new_context()
-                
-                # Handle dialogs by dismissing them and reloading the page
-                def handle_dialog(dialog):
-                    dialog.dismiss()
-                    dialog.page.reload()
-                
-                context.on("dialog", handle_dialog)
-                
-                page = context.new_page()
+        return asyncio.run(self._launch_and_intercept())
+
+    async def _launch_and_intercept(self):
+        await self.start_session()
+        try:
+            return await self.intercept()
+        finally:
+            await self.stop_session()
+
+    async def start_session(self):
+        with self.trace.span('session_start'):
+            await self.api.start_session(port=self.proxy_port)
+            print(f"Started HTTP Toolkit session on proxy port {self.api.proxy_port}")
+            if HAR_DIR:
+                await self.start_archive(HAR_DIR)
+
+    async def start_archive(self, har_dir):
+        """
+        Writes every exchange the session captures to a HAR file as it completes, until
+        the session stops, so the run's traffic can be reprocessed offline.
+        """
+        os.makedirs(har_dir, exist_ok=True)
+        stream = self.api.exchanges()
+        await stream.open()
+        writer = HarWriter(os.path.join(har_dir, f'{self.trace.run_id}.har'), bodies_dir='bodies')
+
+        async def archive():
+            try:
+                async for exchange in stream:
+                    await asyncio.to_thread(writer.write, exchange)
+            finally:
+                await stream.close()
+                writer.close()
+                print(f"Archived {writer.count} exchanges to {writer.path}")
+        self.archive_task = asyncio.create_task(archive())
+
+    async def stop_session(self):
+        if self.api.session_id is None:
+            return
+        with self.trace.span('session_stop'):
+            await self.api.stop_session()
+
+            # Stopping the session ends the archived stream:
+            if self.archive_task is not None:
                 try:
-                    # Navigate to HTTP Toolkit intercept page
-                    print("Navigating to HTTP Toolkit...")
-                    page.goto(self.url, wait_until="networkidle")
-
-                    # Wait for and click the Android ADB option
-                    print("Looking for Android ADB interceptor...")
-                    page.wait_for_selector('h1:text("Android Device via ADB")')
-                    page.click('h1:text("Android Device via ADB")')
-                    print("Clicked Android ADB interceptor")
-
-                    # Wait for and monitor the count value
-                    print("Waiting for count value to change...")
-                    max_attempts = 300  # ~30 seconds total
-                    attempt = 0
-                    
-                    while attempt < max_attempts:
-                        try:
-                            # Look for the count element and get its value
-                            count_element = page.locator('.count')
-                            current_count = count_element.text_content()
-                            
-                            # Click the tap coordinates
-                            subprocess.run([ADB, 'shell', 'input', 'tap', '1200', '1540'])
-                            print(f"Executed tap command, current count: {current_count}")
-                            
-                            # Wait a shorter time between attempts
-                            time.sleep(0.1)
-                            
-                            # Check if count changed to "2"
-                            if current_count != "2":
-                                print("Count value reached 2, proceeding...")
-                                break
-                                
-                            attempt += 1
-                        except Exception as e:
-                            print(f"Error during tap attempt: {e}")
-                            attempt += 1
-
-                    if attempt >= max_attempts:
-                        raise Exception("Failed to detect count change after maximum attempts")
-
-                    # Type the TikTok device register URL into the filter input
-                    print("Typing TikTok device register URL into filter...")
-                    page.wait_for_selector('.react-autosuggest__input')
-                    page.fill(
-                        '.react-autosuggest__input',
-                        'https://log16-normal-useast5.tiktokv.us/service/2/device_register/'
-                    )
-
-                    # Now that everything is set up, launch TikTok
-                    print("HTTP Toolkit setup complete. Opening TikTok app...")
-                    time.sleep(5)
-                    subprocess.run([ADB, 'shell', 'monkey', '-p', 'com.zhiliaoapp.musically', '1'])
-                    print("TikTok app launched.")
-
-                    # Wait for the specific request to appear
-                    print("Waiting for successful device register request...")
-                    selector = 'div[role="row"]:has-text("/service/2/device_register/"):has(div:text-is("200"))'
-                    page.wait_for_selector(selector)
-                    print("Found successful device register request!")
-
-                    # Click on the request row
-                    page.click(selector)
-
-                    # Wait for the request details to load
-                    print("Waiting for request details to load...")
-                    page.wait_for_selector('div.view-line:has-text("device_id_str")')
-                    page.wait_for_selector('div.view-line:has-text("new_user")')
-                    page.wait_for_selector('div.view-line:has-text("install_id_str")')
-
-                    # Extract values using regex
-                    print("Extracting values...")
-
-                    def extract_value(key):
-                        key_selector = f'div.view-line:has-text("{key}")'
-                        text = page.text_content(key_selector)
-                        match = re.search(f'"{key}":\\s*"?(\\d+)"?', text)
-                        return match.group(1) if match else None
-
-                    values = {
-                        'device_id_str': extract_value('device_id_str'),
-                        'new_user': int(extract_value('new_user')),
-                        'install_id_str': extract_value('install_id_str')
-                    }
-
-                    print("\nExtracted values:")
-                    print(f"Device ID: {values['device_id_str']}")
-                    print(f"New User: {values['new_user']}")
-                    print(f"Install ID: {values['install_id_str']}")
-
-                    # Append the extracted values to a JSONL file
-                    with open('extracted_values.jsonl', 'a') as jsonl_file:
-                        json.dump(values, jsonl_file)
-                        jsonl_file.write('\n')
-
-                    return values
-                finally:
-                    context.close()
-                    browser.close()
-
-def wait_for_device_ready(adb_path, timeout=60):
+                    await asyncio.wait_for(self.archive_task, timeout=10)
+                except (asyncio.TimeoutError, HTTPToolkitError, OSError) as e:
+                    print(f"Traffic archive may be incomplete: {e!r}")
+                self.archive_task = None
+
+    async def intercept(self):
+        """
+        Intercepts the device through the started session, launches TikTok, and
+        returns the values extracted from its device register response.
+        """
+        trace = self.trace
+        api = self.api
+        device_id = self.device.serial
+
+        # Subscribe before generating any traffic, so we can't miss the request. Only
+        # successful device register exchanges are sent to us by the server:
+        async with api.exchanges(url_prefix=DEVICE_REGISTER_URL, status=200) as exchanges:
+            with trace.span('interception'):
+                print(f"Activating Android ADB interception for {device_id}...")
+                result = await api.activate_interceptor('android-adb', {'deviceId': device_id})
+                if result.get('success') is False:
+                    raise HTTPToolkitError(f"Android ADB interception failed: {result.get('metadata')}")
+                print("Activated Android ADB interceptor")
+
+                # Accept the VPN connection prompt shown by the HTTP Toolkit app
+                await asyncio.sleep(1)
+                await asyncio.to_thread(self.device.tap, 1200, 1540)
+                print("Executed tap command to accept VPN prompt")
+
+            with trace.span('app_launch'):
+                # Now that everything is set up, launch TikTok
+                print("HTTP Toolkit setup complete. Opening TikTok app...")
+                await asyncio.sleep(5)
+                await asyncio.to_thread(self.device.start_app, TIKTOK_PACKAGE)
+                print("TikTok app launched.")
+
+            with trace.span('wait_for_exchange'):
+                # Wait for the specific request to appear
+                print("Waiting for successful device register request...")
+                exchange = await anext(exchanges, None)
+                if exchange is None:
+                    raise HTTPToolkitError("Exchange stream closed before the request was seen")
+                print("Found successful device register request!")
+
+        with trace.span('extraction'):
+            print("Extracting values...")
+            values = DEVICE_REGISTER_EXTRACTOR.extract(exchange)
+
+        print("\nExtracted values:")
+        print(f"Device ID: {values['device_id_str']}")
+        print(f"New User: {values['new_user']}")
+        print(f"Install ID: {values['install_id_str']}")
+
+        # Store the extracted values. Concurrent workers share the same store.
+        with ResultsStore() as store:
+            if not store.add(values, run_id=self.trace.run_id, worker_id=os.environ.get('HTK_WORKER_ID')):
+                print("These values were already captured previously.")
+
+        return values
+
+# Once the emulator has closed its console after a kill, it's exiting, so it's given a
+# little time to finish before its process group is signalled:
+EMULATOR_STOP_SIGNALS = ((None, 10),) + DEFAULT_STOP_SIGNALS[1:]
+
+async def start_emulator(processes, emulator_path, *args, env=None):
+    # In its own process group, so stopping it also stops its QEMU process, and
+    # never touches any other worker's emulator
+    return await processes.start(
+        'emulator',
+        *emulator_command(emulator_path, *args, port=EMULATOR_PORT),
+        env=env,
+        stop_signals=EMULATOR_STOP_SIGNALS,
+        process_group=True
+    )
+
+async def stop_emulator(processes, emu_proc, serial=None):
     """
-    Repeatedly checks for device readiness with a timeout.
-    Returns True if device becomes ready, False if timeout occurs.
+    Asks the emulator to shut down via its console, if its port is known, and then
+    waits for its process group to exit, signalling it if it doesn't in time.
     """
-    start_time = time.time()
-    while (time.time() - start_time) < timeout:
+    if not emu_proc.running() and not emu_proc.group_running():
+        return
+    print("Stopping emulator...")
+    stop_signals = DEFAULT_STOP_SIGNALS
+    port = EMULATOR_PORT or console_port(serial)
+    if port:
         try:
-            # Suppress output by using capture_output=True
-            result = subprocess.run(
-                [adb_path, 'shell', 'echo', 'Device is ready'],
-                capture_output=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                return True
-        except (subprocess.TimeoutExpired, Exception):
-            pass
-        time.sleep(0.5)
-    return False
-
-def run_npm_start():
-    """
-    Runs 'npm start' in a non-blocking call (Popen).
-    Returns the process object so it can be terminated later.
-    """
-    proc = subprocess.Popen(["npm", "start"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    
-    # Start threads to continuously read and print npm output
-    def log_output(pipe, prefix):
-        for line in iter(pipe.readline, b''):
-            print(f"{prefix}: {line.decode().strip()}")
-    
-    threading.Thread(target=log_output, args=(proc.stdout, "npm stdout"), daemon=True).start()
-    threading.Thread(target=log_output, args=(proc.stderr, "npm stderr"), daemon=True).start()
-    
-    return proc
-
-def kill_npm_proc(npm_proc):
+            await asyncio.to_thread(kill_emulator, port, timeout=10)
+            stop_signals = EMULATOR_STOP_SIGNALS
+        except (EmulatorConsoleError, OSError) as e:
+            print(f"Emulator didn't accept the kill command ({e}), it will be stopped by force")
+    await processes.stop(emu_proc, stop_signals)
+
+async def prepare_emulator_image(emulator_path, env, trace, processes):
     """
-    Attempts to gracefully stop the npm process, escalating signals as needed.
+    Cold boots a freshly wiped emulator, roots it with rootAVD, and shuts it down again.
     """
-    if not npm_proc or npm_proc.poll() is not None:
-        return  # Already stopped or invalid process
-    print("Attempting graceful npm termination by sending SIGINT (Ctrl+C)...")
+    print("Starting emulator with wipe data...")
+    emu_proc = await start_emulator(processes, emulator_path, '-no-snapshot', '-wipe-data', env=env)
+    serial = EMULATOR_SERIAL
+
     try:
-        npm_proc.send_signal(signal.SIGINT)
-        try:
-            npm_proc.wait(timeout=5)
-            print("npm process terminated gracefully with SIGINT.")
-        except subprocess.TimeoutExpired:
-            print("npm process didn't terminate gracefully after SIGINT, sending SIGTERM...")
-            npm_proc.terminate()
+        with trace.span('wipe_boot') as span:
+            # Wait for device to boot (rootAVD needs nothing more)
+            print("Waiting for emulator to start (checking ADB)...")
+            serial, span.details['stages'] = await asyncio.to_thread(
+                wait_for_device_ready,
+                ADB,
+                serial=EMULATOR_SERIAL,
+                stages=('transport', 'boot_completed')
+            )
+            print("Emulator is ready.")
+
+        with trace.span('root'):
+            # Root the emulator with timeout
+            print("Running rootAVD.sh script to root the emulator...")
+            rootavd_proc = await processes.start(
+                'rootAVD',
+                ROOTAVD_SCRIPT,
+                'system-images/android-31/google_apis/arm64-v8a/ramdisk.img',
+                input=b"1\n"
+            )
             try:
-                npm_proc.wait(timeout=5)
-                print("npm process terminated gracefully after SIGTERM.")
-            except subprocess.TimeoutExpired:
-                print("npm process didn't terminate gracefully after SIGTERM, sending SIGKILL...")
-                npm_proc.kill()
-                try:
-                    npm_proc.wait(timeout=5)
-                    print("npm process forcefully killed.")
-                except subprocess.TimeoutExpired:
-                    print("Warning: npm process seems stuck, trying system-level termination...")
-                    if sys.platform == "win32":
-                        subprocess.run(['taskkill', '/F', '/T', '/PID', str(npm_proc.pid)], capture_output=True)
-                    else:
-                        subprocess.run(['pkill', '-KILL', '-P', str(npm_proc.pid)], capture_output=True)
-    except Exception as e:
-        print(f"Error during npm process cleanup: {e}")
+                await rootavd_proc.wait(timeout=30)
+            except asyncio.TimeoutError:
+                await processes.stop(rootavd_proc)
+                raise Exception("rootAVD script timed out")
+    finally:
+        with trace.span('root_kill'):
+            print("Stopping emulator after root step...")
+            await stop_emulator(processes, emu_proc, serial)
+            if not EMULATOR_SERIAL:
+                await asyncio.to_thread(subprocess.run, [ADB, 'kill-server'])
+
+def install_tiktok(device, trace):
+    with trace.span('apk_install') as span:
+        print("Installing TikTok APK...")
+        span.details['result'] = ApkInstaller(device, trace=trace).install(TIKTOK_PACKAGE, TIKTOK_APK, '-r')
+        if span.details['result'] in ('cached', 'verified'):
+            print("TikTok is already installed.")
+        else:
+            print("TikTok installation complete.")
 
-def kill_emulator(adb_path):
+class CaptureRun:
     """
-    Attempts to stop the emulator gracefully, escalating if needed.
+    A single capture run, as a graph of steps: independent steps (starting the HTTP
+    Toolkit server & session, hashing the image inputs, booting the emulator) all
+    run concurrently, and each step starts as soon as the steps it needs are done.
     """
-    print("Stopping emulator (final cleanup)...")
-    try:
-        # Try normal emulator kill
-        subprocess.run([adb_path, 'emu', 'kill'], timeout=10)
-
-        # Wait and verify emulator is actually stopped
-        max_attempts = 10
-        for attempt in range(max_attempts):
-            result = subprocess.run([adb_path, 'devices'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if not any('emulator' in line for line in result.stdout.decode('utf-8').splitlines()):
-                print("Emulator successfully stopped.")
-                break
-            if attempt < max_attempts - 1:
-                print(f"Emulator still running, retry {attempt + 1}/{max_attempts}...")
-                time.sleep(2)
-                # Try force-stop on subsequent attempts
-                subprocess.run([adb_path, 'kill-server'])
-                time.sleep(1)
-                subprocess.run([adb_path, 'start-server'])
+
+    def __init__(self, android_home):
+        self.emulator_path = f"{android_home}/emulator/emulator"
+        self.android_home = android_home
+        self.env = emulator_env()
+
+        self.trace = RunTrace(os.environ.get('HTK_RUN_ID'))
+        self.client = HTTPToolkitClient(trace=self.trace, proxy_port=PROXY_PORT)
+        # Runs the server, emulator & rootAVD, collecting all their output in one log
+        self.processes = ProcessManager()
+
+        self.emu_proc = None
+        self.adb_pool = None
+        self.image_cache = None
+        self.image_lock = ExitStack()
+        self.restoring_snapshot = False
+
+        self.pipeline = Pipeline(self.trace)
+        self.pipeline.add('adb_server', self.start_adb_server)
+        self.pipeline.add('server', self.start_server)
+        self.pipeline.add('ca_certificate', self.wait_for_certificate)
+        self.pipeline.add('image_cache', self.check_image_cache, depends_on=['ca_certificate'])
+        self.pipeline.add('prepare_image', self.prepare_image, depends_on=['image_cache', 'adb_server'])
+        self.pipeline.add('emulator_boot', self.boot_emulator, depends_on=['prepare_image'])
+        self.pipeline.add('app_install', self.install_app, depends_on=['emulator_boot'])
+        self.pipeline.add('session', self.client.start_session, depends_on=['server'])
+        self.pipeline.add('capture', self.client.intercept, depends_on=['app_install', 'session'])
+
+    def start_adb_server(self):
+        # Configure ADB for headless operation
+        subprocess.run([ADB, 'start-server'])  # Ensure ADB server is running
+
+    async def start_server(self):
+        """
+        Starts the HTTP Toolkit server with npm, unless it's already running.
+        """
+        try:
+            return await self.client.api.version()
+        except HTTPToolkitError:
+            if EMULATOR_PORT:
+                # Workers share one server, so it must outlive any single run
+                print("Waiting for the shared HTTP Toolkit server to start...")
+            else:
+                print("Starting HTTP Toolkit server...")
+                await self.processes.start('npm', 'npm', 'start')
+        return await self.client.api.wait_until_available()
+
+    def wait_for_certificate(self, timeout=120):
+        """
+        Waits for the HTTP Toolkit CA certificate, which the server generates on its
+        first ever start (so this usually returns immediately).
+        """
+        cert_path = local_certificate_path()
+        deadline = time.time() + timeout
+        while not os.path.exists(cert_path):
+            if time.time() > deadline:
+                raise Exception(f"No HTTP Toolkit CA certificate found at {cert_path}")
+            time.sleep(0.5)
+        return cert_path
+
+    def check_image_cache(self):
+        self.image_cache = PreparedImageCache(self.android_home, TIKTOK_APK, self.pipeline.result('ca_certificate'))
+        self.restoring_snapshot = self.image_cache.is_ready()
+
+        if not self.restoring_snapshot:
+            # Another worker may be rebuilding the image already, in which case we can
+            # wait for it and then use its snapshot:
+            with self.trace.span('image_lock'):
+                self.image_lock.enter_context(self.image_cache.lock())
+            self.restoring_snapshot = self.image_cache.is_ready()
+            if self.restoring_snapshot:
+                self.image_lock.close()
+
+        return self.restoring_snapshot
+
+    async def prepare_image(self):
+        if not self.restoring_snapshot:
+            print("No prepared emulator snapshot matches the current inputs, rebuilding...")
+            await prepare_emulator_image(self.emulator_path, self.env, self.trace, self.processes)
+
+    async def boot_emulator(self):
+        span = current_span()
+        if self.restoring_snapshot:
+            # Root, reboot & APK install are all already baked into the snapshot
+            print(f"Restoring prepared emulator snapshot {self.image_cache.snapshot_name}...")
+            self.emu_proc = await start_emulator(
+                self.processes,
+                self.emulator_path,
+                *self.image_cache.restore_args(read_only=EMULATOR_PORT is not None),
+                env=self.env
+            )
+            span.details['boot'] = 'snapshot'
         else:
-            print("Warning: Could not verify emulator shutdown!")
-    except Exception as e:
-        print(f"Failed to kill emulator: {e}")
+            print("Restarting emulator (cold boot)...")
+            self.emu_proc = await start_emulator(
+                self.processes,
+                self.emulator_path,
+                *PreparedImageCache.rebuild_args(),
+                env=self.env
+            )
+            span.details['boot'] = 'cold'
 
-def home_directory():
-    """
-    Returns the user's HOME directory in a cross-platform way.
-    """
-    import os
-    return os.path.expanduser('~')
+        print("Waiting for emulator to be ready...")
+        serial, span.details['stages'] = await asyncio.to_thread(
+            wait_for_device_ready,
+            ADB,
+            serial=EMULATOR_SERIAL
+        )
+        print(f"Emulator {serial} ready.")
+
+        self.adb_pool = AdbConnectionPool(AdbClient(ADB))
+        self.client.device = self.adb_pool.device(serial)
+        return serial
+
+    def install_app(self):
+        if self.restoring_snapshot:
+            return
+
+        install_tiktok(self.client.device, self.trace)
+        with self.trace.span('snapshot_save'):
+            self.image_cache.save(ADB, self.client.device.serial)
+        self.image_lock.close()
+
+    async def run(self):
+        """
+        Runs every step, and then cleans up, returning the extracted values.
+        """
+        try:
+            return (await self.pipeline.run())['capture']
+        finally:
+            print("\nInitiating cleanup of background processes...")
+            try:
+                await self.client.stop_session()
+            except Exception as e:
+                print(f"Error stopping HTTP Toolkit session: {e}")
+
+            # Cleaning up stops the emulator, which also unblocks any steps still running
+            # in threads after a failure, so this must happen before the loop shuts down:
+            with self.trace.span('cleanup'):
+                await self.cleanup()
+            print("Cleanup complete.")
+
+    async def cleanup(self):
+        try:
+            self.image_lock.close()
+
+            if self.adb_pool:
+                await asyncio.to_thread(self.adb_pool.close)
+
+            if self.emu_proc:
+                # Other workers share the ADB server & run their own emulators, so
+                # only ours is stopped, by its console port & its process group:
+                serial = self.client.device.serial if self.client.device else EMULATOR_SERIAL
+                await stop_emulator(self.processes, self.emu_proc, serial)
+
+            # Stop everything else we started (the server, if it wasn't already
+            # running) in parallel, escalating through signals as needed:
+            await self.processes.stop_all()
+
+            if not EMULATOR_SERIAL:
+                await asyncio.to_thread(subprocess.run, [ADB, 'kill-server'], timeout=10)
+
+        except Exception as cleanup_error:
+            print(f"Error during cleanup: {cleanup_error}")
+
+    def report(self):
+        self.trace.print_summary()
+        self.pipeline.print_critical_path()
+        self.trace.details['critical_path'] = [step.name for step in self.pipeline.critical_path()]
+
+        trace_dir = os.environ.get('HTK_TRACE_DIR', TRACE_DIR)
+        trace_paths = self.trace.write(trace_dir)
+        print(f"Run trace written to {', '.join(trace_paths)}")
+
+        # The most recent output of every process we ran, for debugging failed runs
+        log_path = os.path.join(trace_dir, f'{self.trace.run_id}.log')
+        self.processes.log.dump(log_path)
+        print(f"Process output written to {log_path}")
 
 def run_all():
     """
     Main orchestration function
     """
     ANDROID_HOME = f"{sys.argv[1]}" if len(sys.argv) > 1 else f"{home_directory()}/Library/Android/sdk"
-    EMULATOR = f"{ANDROID_HOME}/emulator/emulator"
     global ADB
     ADB = f"{ANDROID_HOME}/platform-tools/adb"
 
-    npm_proc = None
-    emu_proc1 = None
-    emu_proc2 = None
-
+    capture_run = CaptureRun(ANDROID_HOME)
     try:
-        # Configure ADB for headless operation
-        subprocess.run([ADB, 'start-server'])  # Ensure ADB server is running
-        
-        print("Starting emulator with wipe data...")
-        env = {
-            **os.environ,
-            'ANDROID_EMULATOR_WAIT_TIME_BEFORE_KILL': '0',
-            'ANDROID_AVD_HOME': f"{home_directory()}/.android/avd",  # Explicit AVD path
-            'ANDROID_EMU_HEADLESS': '1'  # Enable headless mode
-        }
-        emu_proc1 = subprocess.Popen(
-            [
-                EMULATOR, '-no-snapshot', '-wipe-data', '@Pixel_XL_API_31-v2',
-                '-no-window',  # Run without a window
-                '-no-boot-anim',  # Disable boot animation
-                '-no-audio',      # Disable audio
-                '-gpu', 'swiftshader_indirect',
-                '-no-skin'        # Don't load device skin
-            ],
-            env=env
-        )
-
-        # Wait for device with timeout
-        print("Waiting for emulator to start (checking ADB)...")
-        if not wait_for_device_ready(ADB, timeout=60):
-            raise Exception("Emulator failed to start within timeout")
-        print("Emulator is ready.")
-
-        # 3. Root the emulator with timeout
-        print("Running rootAVD.sh script to root the emulator...")
-        rootavd_proc = subprocess.Popen(
-            ['/Users/anirudhrahul/Tiktok-SSL-Pinning-Bypass/rootAVD/rootAVD.sh', 
-             'system-images/android-31/google_apis/arm64-v8a/ramdisk.img'],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        try:
-            rootavd_proc.communicate(input=b"1\n", timeout=30)
-        except subprocess.TimeoutExpired:
-            rootavd_proc.kill()
-            raise Exception("rootAVD script timed out")
-
-        # 4. Kill emulator more aggressively
-        print("Stopping emulator after root step...")
-        subprocess.run([ADB, 'emu', 'kill'])
-        subprocess.run([ADB, 'kill-server'])
-        
-        # Wait for emulator to stop with shorter timeout
-        start_time = time.time()
-        while time.time() - start_time < 20:
-            result = subprocess.run([ADB, 'devices'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if not any('emulator' in line for line in result.stdout.decode('utf-8').splitlines()):
-                break
-            time.sleep(0.5)
+        result = asyncio.run(capture_run.run())
 
-        # 5. Restart emulator
-        print("Restarting emulator (no-snapshot)...")
-        emu_proc2 = subprocess.Popen(
-            [
-                EMULATOR, '-no-snapshot', '@Pixel_XL_API_31-v2',
-                '-no-window',     # Run without a window
-                '-no-boot-anim',
-                '-no-audio',
-                '-gpu', 'swiftshader_indirect',
-                '-no-skin'        # Don't load device skin
-            ],
-            env=env
-        )
-
-        # Wait for restart with timeout
-        print("Waiting for emulator to restart...")
-        if not wait_for_device_ready(ADB, timeout=60):
-            raise Exception("Emulator failed to restart within timeout")
-        print("Emulator restarted & ready.")
-
-        # 6. Install TikTok APK
-        print("Installing TikTok APK...")
-        while True:
-            install_proc = subprocess.run([ADB, 'install', 'tiktok-v30.1.2.apk'],
-                                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if install_proc.returncode == 0:
-                break
-            time.sleep(1)
-        print("TikTok installation complete.")
-
-        # 7. Launch Playwright interception
-        print("Launching Playwright interception...")
-        client = HTTPToolkitClient()
-        result = client.launch_and_intercept()
-        
         if result:
             print(f"\nSuccessful extraction:")
             print(f"Device ID: {result['device_id_str']}")
@@ -363,36 +458,7 @@ def run_all():
         raise  # Re-raise the exception to be caught by the outer try-catch
 
     finally:
-        print("\nInitiating cleanup of background processes...")
-        
-        # First kill npm process
-        # if npm_proc:
-        #     kill_npm_proc(npm_proc)
-            
-        # Then kill ADB and emulator processes
-        try:
-            # Kill ADB server first
-            subprocess.run([ADB, 'kill-server'], timeout=10)
-            
-            # Kill any remaining emulator processes
-            kill_emulator(ADB)
-            
-            # Force kill any remaining emulator processes
-            if emu_proc1 and emu_proc1.poll() is None:
-                emu_proc1.kill()
-            if emu_proc2 and emu_proc2.poll() is None:
-                emu_proc2.kill()
-                
-            # Additional cleanup for any stray emulator processes
-            if sys.platform == "win32":
-                subprocess.run('taskkill /F /IM emulator.exe', shell=True, capture_output=True)
-            else:
-                subprocess.run('pkill -9 emulator', shell=True, capture_output=True)
-                
-        except Exception as cleanup_error:
-            print(f"Error during cleanup: {cleanup_error}")
-
-        print("Cleanup complete.")
+        capture_run.report()
 
 
 if __name__ == "__main__":
@@ -401,6 +467,11 @@ if __name__ == "__main__":
        python run_all_in_python.py /path/to/android/sdk
     If you omit the path, it defaults to ~/Library/Android/sdk (common on macOS).
     """
+    def handle_sigterm(signum, frame):
+        # Unwind normally when stopped by a supervisor, so cleanup runs & the trace is written
+        raise SystemExit(128 + signum)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
     try:
         run_all()
     except KeyboardInterrupt:
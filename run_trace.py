@@ -0,0 +1,156 @@
+"""
+Per-run timing traces for the orchestration scripts.
+
+Each phase of a run is wrapped in a span, recording when it started, how long
+it took, how many retries it needed and how it ended. At the end of a run the
+trace is written out twice: as a plain JSON list of spans, and in Chrome's
+trace-event format, which can be loaded in chrome://tracing or
+https://ui.perfetto.dev to see a run's phases as a flame chart.
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_DIR = 'run_traces'
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def current_span():
+    """
+    Returns the innermost span open in the current context (thread or task), if any.
+    """
+    return _current_span.get()
+
+
+class Span:
+    def __init__(self, name, parent, start):
+        self.name = name
+        self.parent = parent
+        self.start = start
+        self.duration = None
+        self.retries = 0
+        self.outcome = None
+        self.error = None
+        self.details = {}
+        self.thread_id = threading.get_ident()
+
+    def to_json(self, run_start):
+        return {
+            'phase': self.name,
+            'parent': self.parent.name if self.parent else None,
+            'start': round(self.start - run_start, 6),
+            'duration': round(self.duration, 6) if self.duration is not None else None,
+            'retries': self.retries,
+            'outcome': self.outcome,
+            'error': self.error,
+            'details': self.details
+        }
+
+
+class RunTrace:
+    def __init__(self, run_id=None):
+        self.run_id = run_id or time.strftime('%Y%m%d-%H%M%S')
+        # Wall clock for reporting, monotonic clock for all durations
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = []
+        # Run-level information, included in both output formats
+        self.details = {}
+
+    @contextmanager
+    def span(self, name):
+        """
+        Times the enclosed block as a phase of the run. The yielded Span's retries,
+        outcome and details can be set along the way. The outcome defaults to 'ok',
+        or 'error' if the block raises ('cancelled' if it's an asyncio task that is
+        cancelled, e.g. because a concurrent step failed).
+        """
+        span = Span(name, _current_span.get(), time.perf_counter())
+        with self._lock:
+            self.spans.append(span)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except asyncio.CancelledError:
+            span.outcome = 'cancelled'
+            raise
+        except BaseException as e:
+            span.outcome = 'error'
+            span.error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.start
+            if span.outcome is None:
+                span.outcome = 'ok'
+            _current_span.reset(token)
+
+    def to_json(self):
+        return {
+            'run_id': self.run_id,
+            'started_at': self.started_at,
+            'details': self.details,
+            'spans': [span.to_json(self._start) for span in self.spans]
+        }
+
+    def to_chrome_trace(self):
+        thread_ids = {}
+        events = []
+        for span in self.spans:
+            # Chrome expects small integer thread ids
+            tid = thread_ids.setdefault(span.thread_id, len(thread_ids) + 1)
+            duration = span.duration if span.duration is not None else time.perf_counter() - span.start
+            events.append({
+                'name': span.name,
+                'cat': 'run',
+                'ph': 'X',
+                'ts': round((span.start - self._start) * 1e6),
+                'dur': round(duration * 1e6),
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': {
+                    'retries': span.retries,
+                    'outcome': span.outcome,
+                    'error': span.error,
+                    **span.details
+                }
+            })
+        return {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'run_id': self.run_id, 'started_at': self.started_at, **self.details}
+        }
+
+    def write(self, directory=TRACE_DIR):
+        """
+        Writes the trace as <run_id>.json and <run_id>.trace.json (Chrome format).
+        Returns the paths written.
+        """
+        os.makedirs(directory, exist_ok=True)
+        json_path = os.path.join(directory, f'{self.run_id}.json')
+        chrome_path = os.path.join(directory, f'{self.run_id}.trace.json')
+
+        with open(json_path, 'w') as trace_file:
+            json.dump(self.to_json(), trace_file, indent=2)
+        with open(chrome_path, 'w') as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
+        return json_path, chrome_path
+
+    def print_summary(self):
+        print("\nRun timing:")
+        for span in self.spans:
+            depth = 0
+            parent = span.parent
+            while parent:
+                depth += 1
+                parent = parent.parent
+            duration = f'{span.duration:8.2f}s' if span.duration is not None else '     ...'
+            retries = f' ({span.retries} retries)' if span.retries else ''
+            print(f"  {'  ' * depth}{span.name:<{32 - 2 * depth}} {duration}  {span.outcome}{retries}")
@@ -15,6 +15,8 @@ import { getCertExpiry, parseCert } from '../certificates';
 
 import * as Client from '../client/client-types';
 import { HttpClient } from '../client/http-client';
+import { ExchangeFilter, ExchangeStreams } from '../exchange-stream';
+import { ClientTimingCollector } from '../client-timing';
 
 const INTERCEPTOR_TIMEOUT = 1000;
 
@@ -25,6 +27,8 @@ export class ApiModel {
         private interceptors: _.Dictionary<Interceptor>,
         private getRuleParamKeys: () => string[],
         private httpClient: HttpClient,
+        private exchangeStreams: ExchangeStreams,
+        private clientTiming: ClientTimingCollector,
         private callbacks: {
             onTriggerUpdate: () => void,
             onTriggerShutdown: () => void
@@ -219,6 +223,14 @@ export class ApiModel {
         return this.httpClient.sendRequest(requestDefinition, requestOptions);
     }
 
+    streamExchanges(proxyPort: number, filter: ExchangeFilter) {
+        return this.exchangeStreams.subscribe(proxyPort, filter);
+    }
+
+    getClientTiming(proxyPort: number, since?: number) {
+        return this.clientTiming.getRecords(proxyPort, since);
+    }
+
 }
 
 const serializeError = (error: ErrorLike): {} => ({
@@ -13,6 +13,8 @@ import { ApiModel } from './api-model';
 import { exposeGraphQLAPI } from './graphql-api';
 import { exposeRestAPI } from './rest-api';
 import { HttpClient } from '../client/http-client';
+import { ExchangeStreams } from '../exchange-stream';
+import { ClientTimingCollector } from '../client-timing';
 
 /**
  * This file contains the core server API, used by the UI to query
@@ -43,6 +45,8 @@ export class HttpToolkitServerApi extends events.EventEmitter {
     constructor(
         config: HtkConfig,
         httpClient: HttpClient,
+        exchangeStreams: ExchangeStreams,
+        clientTiming: ClientTimingCollector,
         getRuleParamKeys: () => string[]
     ) {
         super();
@@ -120,6 +124,8 @@ export class HttpToolkitServerApi extends events.EventEmitter {
             interceptors,
             getRuleParamKeys,
             httpClient,
+            exchangeStreams,
+            clientTiming,
             {
                 onTriggerUpdate: () => this.emit('update-requested'),
                 onTriggerShutdown: () => shutdown(0, 'API call')
@@ -15,6 +15,7 @@ import { ErrorLike, StatusError } from '@httptoolkit/util';
 import { logError } from '../error-tracking';
 import { ApiModel } from './api-model';
 import * as Client from '../client/client-types';
+import { parseExchangeFilter, SerializedExchange } from '../exchange-stream';
 
 /**
  * This file exposes the API model via a REST-ish classic HTTP API.
@@ -155,6 +156,47 @@ export function exposeRestAPI(
             res.end();
         });
     }));
+
+    // Stream completed exchanges from a running proxy session, as newline-delimited JSON. Only
+    // exchanges matching the given urlPrefix, method, status, requestHeader & responseHeader
+    // (name or name:value, repeatable) filters are sent. Bodies are base64, still encoded.
+    server.get('/exchanges/:proxyPort/stream', handleErrors((req, res) => {
+        const proxyPort = parseInt(req.params.proxyPort, 10);
+        if (isNaN(proxyPort)) throw new StatusError(400, `Could not parse required proxy port: ${req.params.proxyPort}`);
+
+        const filter = parseExchangeFilter(req.query);
+        const exchangeStream = apiModel.streamExchanges(proxyPort, filter);
+
+        // If the client closes the connection, stop streaming to it:
+        res.on('close', () => exchangeStream.destroy());
+
+        res.writeHead(200, {
+            'content-type': 'application/x-ndjson'
+        });
+        // Send headers immediately, so the client knows the subscription is live:
+        res.flushHeaders();
+
+        exchangeStream.on('data', (exchange: SerializedExchange) => {
+            res.write(JSON.stringify(exchange) + '\n');
+        });
+
+        exchangeStream.on('end', () => res.end());
+    }));
+
+    // Client-side timing reported by intercepted clients of a proxy session. Each record's localPort
+    // & connectionRequest identify the matching exchange (by its request's remotePort, and order).
+    server.get('/client-timing/:proxyPort', handleErrors((req, res) => {
+        const proxyPort = parseInt(req.params.proxyPort, 10);
+        if (isNaN(proxyPort)) throw new StatusError(400, `Could not parse required proxy port: ${req.params.proxyPort}`);
+
+        let since: number | undefined;
+        if (req.query.since !== undefined) {
+            since = parseFloat(req.query.since as string);
+            if (isNaN(since)) throw new StatusError(400, `Could not parse since parameter: ${req.query.since}`);
+        }
+
+        res.send({ records: apiModel.getClientTiming(proxyPort, since) });
+    }));
 }
 
 function getProxyPort(stringishInput: any) {
@@ -0,0 +1,149 @@
+import * as _ from 'lodash';
+import * as dgram from 'dgram';
+
+import { CLIENT_TIMING_PORT } from './constants';
+
+/**
+ * This file collects client-side timing for intercepted requests, as reported by
+ * our Python overrides (see overrides/pythonpath/httptoolkit_timing.py).
+ *
+ * The proxy only sees each exchange from its own side. Intercepted clients can also
+ * report what they spent on each request (queueing for a connection, connecting,
+ * tunnelling & TLS, sending, waiting, and reading the body), which they send here
+ * in batches over UDP, so that reporting never blocks or fails their requests.
+ *
+ * Each record includes the client's local port on its connection to the proxy, and
+ * its request number on that connection, which matches the remotePort of the
+ * corresponding captured request, so the UI can line the two up.
+ */
+
+export interface ClientTimingRecord {
+    pid: number;
+    client: string;
+    method: string;
+    url: string;
+    startTime: number; // Epoch milliseconds
+    totalDuration: number; // Milliseconds
+    phases: _.Dictionary<number>; // Phase name -> milliseconds
+    status?: number;
+    localPort?: number;
+    connectionRequest?: number;
+    error?: string;
+}
+
+// Per proxy session, beyond this the oldest records are dropped:
+const MAX_RECORDS_PER_SESSION = 10000;
+
+const isOptionalNumber = (value: unknown) => value === undefined || _.isFinite(value);
+
+function parseRecord(pid: number, record: any): ClientTimingRecord | undefined {
+    if (
+        !_.isPlainObject(record) ||
+        !_.isString(record.client) ||
+        !_.isString(record.method) ||
+        !_.isString(record.url) ||
+        !_.isFinite(record.startTime) ||
+        !_.isFinite(record.totalDuration) ||
+        !_.isPlainObject(record.phases) ||
+        !_.every(record.phases, _.isFinite) ||
+        !isOptionalNumber(record.status) ||
+        !isOptionalNumber(record.localPort) ||
+        !isOptionalNumber(record.connectionRequest) ||
+        !(record.error === undefined || _.isString(record.error))
+    ) return undefined;
+
+    return {
+        pid,
+        ..._.pick(record, [
+            'client',
+            'method',
+            'url',
+            'startTime',
+            'totalDuration',
+            'phases',
+            'status',
+            'localPort',
+            'connectionRequest',
+            'error'
+        ])
+    } as ClientTimingRecord;
+}
+
+export class ClientTimingCollector {
+
+    private socket: dgram.Socket | undefined;
+    private records: { [proxyPort: number]: ClientTimingRecord[] } = {};
+
+    // Local only: remote clients (e.g. in Docker containers) can't report timing.
+    async start(port = CLIENT_TIMING_PORT, host = '127.0.0.1') {
+        const socket = dgram.createSocket('udp4');
+        socket.on('message', (message) => this.handleMessage(message));
+
+        await new Promise<void>((resolve, reject) => {
+            socket.once('error', reject);
+            socket.bind(port, host, () => {
+                socket.removeListener('error', reject);
+                resolve();
+            });
+        });
+
+        // Datagrams are best-effort, so socket errors later on are just logged:
+        socket.on('error', (error) => {
+            console.log('Client timing socket error:', error);
+        });
+
+        this.socket = socket;
+    }
+
+    get port() {
+        return this.socket?.address().port;
+    }
+
+    private handleMessage(message: Buffer) {
+        let envelope: any;
+        try {
+            envelope = JSON.parse(message.toString('utf8'));
+        } catch (e) {
+            return; // Not ours, or truncated - ignore it
+        }
+
+        if (
+            !_.isPlainObject(envelope) ||
+            !Number.isInteger(envelope.proxyPort) ||
+            !Number.isInteger(envelope.pid) ||
+            !Array.isArray(envelope.records)
+        ) return;
+
+        const records = envelope.records
+            .map((record: unknown) => parseRecord(envelope.pid, record))
+            .filter((record: ClientTimingRecord | undefined) => !!record);
+        if (!records.length) return;
+
+        const sessionRecords = (this.records[envelope.proxyPort] ??= []);
+        sessionRecords.push(...records);
+        if (sessionRecords.length > MAX_RECORDS_PER_SESSION) {
+            sessionRecords.splice(0, sessionRecords.length - MAX_RECORDS_PER_SESSION);
+        }
+    }
+
+    // Records reported by clients of the given proxy, in the order received, optionally only those
+    // for requests started after the given time (epoch ms).
+    getRecords(proxyPort: number, since?: number): ClientTimingRecord[] {
+        const records = this.records[proxyPort] ?? [];
+        return since === undefined
+            ? records.slice()
+            : records.filter((record) => record.startTime > since);
+    }
+
+    clear(proxyPort: number) {
+        delete this.records[proxyPort];
+    }
+
+    stop() {
+        this.records = {};
+        if (!this.socket) return;
+        this.socket.close();
+        this.socket = undefined;
+    }
+
+}
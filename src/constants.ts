@@ -38,4 +38,8 @@ export const MOCKTTP_ALLOWED_ORIGINS = [
 // use for dynamic ports.
 export const EPHEMERAL_PORT_RANGE = { startPort: 49152, endPort: 65535 } as const;
 
+// The localhost UDP port on which intercepted clients (currently our Python overrides) report
+// their own timing for each request. See client-timing.ts.
+export const CLIENT_TIMING_PORT = 45458;
+
 export const SERVER_VERSION = require('../package.json').version as string;
\ No newline at end of file
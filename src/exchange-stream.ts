@@ -0,0 +1,220 @@
+import * as _ from 'lodash';
+import * as stream from 'stream';
+import type {
+    Mockttp,
+    CompletedRequest,
+    CompletedResponse,
+    Headers
+} from 'mockttp';
+import type { ParsedQs } from 'qs';
+import { StatusError } from '@httptoolkit/util';
+
+/**
+ * This file streams completed exchanges from running proxy sessions to API clients
+ * (e.g. headless scripts, which don't have the UI's own Mockttp subscriptions).
+ *
+ * Each subscription has a filter, which is evaluated here as traffic arrives, so
+ * only matching exchanges are ever serialized & sent to the client. Requests that
+ * no subscriber could match aren't retained at all.
+ */
+
+export interface ExchangeFilter {
+    urlPrefix?: string;
+    method?: string;
+    status?: number;
+    // Header name -> required value (or undefined, to require only presence)
+    requestHeaders?: _.Dictionary<string | undefined>;
+    responseHeaders?: _.Dictionary<string | undefined>;
+}
+
+export interface SerializedExchange {
+    id: string;
+    request: {
+        protocol: string;
+        httpVersion: string;
+        method: string;
+        url: string;
+        headers: Headers;
+        body: string; // Base64, as captured (not decoded)
+        timingEvents: {};
+        tags: string[];
+    };
+    response: {
+        statusCode: number;
+        statusMessage: string;
+        headers: Headers;
+        body: string; // Base64, as captured (not decoded)
+        timingEvents: {};
+        tags: string[];
+    };
+}
+
+function parseHeaderPredicates(input: ParsedQs[string]) {
+    if (input === undefined) return undefined;
+
+    const values = _.castArray(input);
+    if (!values.every(_.isString)) {
+        throw new StatusError(400, 'Header filters must be strings, formatted as name or name:value');
+    }
+
+    return _.fromPairs(values.map((value) => {
+        const separatorIndex = value.indexOf(':');
+        return separatorIndex === -1
+            ? [value.trim().toLowerCase(), undefined]
+            : [
+                value.slice(0, separatorIndex).trim().toLowerCase(),
+                value.slice(separatorIndex + 1).trim()
+            ];
+    }));
+}
+
+export function parseExchangeFilter(query: ParsedQs): ExchangeFilter {
+    const { urlPrefix, method, status } = query;
+
+    if (urlPrefix !== undefined && !_.isString(urlPrefix)) {
+        throw new StatusError(400, 'The urlPrefix filter must be a single string');
+    }
+    if (method !== undefined && !_.isString(method)) {
+        throw new StatusError(400, 'The method filter must be a single string');
+    }
+
+    let statusCode: number | undefined;
+    if (status !== undefined) {
+        statusCode = parseInt(status as string, 10);
+        if (isNaN(statusCode)) throw new StatusError(400, `Could not parse status filter: ${status}`);
+    }
+
+    return {
+        urlPrefix,
+        method: method?.toUpperCase(),
+        status: statusCode,
+        requestHeaders: parseHeaderPredicates(query.requestHeader),
+        responseHeaders: parseHeaderPredicates(query.responseHeader)
+    };
+}
+
+function matchesHeaders(predicates: ExchangeFilter['requestHeaders'], headers: Headers) {
+    return _.every(predicates, (expectedValue, name) => {
+        const headerValue = headers[name];
+        if (headerValue === undefined) return false;
+        if (expectedValue === undefined) return true;
+        return _.castArray(headerValue).includes(expectedValue);
+    });
+}
+
+export function matchesRequest(filter: ExchangeFilter, request: CompletedRequest) {
+    return (!filter.urlPrefix || request.url.startsWith(filter.urlPrefix)) &&
+        (!filter.method || request.method === filter.method) &&
+        matchesHeaders(filter.requestHeaders, request.headers);
+}
+
+export function matchesResponse(filter: ExchangeFilter, response: CompletedResponse) {
+    return (filter.status === undefined || response.statusCode === filter.status) &&
+        matchesHeaders(filter.responseHeaders, response.headers);
+}
+
+const serializeExchange = (
+    request: CompletedRequest,
+    response: CompletedResponse
+): SerializedExchange => ({
+    id: request.id,
+    request: {
+        protocol: request.protocol,
+        httpVersion: request.httpVersion,
+        method: request.method,
+        url: request.url,
+        headers: request.headers,
+        body: request.body.buffer.toString('base64'),
+        timingEvents: request.timingEvents,
+        tags: request.tags
+    },
+    response: {
+        statusCode: response.statusCode,
+        statusMessage: response.statusMessage,
+        headers: response.headers,
+        body: response.body.buffer.toString('base64'),
+        timingEvents: response.timingEvents,
+        tags: response.tags
+    }
+});
+
+interface Subscriber {
+    filter: ExchangeFilter;
+    output: stream.Readable;
+}
+
+interface SessionStreams {
+    subscribers: Set<Subscriber>;
+    // Requests awaiting a response, with the subscribers whose request filters they matched
+    pendingRequests: Map<string, { request: CompletedRequest, subscribers: Subscriber[] }>;
+}
+
+export class ExchangeStreams {
+
+    private sessions: { [proxyPort: number]: SessionStreams } = {};
+
+    // Mockttp has no way to remove event listeners, so we listen once per session
+    // and fan out events to subscribers ourselves.
+    async register(proxyPort: number, mockServer: Mockttp) {
+        const session: SessionStreams = {
+            subscribers: new Set(),
+            pendingRequests: new Map()
+        };
+        this.sessions[proxyPort] = session;
+
+        await Promise.all([
+            mockServer.on('request', (request) => {
+                if (!session.subscribers.size) return;
+
+                const subscribers = [...session.subscribers]
+                    .filter(({ filter }) => matchesRequest(filter, request));
+                if (subscribers.length) {
+                    session.pendingRequests.set(request.id, { request, subscribers });
+                }
+            }),
+            mockServer.on('response', (response) => {
+                const pendingRequest = session.pendingRequests.get(response.id);
+                if (!pendingRequest) return;
+                session.pendingRequests.delete(response.id);
+
+                const matchingSubscribers = pendingRequest.subscribers.filter((subscriber) =>
+                    session.subscribers.has(subscriber) && // Not closed in the meantime
+                    matchesResponse(subscriber.filter, response)
+                );
+                if (!matchingSubscribers.length) return;
+
+                const exchange = serializeExchange(pendingRequest.request, response);
+                matchingSubscribers.forEach(({ output }) => output.push(exchange));
+            }),
+            mockServer.on('abort', (request) => {
+                session.pendingRequests.delete(request.id);
+            })
+        ]);
+    }
+
+    unregister(proxyPort: number) {
+        const session = this.sessions[proxyPort];
+        if (!session) return;
+
+        delete this.sessions[proxyPort];
+        session.pendingRequests.clear();
+        session.subscribers.forEach(({ output }) => output.push(null));
+    }
+
+    subscribe(proxyPort: number, filter: ExchangeFilter): stream.Readable {
+        const session = this.sessions[proxyPort];
+        if (!session) throw new StatusError(404, `No proxy session is running on port ${proxyPort}`);
+
+        const output = new stream.Readable({
+            objectMode: true,
+            read() {} // Data is pushed as exchanges complete
+        });
+        const subscriber = { filter, output };
+
+        session.subscribers.add(subscriber);
+        output.on('close', () => session.subscribers.delete(subscriber));
+
+        return output;
+    }
+
+}
@@ -33,6 +33,8 @@ import {
 } from './interceptors/docker/docker-interception-services';
 import { clearWebExtensionConfig, updateWebExtensionConfig } from './webextension';
 import { HttpClient } from './client/http-client';
+import { ExchangeStreams } from './exchange-stream';
+import { ClientTimingCollector } from './client-timing';
 
 const APP_NAME = "HTTP Toolkit";
 
@@ -85,7 +87,9 @@ function manageBackgroundServices(
         http: MockttpAdminPlugin,
         webrtc: MockRTCAdminPlugin
     }>,
-    httpsConfig: { certPath: string, certContent: string }
+    httpsConfig: { certPath: string, certContent: string },
+    exchangeStreams: ExchangeStreams,
+    clientTiming: ClientTimingCollector
 ) {
     let activeSessions = 0;
 
@@ -109,6 +113,11 @@ function manageBackgroundServices(
             console.log("Could not start Docker components:", error);
         });
 
+        exchangeStreams.register(httpProxyPort, http.getMockServer())
+        .catch((error) => {
+            console.log("Could not subscribe to exchanges:", error);
+        });
+
         updateWebExtensionConfig(sessionId, httpProxyPort, !!webrtc)
         .catch((error) => {
             console.log("Could not update WebRTC config:", error);
@@ -125,6 +134,8 @@ function manageBackgroundServices(
         });
 
         clearWebExtensionConfig(httpProxyPort);
+        exchangeStreams.unregister(httpProxyPort);
+        clientTiming.clear(httpProxyPort);
 
         // In some odd cases, the server can end up running even though all UIs & desktop have exited
         // completely. This can be problematic, as it leaves the server holding ports that HTTP Toolkit
@@ -212,7 +223,14 @@ export async function runHTK(options: {
         ruleParameters // Rule parameter dictionary
     });
 
-    manageBackgroundServices(standalone, httpsConfig);
+    const exchangeStreams = new ExchangeStreams();
+    const clientTiming = new ClientTimingCollector();
+    manageBackgroundServices(standalone, httpsConfig, exchangeStreams, clientTiming);
+
+    // Timing reports are optional extra detail, so failing to listen for them isn't fatal:
+    clientTiming.start().catch((error) => {
+        console.log("Could not start client timing collector:", error);
+    });
 
     await standalone.start({
         port: 45456,
@@ -226,6 +244,8 @@ export async function runHTK(options: {
     const apiServer = new HttpToolkitServerApi(
         { configPath, authToken: options.authToken, https: httpsConfig },
         new HttpClient(ruleParameters),
+        exchangeStreams,
+        clientTiming,
         () => standalone.ruleParameterKeys
     );
 
@@ -1,7 +1,7 @@
 import * as _ from 'lodash';
 import * as path from 'path';
 
-import { APP_ROOT } from '../../constants';
+import { APP_ROOT, CLIENT_TIMING_PORT } from '../../constants';
 import { getDockerPipePath } from '../docker/docker-proxy';
 
 const BIN_OVERRIDE_DIR = 'path';
@@ -132,6 +132,13 @@ export function getTerminalEnvVars(
         // Useful downstream to derive the raw paths elsewhere, e.g. in php.ini override config.
         'HTTP_TOOLKIT_OVERRIDE_PATH': overridePath,
 
+        // Where our overrides can report client-side request timing. Only local processes can reach
+        // the collector, so this is skipped for other targets (i.e. Docker containers).
+        ...(targetEnvConfig === undefined
+            ? { 'HTTP_TOOLKIT_TIMING_PORT': CLIENT_TIMING_PORT.toString() }
+            : {}
+        ),
+
         // Prepend our bin overrides into $PATH
         'PATH': `${binPath}${pathVarSeparator}${
             runtimeInherit ? runtimeInherit('PATH') : currentEnv.PATH
@@ -0,0 +1,90 @@
+import { expect } from 'chai';
+import * as dgram from 'dgram';
+import { delay } from '@httptoolkit/util';
+
+import { ClientTimingCollector } from '../../src/client-timing';
+
+describe("The client timing collector", () => {
+
+    let collector: ClientTimingCollector;
+    let client: dgram.Socket;
+
+    beforeEach(async () => {
+        collector = new ClientTimingCollector();
+        await collector.start(0);
+        client = dgram.createSocket('udp4');
+    });
+
+    afterEach(() => {
+        collector.stop();
+        client.close();
+    });
+
+    const send = async (message: string | object) => {
+        await new Promise<void>((resolve, reject) => client.send(
+            typeof message === 'string' ? message : JSON.stringify(message),
+            collector.port!,
+            '127.0.0.1',
+            (error) => error ? reject(error) : resolve()
+        ));
+        await delay(10);
+    };
+
+    const record = (overrides: object = {}) => ({
+        client: 'http.client',
+        method: 'GET',
+        url: 'https://example.com/',
+        startTime: 1000,
+        totalDuration: 12.5,
+        phases: { tcp: 1, tunnel: 0.5, tls: 3, send: 0.2, wait: 7.5, body: 0.3 },
+        status: 200,
+        localPort: 54321,
+        connectionRequest: 1,
+        ...overrides
+    });
+
+    it("should store reported records per proxy port", async () => {
+        await send({ proxyPort: 8000, pid: 123, records: [record(), record({ connectionRequest: 2 })] });
+        await send({ proxyPort: 8001, pid: 456, records: [record({ method: 'POST' })] });
+
+        const records = collector.getRecords(8000);
+        expect(records.length).to.equal(2);
+        expect(records[0]).to.deep.equal({ pid: 123, ...record() });
+        expect(records[1].connectionRequest).to.equal(2);
+
+        expect(collector.getRecords(8001).map(r => r.method)).to.deep.equal(['POST']);
+        expect(collector.getRecords(8002)).to.deep.equal([]);
+    });
+
+    it("should only return records started after the given time", async () => {
+        await send({ proxyPort: 8000, pid: 123, records: [
+            record({ startTime: 1000 }),
+            record({ startTime: 2000 })
+        ] });
+
+        expect(collector.getRecords(8000, 1500).map(r => r.startTime)).to.deep.equal([2000]);
+    });
+
+    it("should ignore invalid messages and records", async () => {
+        await send('not json');
+        await send({ proxyPort: 'abc', pid: 123, records: [record()] });
+        await send({ proxyPort: 8000, pid: 123, records: [
+            record({ url: undefined }),
+            record({ phases: { tcp: 'slow' } }),
+            record({ url: 'https://example.com/valid', unexpected: 'field' })
+        ] });
+
+        const records = collector.getRecords(8000);
+        expect(records.length).to.equal(1);
+        expect(records[0].url).to.equal('https://example.com/valid');
+        expect(records[0]).not.to.have.property('unexpected');
+    });
+
+    it("should drop records when a session is cleared", async () => {
+        await send({ proxyPort: 8000, pid: 123, records: [record()] });
+        collector.clear(8000);
+
+        expect(collector.getRecords(8000)).to.deep.equal([]);
+    });
+
+});
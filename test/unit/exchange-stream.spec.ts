@@ -0,0 +1,97 @@
+import { expect } from 'chai';
+import * as mockttp from 'mockttp';
+import fetch from 'node-fetch';
+import { delay } from '@httptoolkit/util';
+
+import { ExchangeStreams, parseExchangeFilter } from '../../src/exchange-stream';
+
+describe("The exchange streaming API", () => {
+
+    const mockServer = mockttp.getLocal();
+    let exchangeStreams: ExchangeStreams;
+
+    beforeEach(async () => {
+        await mockServer.start();
+        exchangeStreams = new ExchangeStreams();
+        await exchangeStreams.register(mockServer.port, mockServer);
+
+        await mockServer.forGet('/missing').thenReply(404, 'Not found');
+        await mockServer.forAnyRequest().thenReply(200, 'Mock response', {
+            'custom-header': 'custom-value'
+        });
+    });
+
+    afterEach(async () => {
+        exchangeStreams.unregister(mockServer.port);
+        await mockServer.stop();
+    });
+
+    it("should stream completed exchanges", async () => {
+        const exchanges: any[] = [];
+        const exchangeStream = exchangeStreams.subscribe(mockServer.port, {});
+        exchangeStream.on('data', (exchange) => exchanges.push(exchange));
+
+        await fetch(mockServer.urlFor('/path'), { method: 'POST', body: 'Request body' });
+        await delay(10);
+
+        expect(exchanges.length).to.equal(1);
+        expect(exchanges[0].request.method).to.equal('POST');
+        expect(exchanges[0].request.url).to.equal(mockServer.urlFor('/path'));
+        expect(Buffer.from(exchanges[0].request.body, 'base64').toString()).to.equal('Request body');
+        expect(exchanges[0].response.statusCode).to.equal(200);
+        expect(Buffer.from(exchanges[0].response.body, 'base64').toString()).to.equal('Mock response');
+    });
+
+    it("should only stream exchanges matching the filter", async () => {
+        const exchanges: any[] = [];
+        const exchangeStream = exchangeStreams.subscribe(mockServer.port, parseExchangeFilter({
+            urlPrefix: mockServer.urlFor('/match'),
+            method: 'get',
+            status: '200',
+            requestHeader: 'x-test:matching',
+            responseHeader: 'custom-header'
+        }));
+        exchangeStream.on('data', (exchange) => exchanges.push(exchange));
+
+        const headers = { 'x-test': 'matching' };
+        await fetch(mockServer.urlFor('/match/1'), { headers });
+        await fetch(mockServer.urlFor('/match/2'), { method: 'POST', headers });
+        await fetch(mockServer.urlFor('/match/3'), { headers: { 'x-test': 'other' } });
+        await fetch(mockServer.urlFor('/other'), { headers });
+        await delay(10);
+
+        expect(exchanges.map(e => e.request.url)).to.deep.equal([
+            mockServer.urlFor('/match/1')
+        ]);
+    });
+
+    it("should filter on response status", async () => {
+        const exchanges: any[] = [];
+        const exchangeStream = exchangeStreams.subscribe(mockServer.port, { status: 404 });
+        exchangeStream.on('data', (exchange) => exchanges.push(exchange));
+
+        await fetch(mockServer.urlFor('/path'));
+        await fetch(mockServer.urlFor('/missing'));
+        await delay(10);
+
+        expect(exchanges.map(e => e.response.statusCode)).to.deep.equal([404]);
+    });
+
+    it("should end the stream when the session is unregistered", async () => {
+        const exchangeStream = exchangeStreams.subscribe(mockServer.port, {});
+        const ended = new Promise((resolve) => exchangeStream.on('end', resolve));
+        exchangeStream.resume();
+
+        exchangeStreams.unregister(mockServer.port);
+        await ended;
+    });
+
+    it("should reject subscriptions for unknown sessions", () => {
+        expect(() => exchangeStreams.subscribe(1, {})).to.throw('No proxy session is running on port 1');
+    });
+
+    it("should reject invalid filters", () => {
+        expect(() => parseExchangeFilter({ status: 'abc' })).to.throw('Could not parse status filter');
+    });
+
+});